@@ -0,0 +1,7 @@
+"""Offline benchmarks for the backend. Run from backend/ as python -m benchmarks.<name>."""
+import os
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
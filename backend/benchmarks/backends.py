@@ -0,0 +1,101 @@
+"""Benchmark the storage operations on each storage backend.
+
+Runs the same storage calls (create and load a chat, add a message, list a
+user's chats, a token lookup past the auth cache) against memory, sqlite,
+redis (the native protocol, against the RESP fake or --redis-url) and
+upstash (the REST fake). --latency adds a per-request delay to the two
+network fakes, e.g. 0.001 for a same-region hop.
+
+    cd backend
+    python -m benchmarks.backends [--repeat 200] [--latency 0.001] [--json]
+    python -m benchmarks.backends --backends redis --redis-url redis://localhost:6379/15
+"""
+import argparse
+import json
+import statistics
+import time
+
+from django.conf import settings
+
+from chat.services import storage
+from .fakes import use_fakes
+from .stats import percentile
+
+BACKENDS = ('memory', 'sqlite', 'redis', 'upstash')
+
+
+def _measure(backend: str, op: str, fn, repeat: int) -> dict:
+    fn()  # warm connections
+    latencies = []
+    counter = storage.count_round_trips()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {
+        'backend': backend,
+        'op': op,
+        'p50_ms': round(percentile(latencies, 0.5), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'round_trips': round(counter.count / repeat, 2),
+    }
+
+
+def _ops() -> dict:
+    email = 'bench-backends@example.com'
+    user = storage.create_user(email)
+    chat = storage.create_chat(email, 'How should I plan my runs around a week of travel?')
+    storage.update_chat(chat['id'], [
+        storage._new_message('user' if i % 2 == 0 else 'assistant', f'Message {i} about training plans. ' * 8)
+        for i in range(50)
+    ])
+    for i in range(20):
+        storage.create_chat(email, f'Chat {i}')
+
+    def get_user_by_token():
+        storage.clear_token_cache()
+        storage.get_user_by_token(user['token'])
+
+    # Reads first, before the writes grow the chat and the user's list
+    return {
+        'get_chat_50': lambda: storage.get_chat(chat['id']),
+        'list_user_chats': lambda: storage.list_user_chats(email),
+        'get_user_by_token': get_user_by_token,
+        'create_chat': lambda: storage.create_chat(email, 'Another question'),
+        'add_message': lambda: storage.add_message(chat['id'], 'user', 'One more question about shoes.'),
+    }
+
+
+def run(backends, repeat: int, latency: float, redis_url: str | None = None) -> list:
+    results = []
+    for backend in backends:
+        with use_fakes(redis_latency=latency, storage_backend=backend):
+            if backend == 'redis' and redis_url:
+                settings.REDIS_URL = redis_url
+                storage._client = None
+            for op, fn in _ops().items():
+                results.append(_measure(backend, op, fn, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added per request by the network fakes')
+    parser.add_argument('--backends', default=','.join(BACKENDS), help='comma-separated subset of ' + ', '.join(BACKENDS))
+    parser.add_argument('--redis-url', help='run the redis backend against this server instead of the fake')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.backends.split(','), args.repeat, args.latency, args.redis_url)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"backend":<9} {"op":<18} {"p50 ms":>8} {"p95 ms":>8} {"mean ms":>8} {"trips":>6}')
+    for r in results:
+        print(f'{r["backend"]:<9} {r["op"]:<18} {r["p50_ms"]:>8} {r["p95_ms"]:>8} {r["mean_ms"]:>8} {r["round_trips"]:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark the stored value codec on chat-shaped payloads.
+
+For each payload (single messages of several sizes, a whole chat's worth of
+messages, an inline user record) and each encoding — plain JSON, JSON +
+zlib, and msgpack + zlib when msgpack is installed — reports the stored
+size, the compression ratio against JSON, and encode/decode time.
+
+    cd backend
+    python -m benchmarks.codec [--repeat 2000] [--json]
+"""
+import argparse
+import json
+import random
+import time
+
+from django.conf import settings
+
+from chat.services import codec, storage
+
+_SENTENCES = [
+    'Here is a step-by-step plan you can adapt to your schedule.',
+    'The main trade-off is between latency and cost, so measure both before deciding.',
+    'If you are training for a marathon, keep most runs at an easy, conversational pace.',
+    'You can reuse the same connection pool across requests instead of reconnecting.',
+    'Start with a small budget and increase it once you see what actually works.',
+    'A good rule of thumb is to pack layers rather than one heavy jacket.',
+    'In Python, a generator lets you stream results without building the whole list.',
+    'Check the documentation for the exact limits, since they change between plans.',
+]
+
+_CODE = '''```python
+def stream_reply(messages):
+    for chunk in client.chat.completions.create(model=MODEL, messages=messages, stream=True):
+        delta = chunk.choices[0].delta.content
+        if delta:
+            yield delta
+```
+'''
+
+
+def _reply(rng: random.Random, paragraphs: int, code: bool = False) -> str:
+    parts = []
+    for i in range(paragraphs):
+        if i and i % 2 == 0:
+            parts.append('\n'.join(f'{n}. {rng.choice(_SENTENCES)}' for n in range(1, 4)))
+        else:
+            parts.append(' '.join(rng.choice(_SENTENCES) for _ in range(rng.randint(2, 5))))
+        if code and i == 1:
+            parts.append(_CODE)
+    return '\n\n'.join(parts)
+
+
+def payloads() -> dict:
+    rng = random.Random(18)
+    messages = []
+    for i in range(40):
+        if i % 2 == 0:
+            messages.append(storage._new_message('user', rng.choice(_SENTENCES)))
+        else:
+            messages.append(storage._new_message('assistant', _reply(rng, rng.randint(1, 6), code=i % 6 == 1)))
+    return {
+        'user_message': storage._new_message('user', 'How should I plan my runs around a week of travel?'),
+        'reply_short': storage._new_message('assistant', _reply(rng, 1)),
+        'reply_medium': storage._new_message('assistant', _reply(rng, 4)),
+        'reply_long_code': storage._new_message('assistant', _reply(rng, 12, code=True)),
+        'chat_40_messages': messages,
+        'user_record': {'email': 'runner@example.com', 'created_at': '2026-01-01T00:00:00+00:00',
+                        'token': '0123456789abcdef0123456789abcdef'},
+    }
+
+
+def _time_us(fn, arg, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(arg)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def _encodings() -> dict:
+    """name → (STORAGE_CODEC, STORAGE_COMPRESS_MIN_BYTES, use msgpack)."""
+    encodings = {
+        'json': ('json', 0, False),
+        'json+zlib': ('v1', 0, False),
+    }
+    if codec.msgpack is not None:
+        encodings['msgpack+zlib'] = ('v1', 0, True)
+    encodings['default'] = (settings.STORAGE_CODEC, settings.STORAGE_COMPRESS_MIN_BYTES, codec.msgpack is not None)
+    return encodings
+
+
+def run(repeat: int) -> list:
+    saved = (settings.STORAGE_CODEC, settings.STORAGE_COMPRESS_MIN_BYTES, codec.msgpack)
+    results = []
+    try:
+        for name, value in payloads().items():
+            json_bytes = len(json.dumps(value, default=str))
+            for encoding, (mode, min_bytes, use_msgpack) in _encodings().items():
+                settings.STORAGE_CODEC, settings.STORAGE_COMPRESS_MIN_BYTES = mode, min_bytes
+                codec.msgpack = saved[2] if use_msgpack else None
+                stored = codec.encode(value)
+                assert codec.decode(stored) == json.loads(json.dumps(value, default=str))
+                results.append({
+                    'payload': name,
+                    'encoding': encoding,
+                    'json_bytes': json_bytes,
+                    'stored_bytes': len(stored),
+                    'ratio': round(json_bytes / len(stored), 2),
+                    'encode_us': round(_time_us(codec.encode, value, repeat), 1),
+                    'decode_us': round(_time_us(codec.decode, stored, repeat), 1),
+                })
+    finally:
+        settings.STORAGE_CODEC, settings.STORAGE_COMPRESS_MIN_BYTES, codec.msgpack = saved
+        codec.reset_stats()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=2000)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"payload":<18} {"encoding":<14} {"json B":>8} {"stored B":>9} {"ratio":>6} {"enc us":>8} {"dec us":>8}')
+    for r in results:
+        print(f'{r["payload"]:<18} {r["encoding"]:<14} {r["json_bytes"]:>8} {r["stored_bytes"]:>9} '
+              f'{r["ratio"]:>6} {r["encode_us"]:>8} {r["decode_us"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Benchmark a serverless cold start: interpreter start to the first response.
+
+Each run starts a fresh interpreter that imports api/wsgi.py (the Vercel
+entry point) and passes it one request, GET /api/chats/ with an unknown
+token by default, which loads the views and does one storage lookup.
+Reports, per phase, the median and worst of --runs runs: interpreter
+start-up, importing the app, the first request and the total.
+
+With --profile, one more run under `python -X importtime` reports where
+the import goes: self time summed per top-level package, and the slowest
+modules by cumulative time.
+
+Storage is the in-process memory backend unless --storage-backend says
+otherwise, so nothing here needs a network.
+
+    cd backend
+    python -m benchmarks.coldstart [--runs 10] [--profile] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PHASES = ('interpreter', 'import', 'first_request', 'total')
+
+# Run by each fresh interpreter; argv[1] is the request path
+_CHILD = '''
+import json, sys, time
+started = time.time()
+from io import BytesIO
+import api.wsgi
+imported = time.time()
+environ = {
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+    'HTTP_HOST': 'localhost', 'HTTP_X_AUTH_TOKEN': 'cold-start', 'wsgi.input': BytesIO(), 'wsgi.url_scheme': 'http',
+}
+statuses = []
+b''.join(api.wsgi.app(environ, lambda status, headers: statuses.append(status)))
+print(json.dumps({'started': started, 'imported': imported, 'served': time.time(), 'status': statuses[0]}))
+'''
+
+
+def _child_env(storage_backend: str) -> dict:
+    env = dict(os.environ, STORAGE_BACKEND=storage_backend)
+    env.pop('DJANGO_SETTINGS_MODULE', None)  # let api/wsgi.py pick it, as on Vercel
+    return env
+
+
+def cold_start(path: str, storage_backend: str) -> dict:
+    """Milliseconds per phase of one cold start."""
+    spawned = time.time()
+    proc = subprocess.run(
+        [sys.executable, '-c', _CHILD, path],
+        cwd=BACKEND_DIR, env=_child_env(storage_backend), capture_output=True, text=True, check=True,
+    )
+    child = json.loads(proc.stdout.strip().splitlines()[-1])
+    return {
+        'interpreter': (child['started'] - spawned) * 1000,
+        'import': (child['imported'] - child['started']) * 1000,
+        'first_request': (child['served'] - child['imported']) * 1000,
+        'total': (child['served'] - spawned) * 1000,
+        'status': child['status'],
+    }
+
+
+def import_profile(path: str, storage_backend: str, top: int) -> dict:
+    """Import cost of one cold start from -X importtime, in milliseconds."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', _CHILD, path],
+        cwd=BACKEND_DIR, env=_child_env(storage_backend), capture_output=True, text=True, check=True,
+    )
+    modules, packages = [], {}
+    # Lines look like: "import time:   self [us] | cumulative | imported package"
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        if not self_us.isdigit():  # the header line
+            continue
+        modules.append((name, int(self_us) / 1000, int(cumulative_us) / 1000))
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us) / 1000
+    return {
+        'packages': [
+            {'package': package, 'self_ms': round(ms, 1)}
+            for package, ms in sorted(packages.items(), key=lambda item: -item[1])[:top]
+        ],
+        'modules': [
+            {'module': name, 'self_ms': round(self_ms, 1), 'cumulative_ms': round(cumulative_ms, 1)}
+            for name, self_ms, cumulative_ms in sorted(modules, key=lambda m: -m[2])[:top]
+        ],
+    }
+
+
+def run(runs: int, path: str = '/api/chats/', storage_backend: str = 'memory',
+        profile: bool = False, top: int = 15) -> dict:
+    samples = [cold_start(path, storage_backend) for _ in range(runs)]
+    report = {
+        'runs': runs,
+        'status': samples[-1]['status'],
+        'phases': {
+            phase: {
+                'median_ms': round(statistics.median(s[phase] for s in samples), 1),
+                'max_ms': round(max(s[phase] for s in samples), 1),
+            }
+            for phase in PHASES
+        },
+    }
+    if profile:
+        report['profile'] = import_profile(path, storage_backend, top)
+    return report
+
+
+def _print(report: dict):
+    print(f'{"phase":<14} {"median ms":>10} {"max ms":>8}    ({report["runs"]} runs, {report["status"]})')
+    for phase, r in report['phases'].items():
+        print(f'{phase:<14} {r["median_ms"]:>10} {r["max_ms"]:>8}')
+    profile = report.get('profile')
+    if not profile:
+        return
+    print(f'\n{"package":<32} {"self ms":>8}')
+    for p in profile['packages']:
+        print(f'{p["package"]:<32} {p["self_ms"]:>8}')
+    print(f'\n{"module":<48} {"self ms":>8} {"cumul ms":>9}')
+    for m in profile['modules']:
+        print(f'{m["module"]:<48} {m["self_ms"]:>8} {m["cumulative_ms"]:>9}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--path', default='/api/chats/', help='path of the first request')
+    parser.add_argument('--storage-backend', default='memory', help='memory or sqlite; others need a server')
+    parser.add_argument('--profile', action='store_true', help='add an -X importtime breakdown')
+    parser.add_argument('--top', type=int, default=15, help='packages and modules listed by --profile')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    report = run(args.runs, args.path, args.storage_backend, args.profile, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark send_code with and without the email outbox, against the fakes.
+
+Reports send_code latency when the view calls Brevo itself and when it only
+queues the email (EMAIL_OUTBOX), then how long the worker takes to drain a
+burst of queued emails, and in how many Brevo requests, per batch size.
+
+    cd backend
+    python -m benchmarks.email [--logins 50] [--email-latency 0.2] [--json]
+"""
+import argparse
+import json
+import statistics
+import time
+
+from django.conf import settings
+from django.test import Client
+
+from chat.services import outbox
+from .fakes import use_fakes
+
+
+def _send_code_ms(client: Client, logins: int) -> list:
+    latencies = []
+    for i in range(logins):
+        start = time.perf_counter()
+        response = client.post(
+            '/api/auth/send-code/', json.dumps({'email': f'login-{i}@example.com'}),
+            content_type='application/json',
+        )
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert response.status_code == 200, response.content
+    return latencies
+
+
+def run(logins: int, email_latency: float) -> list:
+    results = []
+    saved = settings.EMAIL_OUTBOX, settings.EMAIL_BATCH_SIZE
+    try:
+        with use_fakes(email_latency=email_latency) as fakes:
+            client = Client()
+            for mode in ('direct', 'outbox'):
+                settings.EMAIL_OUTBOX = mode == 'outbox'
+                latencies = _send_code_ms(client, logins)
+                results.append({
+                    'case': f'send_code ({mode})',
+                    'p50_ms': round(statistics.median(latencies), 2),
+                    'max_ms': round(max(latencies), 2),
+                })
+                outbox.run_worker(once=True)  # leave the queue empty
+
+            settings.EMAIL_OUTBOX = True
+            for batch_size in (1, 10, 50):
+                settings.EMAIL_BATCH_SIZE = batch_size
+                for i in range(logins):
+                    outbox.queue_verification_email(f'burst-{i}@example.com')
+                before = fakes.brevo.requests
+                start = time.perf_counter()
+                outbox.run_worker(once=True)
+                results.append({
+                    'case': f'drain {logins} (batch {batch_size})',
+                    'seconds': round(time.perf_counter() - start, 3),
+                    'brevo_requests': fakes.brevo.requests - before,
+                })
+    finally:
+        settings.EMAIL_OUTBOX, settings.EMAIL_BATCH_SIZE = saved
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--email-latency', type=float, default=0.2, help='seconds per Brevo request')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.logins, args.email_latency)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for r in results:
+        print(f'{r.pop("case"):<26} ' + '  '.join(f'{k}={v}' for k, v in r.items()))
+
+
+if __name__ == '__main__':
+    main()
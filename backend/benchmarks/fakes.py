@@ -0,0 +1,488 @@
+"""Local stand-ins for the services the backend talks to.
+
+- UpstashServer: serves the storage Engine (chat/services/backends/engine.py)
+  over the Upstash REST protocol, so the real upstash_redis client (and its
+  HTTP round trips) is exercised.
+- RespServer: serves the Engine over the native Redis protocol, for
+  STORAGE_BACKEND=redis.
+- OpenAIServer: streams chat completions as SSE with configurable delays.
+- ThradServer: answers SSP bid requests after a configurable delay.
+- BrevoServer: accepts (or fails) transactional email sends.
+
+use_fakes() starts them (each in its own process by default) and points the
+Django settings at them.
+"""
+import base64
+import contextlib
+import json
+import multiprocessing
+import random
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from chat.services.backends.engine import CommandError, Engine
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fake = None
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out in separate writes; without this, Nagle's
+        # algorithm and delayed ACKs add ~40 ms to every response
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, *args):
+        pass
+
+    def _read_json(self):
+        return json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        with self.fake.counter.get_lock():
+            self.fake.counter.value += 1
+        if self.fake.error_rate and random.random() < self.fake.error_rate:
+            self._read_json()
+            self._send_json({'error': 'Injected failure'}, 503)
+            return
+        self.fake.handle(self)
+
+    def do_GET(self):
+        self.fake.handle_get(self)
+
+
+class FakeServer:
+    """A local HTTP server on an ephemeral port; subclasses implement handle().
+
+    `error_rate` of requests (0 to 1) fail with a 503 before reaching handle().
+    """
+
+    path = ''
+
+    def __init__(self, counter=None, error_rate: float = 0.0):
+        self.counter = counter or multiprocessing.Value('i', 0)
+        self.error_rate = error_rate
+        handler = type('Handler', (_Handler,), {'fake': self})
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}{self.path}'
+        # A short poll so close() (once per test) does not wait half a second
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    @property
+    def requests(self) -> int:
+        return self.counter.value
+
+    def handle(self, request: _Handler):
+        raise NotImplementedError
+
+    def handle_get(self, request: _Handler):
+        request._send_json({'error': 'Not found'}, 404)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class UpstashServer(FakeServer):
+    """Serves an Engine over the Upstash REST API (single, /pipeline, /multi-exec)."""
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0, counter=None):
+        self.engine = Engine()
+        self.latency = latency
+        super().__init__(counter, error_rate)
+
+    def handle(self, request):
+        if self.latency:
+            time.sleep(self.latency)
+        body = request._read_json()
+        encode = request.headers.get('Upstash-Encoding') == 'base64'
+        if request.path.rstrip('/') in ('/pipeline', '/multi-exec'):
+            request._send_json([self._run(command, encode) for command in body])
+        else:
+            request._send_json(self._run(body, encode))
+
+    def _run(self, command, encode: bool) -> dict:
+        try:
+            return {'result': _encode(self.engine.execute(command), encode)}
+        except CommandError as e:
+            return {'error': str(e)}
+
+
+def _encode(value, b64: bool):
+    if isinstance(value, str):
+        return base64.b64encode(value.encode()).decode() if b64 and value != 'OK' else value
+    if isinstance(value, list):
+        return [_encode(item, b64) for item in value]
+    return value
+
+
+def _parse_command(buf: bytearray, pos: int):
+    """(command, next position) for the RESP array at pos, or None if incomplete."""
+    end = buf.find(b'\r\n', pos)
+    if end < 0:
+        return None
+    count, pos = int(buf[pos + 1:end]), end + 2
+    command = []
+    for _ in range(count):
+        end = buf.find(b'\r\n', pos)
+        if end < 0:
+            return None
+        size, pos = int(buf[pos + 1:end]), end + 2
+        if len(buf) < pos + size + 2:
+            return None
+        command.append(bytes(buf[pos:pos + size]).decode('utf-8', 'surrogateescape'))
+        pos += size + 2
+    return command, pos
+
+
+def _resp(value) -> bytes:
+    if isinstance(value, CommandError):
+        return b'-%s\r\n' % str(value).encode()
+    if value is None:
+        return b'$-1\r\n'
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(_resp(item) for item in value)
+    data = str(value).encode('utf-8', 'surrogateescape')
+    return b'$%d\r\n%s\r\n' % (len(data), data)
+
+
+class _RespHandler(socketserver.BaseRequestHandler):
+    fake = None
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = bytearray()
+        queued = None  # commands between MULTI and EXEC
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            buf += data
+            commands, pos = [], 0
+            while (parsed := _parse_command(buf, pos)) is not None:
+                command, pos = parsed
+                commands.append(command)
+            del buf[:pos]
+            if not commands:
+                continue
+            # Commands that arrive together are one pipelined round trip
+            with self.fake.counter.get_lock():
+                self.fake.counter.value += 1
+            if self.fake.latency:
+                time.sleep(self.fake.latency)
+            replies = []
+            for command in commands:
+                name = command[0].upper()
+                if name == 'MULTI':
+                    queued = []
+                    replies.append('OK')
+                elif name == 'EXEC':
+                    replies.append(self.fake.engine.run(queued or []))
+                    queued = None
+                elif queued is not None:
+                    queued.append(command)
+                    replies.append('QUEUED')
+                elif name in ('AUTH', 'SELECT'):
+                    replies.append('OK')
+                else:
+                    replies.extend(self.fake.engine.run([command]))
+            self.request.sendall(b''.join(_resp(reply) for reply in replies))
+
+
+class RespServer:
+    """Serves an Engine over the native Redis protocol (RESP2, MULTI/EXEC, no auth)."""
+
+    def __init__(self, latency: float = 0.0, counter=None):
+        self.engine = Engine()
+        self.latency = latency
+        self.counter = counter or multiprocessing.Value('i', 0)
+        handler = type('Handler', (_RespHandler,), {'fake': self})
+        self.server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), handler)
+        self.server.daemon_threads = True
+        self.url = f'redis://127.0.0.1:{self.server.server_address[1]}/0'
+        threading.Thread(target=self.server.serve_forever, args=(0.01,), daemon=True).start()
+
+    @property
+    def requests(self) -> int:
+        return self.counter.value
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OpenAIServer(FakeServer):
+    """Fake /chat/completions: streams `words` as SSE chunks, or returns them whole."""
+
+    path = '/v1'
+
+    def __init__(self, words=('Hello', ' there', '!'), first_token_delay=0.0, token_delay=0.0,
+                 error_rate: float = 0.0, counter=None):
+        self.words = list(words)
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        super().__init__(counter, error_rate)
+
+    def handle(self, request):
+        body = request._read_json()
+        if not body.get('stream'):
+            request._send_json(self._completion(''.join(self.words)))
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/event-stream')
+        request.send_header('Transfer-Encoding', 'chunked')
+        request.end_headers()
+        time.sleep(self.first_token_delay)
+        for i, word in enumerate(self.words):
+            if i:
+                time.sleep(self.token_delay)
+            self._write_chunk(request, f'data: {json.dumps(self._chunk(word))}\n\n')
+        self._write_chunk(request, 'data: [DONE]\n\n')
+        request.wfile.write(b'0\r\n\r\n')
+
+    @staticmethod
+    def _write_chunk(request, text: str):
+        data = text.encode()
+        request.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        request.wfile.flush()
+
+    @staticmethod
+    def _chunk(word: str) -> dict:
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'fake',
+            'choices': [{'index': 0, 'delta': {'content': word}, 'finish_reason': None}],
+        }
+
+    @staticmethod
+    def _completion(text: str) -> dict:
+        return {
+            'id': 'chatcmpl-fake', 'object': 'chat.completion', 'created': 0, 'model': 'fake',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+        }
+
+
+class ThradServer(FakeServer):
+    """Fake SSP bid endpoint returning a fixed bid after `latency` seconds.
+
+    Only `fill_rate` of requests get the bid; the rest are answered with none.
+    `payloads` lists the bid requests received (in-process only).
+    """
+
+    path = '/api/v1/ssp/bid-request'
+    BID = {
+        'advertiser': 'Bench',
+        'headline': 'Benchmark Ad',
+        'description': 'Served by the local fake SSP.',
+        'cta_text': 'Learn More',
+        'url': 'https://example.com',
+    }
+
+    def __init__(self, latency: float = 0.0, fill_rate: float = 1.0, error_rate: float = 0.0, counter=None):
+        self.latency = latency
+        self.fill_rate = fill_rate
+        self.payloads = []
+        super().__init__(counter, error_rate)
+
+    def handle(self, request):
+        self.payloads.append(request._read_json())
+        time.sleep(self.latency)
+        bid = self.BID if random.random() < self.fill_rate else None
+        request._send_json({'data': {'bid': bid}})
+
+
+class BrevoServer(FakeServer):
+    """Fake Brevo /v3/smtp/email: accepts single and messageVersions sends.
+
+    The first `fail_first` requests get `fail_status`; recipients in
+    `reject` make their whole request fail with 400. `delivered` lists the
+    recipients of accepted requests (in-process only). The last message
+    accepted for each recipient can be read back with GET ?to=<email>, as
+    the load generator does to sign in with the code it carries.
+    """
+
+    path = '/v3/smtp/email'
+
+    def __init__(self, latency: float = 0.0, fail_first: int = 0, fail_status: int = 503,
+                 reject=(), error_rate: float = 0.0, counter=None):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.reject = set(reject)
+        self.delivered = []
+        self.inbox = {}
+        self._lock = threading.Lock()
+        super().__init__(counter, error_rate)
+
+    def handle(self, request):
+        body = request._read_json()
+        time.sleep(self.latency)
+        versions = body.get('messageVersions') or [body]
+        recipients = [to['email'] for version in versions for to in version['to']]
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                request._send_json({'code': 'unavailable', 'message': 'Try again later'}, self.fail_status)
+                return
+            if self.reject & set(recipients):
+                request._send_json({'code': 'invalid_parameter', 'message': 'email is not valid'}, 400)
+                return
+            self.delivered.extend(recipients)
+            for version in versions:
+                for to in version['to']:
+                    self.inbox[to['email']] = {'subject': version.get('subject', body.get('subject'))}
+        request._send_json({'messageIds': [f'<{i}@fake>' for i in range(len(versions))]}, 201)
+
+    def handle_get(self, request):
+        to = parse_qs(urlsplit(request.path).query).get('to', [''])[0]
+        with self._lock:
+            message = self.inbox.get(to)
+        if message is None:
+            request._send_json({'error': 'No message'}, 404)
+        else:
+            request._send_json(message)
+
+
+def _run_remote(server_class, kwargs, counter, conn):
+    # Registers the Python versions of the Lua scripts with the Engine
+    from chat.services import outbox, storage, user_profile  # noqa: F401
+    server = server_class(counter=counter, **kwargs)
+    conn.send(server.url)
+    conn.recv()  # block until the parent closes the pipe or asks us to stop
+
+
+class RemoteServer:
+    """Run a FakeServer in a child process.
+
+    Keeps the fake's CPU time off the benchmark's GIL and its allocations out
+    of the benchmark's tracemalloc numbers. Exposes the same url, requests
+    and close() as an in-process server.
+    """
+
+    def __init__(self, server_class, **kwargs):
+        context = multiprocessing.get_context('spawn')
+        self.counter = context.Value('i', 0)
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_run_remote, args=(server_class, kwargs, self.counter, child_conn), daemon=True,
+        )
+        self._process.start()
+        self.url = self._conn.recv()
+
+    @property
+    def requests(self) -> int:
+        return self.counter.value
+
+    def close(self):
+        self._conn.send('stop')
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+
+
+@contextlib.contextmanager
+def use_fakes(redis_latency=0.0, llm_first_token_delay=0.0, llm_token_delay=0.0, llm_words=None,
+              ssp_latency=0.0, remote=True, storage_backend='upstash', email_latency=0.0, ssp_fill_rate=1.0,
+              error_rates=None):
+    """Start the fakes and point settings (and the shared clients) at them.
+
+    Yields a namespace with .redis, .openai, .thrad and .brevo servers, and
+    .env: the settings pointed at them, for a server run as another process
+    (every value is read from the environment of the same name). With remote
+    (the default) each fake runs in its own process. storage_backend
+    'upstash' serves storage over REST, 'redis' over RESP; 'sqlite' (in a
+    temporary directory) and 'memory' run in-process, so .redis is None.
+    error_rates maps those server names to the share of requests that fail
+    (the RESP fake does not inject errors).
+    """
+    error_rates = error_rates or {}
+    from django.conf import settings
+    from chat.services import ads, claude, fill_rate, storage, user_profile
+    from chat.services.backends import memory
+
+    def start(server_class, **kwargs):
+        return RemoteServer(server_class, **kwargs) if remote else server_class(**kwargs)
+
+    storage_dir = None
+    if storage_backend == 'upstash':
+        redis = start(UpstashServer, latency=redis_latency, error_rate=error_rates.get('redis', 0.0))
+        storage_overrides = {'KV_REST_API_URL': redis.url, 'KV_REST_API_TOKEN': 'fake'}
+    elif storage_backend == 'redis':
+        redis = start(RespServer, latency=redis_latency)
+        storage_overrides = {'REDIS_URL': redis.url}
+    else:
+        redis = None
+        storage_dir = tempfile.TemporaryDirectory()
+        storage_overrides = {'SQLITE_STORAGE_PATH': str(Path(storage_dir.name) / 'storage.sqlite3')}
+    openai = start(
+        OpenAIServer,
+        words=llm_words or ('Hello', ' there', '!'),
+        first_token_delay=llm_first_token_delay,
+        token_delay=llm_token_delay,
+        error_rate=error_rates.get('openai', 0.0),
+    )
+    thrad = start(ThradServer, latency=ssp_latency, fill_rate=ssp_fill_rate, error_rate=error_rates.get('thrad', 0.0))
+    brevo = start(BrevoServer, latency=email_latency, error_rate=error_rates.get('brevo', 0.0))
+    overrides = {
+        **storage_overrides,
+        'STORAGE_BACKEND': storage_backend,
+        'OPENAI_BASE_URL': openai.url,
+        'OPENAI_API_KEY': 'fake',
+        'THRAD_SSP_URL': thrad.url,
+        'THRAD_API_KEY': 'fake-primary',
+        'THRAD_API_KEY_FALLBACK': 'fake-fallback',
+        'BREVO_API_URL': brevo.url,
+        'BREVO_API_KEY': 'fake',
+        'EMAIL_FROM_ADDRESS': 'bench@example.com',
+    }
+    previous = {name: getattr(settings, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(settings, name, value)
+    if 'testserver' not in settings.ALLOWED_HOSTS:
+        settings.ALLOWED_HOSTS.append('testserver')
+
+    def reset_clients():
+        if storage._client is not None:
+            storage._client.close()
+        storage._client = None
+        storage._async_clients.clear()
+        claude._client = None
+        storage.clear_token_cache()
+        ads._bid_cache.clear()
+        ads._breakers.clear()
+        fill_rate.clear()
+
+    reset_clients()
+    try:
+        yield types.SimpleNamespace(redis=redis, openai=openai, thrad=thrad, brevo=brevo, env=overrides)
+    finally:
+        # Buffered profile updates still belong to the fakes
+        user_profile.flush()
+        for name, value in previous.items():
+            setattr(settings, name, value)
+        reset_clients()
+        for server in (redis, openai, thrad, brevo):
+            if server is not None:
+                server.close()
+        if storage_backend == 'memory':
+            memory.flush()
+        if storage_dir is not None:
+            storage_dir.cleanup()
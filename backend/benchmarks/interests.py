@@ -0,0 +1,106 @@
+"""Benchmark interest matching on realistic pasted messages.
+
+Compares the word-lookup matcher in chat.services.user_profile with the
+per-keyword substring scan it replaced, on short prose and on tens of KB of
+pasted code and logs.
+
+    cd backend
+    python -m benchmarks.interests [--repeat 50] [--json]
+"""
+import argparse
+import inspect
+import json
+import random
+import time
+
+from chat.services.user_profile import INTEREST_KEYWORDS, match_interests
+
+
+def legacy_match(text: str) -> dict:
+    """The substring scan update_interests used before the word-lookup matcher."""
+    text = text.lower()
+    found = {}
+    for category, keywords in INTEREST_KEYWORDS.items():
+        for keyword in keywords:
+            if keyword in text:
+                found[category] = keyword
+                break
+    return found
+
+
+def _code_paste(size: int) -> str:
+    import json.decoder
+    import logging
+    source = ''.join(inspect.getsource(m) for m in (argparse, json.decoder, logging))
+    return (source * (size // len(source) + 1))[:size]
+
+
+def _log_paste(size: int) -> str:
+    rng = random.Random(42)
+    levels = ['INFO', 'WARNING', 'ERROR', 'DEBUG']
+    services = ['api', 'worker', 'scheduler', 'db-proxy', 'auth']
+    words = ['request', 'handled', 'timeout', 'retrying', 'connection', 'reset', 'user', 'said',
+             'cache', 'miss', 'latency', 'happy', 'path', 'queue', 'depth', 'payload', 'bytes']
+    lines = []
+    while sum(len(line) for line in lines) < size:
+        lines.append('2024-05-01T12:%02d:%02d %s [%s] %s\n' % (
+            rng.randrange(60), rng.randrange(60), rng.choice(levels), rng.choice(services),
+            ' '.join(rng.choice(words) for _ in range(rng.randrange(6, 16))),
+        ))
+    return ''.join(lines)[:size]
+
+
+WORKLOADS = {
+    'prose': "I've been getting into running lately and want new shoes, plus a budget for my trip to Japan.",
+    'code_10k': _code_paste(10_000),
+    'code_50k': _code_paste(50_000),
+    'logs_10k': _log_paste(10_000),
+    'logs_50k': _log_paste(50_000),
+}
+
+
+def _time_per_call(fn, text: str, repeat: int) -> float:
+    fn(text)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def run(repeat: int) -> list:
+    results = []
+    for name, text in WORKLOADS.items():
+        legacy = _time_per_call(legacy_match, text, repeat)
+        words = _time_per_call(match_interests, text, repeat)
+        results.append({
+            'workload': name,
+            'bytes': len(text),
+            'legacy_us': round(legacy * 1e6, 1),
+            'words_us': round(words * 1e6, 1),
+            'speedup': round(legacy / words, 2),
+            'legacy_hits': legacy_match(text),
+            'words_hits': match_interests(text),
+        })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"workload":<10} {"bytes":>7} {"legacy µs":>11} {"words µs":>12} {"speedup":>8}')
+    for r in results:
+        print(f'{r["workload"]:<10} {r["bytes"]:>7} {r["legacy_us"]:>11} {r["words_us"]:>12} {r["speedup"]:>8}')
+        dropped = sorted(set(r['legacy_hits']) - set(r['words_hits']))
+        if dropped:
+            print(f'           substring-only categories (false positives): {", ".join(dropped)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,369 @@
+"""Load-test the full chat flow against the local fakes.
+
+Runs --sessions user sessions, --concurrency at a time: send a login code
+(Brevo), read it from the fake's inbox and verify it, create a chat, then
+--sends messages whose SSE replies are read to the end (OpenAI), each
+followed by an ad request (Thrad) unless --inline-ad asks for the ad in the
+stream, then feedback on the last reply and a chat list. Storage, the LLM,
+the SSP and Brevo are the fakes, each in its own process, with the given
+latency and share of failed requests.
+
+Reports p50/p95/p99 latency and error rate per endpoint, time to the first
+reply chunk, and sessions and requests per second. A session stops at its
+first failed request.
+
+By default requests go through Django's test client on threads of this
+process. That shares the GIL with the load generator, so the numbers only
+compare code changes. With --server the backend runs as its own server
+process, started with that command and pointed at the fakes, and the
+sessions send real HTTP requests to --base-url. That measures what the
+deployment sustains and compares WSGI (gunicorn) with ASGI (uvicorn):
+
+    cd backend
+    python -m benchmarks.load [--concurrency 8] [--sessions 40] [--sends 3] [--json]
+    python -m benchmarks.load --redis-latency 0.002 --llm-token-delay 0.02 --ssp-errors 0.2
+    python -m benchmarks.load --base-url http://127.0.0.1:8001 \\
+        --server 'gunicorn config.wsgi -w 4 --threads 8 -b 127.0.0.1:8001'
+    python -m benchmarks.load --base-url http://127.0.0.1:8001 \\
+        --server 'uvicorn config.asgi:application --workers 4 --port 8001'
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shlex
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+from django.test import Client
+
+from .fakes import use_fakes
+from .stats import percentile
+
+ENDPOINTS = ('send_code', 'verify_code', 'create_chat', 'send', 'ads', 'feedback', 'list_chats')
+
+PROMPTS = (
+    'What running shoes would you recommend for a first marathon?',
+    'How do I structure a Python project with a REST API and a database?',
+    'Plan a cheap week-long trip to Lisbon with good food.',
+    'Is it better to invest in index funds or pay off my student loan first?',
+    'Give me a 20 minute workout I can do in a hotel room.',
+    'Which podcasts explain machine learning for beginners?',
+)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+REQUEST_TIMEOUT_SECONDS = 60
+# How long to wait for the code email (longer than a send under EMAIL_OUTBOX)
+# and for a --server to start answering
+MAILBOX_WAIT_SECONDS = 10
+SERVER_START_SECONDS = 30
+
+
+class _Stats:
+    """Latencies and errors per endpoint, shared by the session threads."""
+
+    def __init__(self):
+        self.latencies = {endpoint: [] for endpoint in ENDPOINTS}
+        self.errors = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.first_chunk = []
+        self.sessions = {'completed': 0, 'failed': 0}
+        self._lock = threading.Lock()
+
+    def add(self, endpoint: str, ms: float, ok: bool):
+        with self._lock:
+            self.latencies[endpoint].append(ms)
+            if not ok:
+                self.errors[endpoint] += 1
+
+    def add_first_chunk(self, ms: float):
+        with self._lock:
+            self.first_chunk.append(ms)
+
+    def end_session(self, ok: bool):
+        with self._lock:
+            self.sessions['completed' if ok else 'failed'] += 1
+
+
+class _SessionFailed(Exception):
+    pass
+
+
+class _InProcess:
+    """Requests through Django's test client, on this process's threads."""
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def request(self, method: str, path: str, body: dict | None, token: str) -> tuple[int, object]:
+        """(status, iterable of body parts as bytes)."""
+        headers = {'HTTP_X_AUTH_TOKEN': token} if token else {}
+        if method == 'GET':
+            response = self.client.get(path, **headers)
+        else:
+            response = self.client.post(path, json.dumps(body or {}), content_type='application/json', **headers)
+        return response.status_code, response.streaming_content if response.streaming else [response.content]
+
+
+class _Http:
+    """Requests over HTTP to a running server, on one keep-alive session."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self.http = requests.Session()
+
+    def request(self, method: str, path: str, body: dict | None, token: str) -> tuple[int, object]:
+        response = self.http.request(
+            method, self.base_url + path,
+            json=None if method == 'GET' else body or {},
+            headers={'X-Auth-Token': token} if token else {},
+            stream=True, timeout=REQUEST_TIMEOUT_SECONDS,
+        )
+        return response.status_code, response.iter_content(chunk_size=None)
+
+
+def _read_code(mailbox_url: str, email: str) -> str:
+    """The code in the last email the fake Brevo accepted for `email`, '' if none came."""
+    deadline = time.monotonic() + MAILBOX_WAIT_SECONDS
+    while True:
+        response = requests.get(mailbox_url, params={'to': email}, timeout=REQUEST_TIMEOUT_SECONDS)
+        if response.status_code == 200:
+            # 'Your verification code is 123456'
+            return response.json()['subject'].rsplit(' ', 1)[-1]
+        if time.monotonic() >= deadline:
+            return ''
+        time.sleep(0.05)
+
+
+class _Session:
+    def __init__(self, stats: _Stats, transport, mailbox_url: str, sends: int, inline_ad: bool):
+        self.stats = stats
+        self.transport = transport
+        self.mailbox_url = mailbox_url
+        self.sends = sends
+        self.inline_ad = inline_ad
+        self.token = ''
+
+    def _request(self, endpoint: str, method: str, path: str, body: dict | None = None):
+        start = time.perf_counter()
+        try:
+            status, parts = self.transport.request(method, path, body, self.token)
+            data = b''.join(parts)
+        except OSError:  # connection refused or reset, timeouts
+            status, data = None, b''
+        ok = status is not None and status < 400
+        self.stats.add(endpoint, (time.perf_counter() - start) * 1000, ok)
+        if not ok:
+            raise _SessionFailed(endpoint)
+        return json.loads(data)
+
+    def _login(self):
+        email = f'load-{uuid.uuid4().hex[:12]}@example.com'
+        self._request('send_code', 'POST', '/api/auth/send-code/', {'email': email})
+        # As the user would: from the email
+        code = _read_code(self.mailbox_url, email)
+        user = self._request('verify_code', 'POST', '/api/auth/verify-code/', {'email': email, 'code': code})
+        self.token = user['token']
+
+    def _send(self, chat_id: str, message: str, turn: int) -> str:
+        start = time.perf_counter()
+        message_id, ok = None, False
+        try:
+            status, parts = self.transport.request(
+                'POST', f'/api/chats/{chat_id}/send/',
+                {'message': message, 'inline_ad': self.inline_ad, 'turn_number': turn}, self.token,
+            )
+            ok, first_chunk, buffer = status < 400, None, b''
+            for part in parts:
+                if ok and first_chunk is None and b'"chunk"' in part:
+                    first_chunk = time.perf_counter()
+                    self.stats.add_first_chunk((first_chunk - start) * 1000)
+                # Over HTTP, parts need not end on a frame boundary
+                *frames, buffer = (buffer + part).split(b'\n\n')
+                for frame in frames:
+                    if ok and frame.startswith(b'data: '):
+                        event = json.loads(frame[len(b'data: '):])
+                        if 'error' in event:
+                            ok = False
+                        elif event.get('done'):
+                            message_id = event.get('message_id')
+            ok = ok and bool(message_id)
+        except OSError:
+            ok = False
+        self.stats.add('send', (time.perf_counter() - start) * 1000, ok)
+        if not ok:
+            raise _SessionFailed('send')
+        return message_id
+
+    def run(self, rng: random.Random):
+        try:
+            self._login()
+            chat = self._request('create_chat', 'POST', '/api/chats/', {'message': rng.choice(PROMPTS)})['chat']
+            message_id = None
+            for turn in range(1, self.sends + 1):
+                message_id = self._send(chat['id'], rng.choice(PROMPTS), turn)
+                if not self.inline_ad:
+                    self._request('ads', 'POST', f'/api/chats/{chat["id"]}/ads/', {'turn_number': turn})
+            if message_id:
+                self._request('feedback', 'POST', f'/api/chats/{chat["id"]}/feedback/', {
+                    'message_id': message_id, 'feedback': rng.choice(('like', 'dislike')),
+                })
+            self._request('list_chats', 'GET', '/api/chats/')
+        except _SessionFailed:
+            self.stats.end_session(False)
+            return
+        self.stats.end_session(True)
+
+
+@contextlib.contextmanager
+def _serve(command: str, base_url: str, env: dict):
+    """Run the backend with `command`, pointed at the fakes, until the block exits."""
+    process = subprocess.Popen(shlex.split(command), cwd=BACKEND_DIR, env={**os.environ, **env})
+    try:
+        deadline = time.monotonic() + SERVER_START_SECONDS
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'{command!r} exited with status {process.returncode}')
+            try:
+                requests.get(f'{base_url.rstrip("/")}/api/chats/', timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f'{base_url} did not answer within {SERVER_START_SECONDS}s') from None
+                time.sleep(0.1)
+        yield
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _summary(values: list) -> dict:
+    if not values:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    return {
+        'p50_ms': round(percentile(values, 0.5), 1),
+        'p95_ms': round(percentile(values, 0.95), 1),
+        'p99_ms': round(percentile(values, 0.99), 1),
+    }
+
+
+def run(concurrency: int, sessions: int, sends: int, inline_ad: bool = False, seed: int = 0,
+        server: str | None = None, base_url: str | None = None, **fakes) -> dict:
+    """Run the sessions in process, or over HTTP against `server` listening at `base_url`."""
+    stats = _Stats()
+    rng = random.Random(seed)
+    seeds = [rng.randrange(1 << 30) for _ in range(sessions)]
+    with use_fakes(**fakes) as services, contextlib.ExitStack() as stack:
+        if server:
+            stack.enter_context(_serve(server, base_url, services.env))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(
+                    _Session(stats, _Http(base_url) if server else _InProcess(), services.brevo.url, sends, inline_ad).run,
+                    random.Random(session_seed),
+                )
+                for session_seed in seeds
+            ]
+        elapsed = time.perf_counter() - started
+        for future in futures:
+            future.result()  # a bug in the load generator, not a failed request
+
+    requests = sum(len(latencies) for latencies in stats.latencies.values())
+    return {
+        'target': base_url if server else 'in-process',
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 2),
+        'sessions': stats.sessions,
+        'sessions_per_s': round(stats.sessions['completed'] / elapsed, 2),
+        'requests_per_s': round(requests / elapsed, 2),
+        'first_chunk': _summary(stats.first_chunk),
+        'endpoints': {
+            endpoint: {
+                'requests': len(latencies),
+                'error_rate': round(stats.errors[endpoint] / len(latencies), 4) if latencies else 0.0,
+                **_summary(latencies),
+            }
+            for endpoint, latencies in stats.latencies.items()
+        },
+    }
+
+
+def _print(report: dict):
+    print(f'{"endpoint":<12} {"requests":>8} {"errors":>7} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for endpoint, r in report['endpoints'].items():
+        if not r['requests']:
+            continue
+        print(f'{endpoint:<12} {r["requests"]:>8} {r["error_rate"]:>7.1%} '
+              f'{r["p50_ms"]:>8} {r["p95_ms"]:>8} {r["p99_ms"]:>8}')
+    first = report['first_chunk']
+    print(f'{"first chunk":<12} {"":>8} {"":>7} {first["p50_ms"]!s:>8} {first["p95_ms"]!s:>8} {first["p99_ms"]!s:>8}')
+    sessions = report['sessions']
+    print(f'\n{sessions["completed"]} sessions completed, {sessions["failed"]} failed in {report["elapsed_s"]}s '
+          f'at concurrency {report["concurrency"]} ({report["target"]}): '
+          f'{report["sessions_per_s"]} sessions/s, {report["requests_per_s"]} requests/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--sessions', type=int, default=40)
+    parser.add_argument('--sends', type=int, default=3, help='messages per session')
+    parser.add_argument('--inline-ad', action='store_true', help='ask for the ad in the send stream')
+    parser.add_argument('--storage-backend', default='upstash')
+    parser.add_argument('--server', help='command that starts the backend listening at --base-url, '
+                                         "e.g. 'gunicorn config.wsgi -b 127.0.0.1:8001'")
+    parser.add_argument('--base-url', help='where --server listens, e.g. http://127.0.0.1:8001')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--redis-latency', type=float, default=0.0, help='seconds per storage request')
+    parser.add_argument('--llm-first-token', type=float, default=0.2, help='seconds before the first token')
+    parser.add_argument('--llm-token-delay', type=float, default=0.01, help='seconds between tokens')
+    parser.add_argument('--llm-tokens', type=int, default=60, help='tokens per reply')
+    parser.add_argument('--ssp-latency', type=float, default=0.1)
+    parser.add_argument('--ssp-fill-rate', type=float, default=1.0)
+    parser.add_argument('--email-latency', type=float, default=0.1)
+    for name, help_name in (('redis', 'storage (upstash only)'), ('llm', 'LLM'), ('ssp', 'SSP'), ('email', 'Brevo')):
+        parser.add_argument(f'--{name}-errors', type=float, default=0.0,
+                            help=f'share of {help_name} requests that fail with a 503')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+    if bool(args.server) != bool(args.base_url):
+        parser.error('--server and --base-url go together')
+    if args.server and args.storage_backend == 'memory':
+        parser.error('the memory backend lives in one process; use upstash, redis or sqlite with --server')
+
+    report = run(
+        args.concurrency, args.sessions, args.sends, inline_ad=args.inline_ad, seed=args.seed,
+        server=args.server, base_url=args.base_url,
+        storage_backend=args.storage_backend,
+        redis_latency=args.redis_latency,
+        llm_first_token_delay=args.llm_first_token,
+        llm_token_delay=args.llm_token_delay,
+        llm_words=[f' word{i}' for i in range(args.llm_tokens)],
+        ssp_latency=args.ssp_latency,
+        ssp_fill_rate=args.ssp_fill_rate,
+        email_latency=args.email_latency,
+        error_rates={
+            'redis': args.redis_errors,
+            'openai': args.llm_errors,
+            'thrad': args.ssp_errors,
+            'brevo': args.email_errors,
+        },
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        _print(report)
+
+
+if __name__ == '__main__':
+    main()
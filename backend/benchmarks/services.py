@@ -0,0 +1,233 @@
+"""Benchmark the chat services offline, against the local fakes.
+
+Measures add_message and get_thrad_ad across chat lengths, list_user_chats
+across users with more and more chats, update_interests on prose and on a
+pasted log (buffered and written through), and the full chat_send view
+(request to last SSE byte). Each case reports latency, peak allocations and
+Redis round trips per call.
+
+    cd backend
+    python -m benchmarks.services [--repeat 20] [--quick] [--output out.json]
+    python -m benchmarks.services --baseline previous.json   # flag regressions
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.test import Client
+
+from chat.services import ads, context, storage, user_profile
+from .fakes import use_fakes
+from .interests import WORKLOADS
+from .stats import percentile
+
+CHAT_LENGTHS = (10, 100, 500)
+USER_SIZES = (10, 100, 1000)
+QUICK_CHAT_LENGTHS = (10, 100)
+QUICK_USER_SIZES = (10, 100)
+
+
+def measure(fakes, op: str, params: dict, fn, repeat: int) -> dict:
+    """Time `fn` `repeat` times, then run it once more under tracemalloc."""
+    fn()  # warm connections and caches
+    latencies = []
+    before = fakes.redis.requests
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    round_trips = (fakes.redis.requests - before) / repeat
+
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'op': op,
+        'params': params,
+        'repeat': repeat,
+        'latency_ms': {
+            'mean': round(statistics.fmean(latencies), 3),
+            'p50': round(percentile(latencies, 0.5), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'max': round(max(latencies), 3),
+        },
+        'alloc_peak_kb': round((peak - baseline) / 1024, 1),
+        'redis_round_trips': round(round_trips, 2),
+    }
+
+
+def _messages(count: int) -> list:
+    return [
+        {
+            'role': 'user' if i % 2 == 0 else 'assistant',
+            'content': f'Message {i}: how should I plan a running schedule around travel? ' * 3,
+        }
+        for i in range(count)
+    ]
+
+
+def _seed_chat(email: str, length: int) -> dict:
+    chat = storage.create_chat(email, f'Benchmark chat with {length} messages')
+    storage.update_chat(chat['id'], [storage._new_message(m['role'], m['content']) for m in _messages(length)])
+    return storage.get_chat(chat['id'])
+
+
+def bench_add_message(fakes, chat_lengths, repeat) -> list:
+    results = []
+    for length in chat_lengths:
+        chat = _seed_chat('bench-add@example.com', length)
+        results.append(measure(
+            fakes, 'add_message', {'chat_length': length},
+            lambda: storage.add_message(chat['id'], 'user', 'One more question about shoes.'),
+            repeat,
+        ))
+    return results
+
+
+def bench_list_user_chats(fakes, user_sizes, repeat) -> list:
+    results = []
+    for size in user_sizes:
+        email = f'bench-list-{size}@example.com'
+        for i in range(size):
+            storage.create_chat(email, f'Chat {i}')
+        results.append(measure(
+            fakes, 'list_user_chats', {'user_chats': size, 'limit': storage.CHAT_PAGE_SIZE},
+            lambda: storage.list_user_chats(email),
+            repeat,
+        ))
+    return results
+
+
+def bench_update_interests(fakes, repeat) -> list:
+    results = []
+    flush_seconds = settings.PROFILE_FLUSH_SECONDS
+    for mode, seconds in (('buffered', flush_seconds or 2), ('write_through', 0)):
+        settings.PROFILE_FLUSH_SECONDS = seconds
+        for workload in ('prose', 'logs_10k'):
+            text = WORKLOADS[workload]
+            results.append(measure(
+                fakes, 'update_interests', {'message': workload, 'bytes': len(text), 'mode': mode},
+                lambda: user_profile.update_interests('bench-interests@example.com', text),
+                repeat,
+            ))
+    settings.PROFILE_FLUSH_SECONDS = flush_seconds
+    user_profile.flush()
+    return results
+
+
+def bench_get_thrad_ad(fakes, chat_lengths, repeat) -> list:
+    results = []
+    for length in chat_lengths:
+        chat = _seed_chat('bench-ads@example.com', length)
+        window = context.ad_window(chat)
+
+        def cold():
+            ads._bid_cache.clear()
+            return ads.get_thrad_ad(window, chat['user_email'], chat['id'], turn_number=length // 2)
+
+        results.append(measure(fakes, 'get_thrad_ad', {'chat_length': length, 'cache': 'cold'}, cold, repeat))
+        results.append(measure(
+            fakes, 'get_thrad_ad', {'chat_length': length, 'cache': 'warm'},
+            lambda: ads.get_thrad_ad(window, chat['user_email'], chat['id'], turn_number=length // 2),
+            repeat,
+        ))
+    return results
+
+
+def bench_chat_send(fakes, chat_lengths, repeat) -> list:
+    client = Client()
+    user = storage.create_user('bench-send@example.com')
+    results = []
+    for length in chat_lengths:
+        chat = _seed_chat(user['email'], length)
+
+        def send():
+            response = client.post(
+                f'/api/chats/{chat["id"]}/send/',
+                json.dumps({'message': 'What should I pack for a marathon trip?'}),
+                content_type='application/json',
+                HTTP_X_AUTH_TOKEN=user['token'],
+            )
+            body = b''.join(response.streaming_content)
+            assert b'"done": true' in body, body[-200:]
+
+        results.append(measure(fakes, 'chat_send', {'chat_length': length}, send, repeat))
+    return results
+
+
+def run(repeat: int, quick: bool = False) -> dict:
+    chat_lengths = QUICK_CHAT_LENGTHS if quick else CHAT_LENGTHS
+    user_sizes = QUICK_USER_SIZES if quick else USER_SIZES
+    with use_fakes() as fakes:
+        results = (
+            bench_add_message(fakes, chat_lengths, repeat)
+            + bench_list_user_chats(fakes, user_sizes, repeat)
+            + bench_update_interests(fakes, repeat)
+            + bench_get_thrad_ad(fakes, chat_lengths, repeat)
+            + bench_chat_send(fakes, chat_lengths, repeat)
+        )
+    return {
+        'benchmark': 'services',
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+def _case_key(result: dict) -> str:
+    return result['op'] + ' ' + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """Cases whose p50 latency or round trips grew by more than `threshold`x."""
+    previous = {_case_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        old = previous.get(_case_key(result))
+        if old is None:
+            continue
+        if result['redis_round_trips'] > old['redis_round_trips']:
+            regressions.append(f'{_case_key(result)}: round trips {old["redis_round_trips"]} -> {result["redis_round_trips"]}')
+        if result['latency_ms']['p50'] > old['latency_ms']['p50'] * threshold:
+            regressions.append(f'{_case_key(result)}: p50 {old["latency_ms"]["p50"]} ms -> {result["latency_ms"]["p50"]} ms')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--quick', action='store_true', help='smaller sweeps')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--baseline', help='JSON report to compare against')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='p50 slowdown factor that counts as a regression')
+    args = parser.parse_args()
+
+    report = run(args.repeat, quick=args.quick)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark SSE framing of chat_send replies: frames and bytes per reply.
+
+Streams a reply of --tokens deltas from the fake OpenAI endpoint (one delta
+every --token-ms) through the real chat_send view, once per framing
+configuration: every delta as its own frame (the old behaviour) and
+several coalescing windows/sizes.
+
+    cd backend
+    python -m benchmarks.sse [--tokens 400] [--token-ms 5] [--json]
+"""
+import argparse
+import json
+import random
+import time
+
+from django.conf import settings
+from django.test import Client
+
+from chat.services import storage
+from .fakes import use_fakes
+
+# name → (SSE_COALESCE_MS, SSE_COALESCE_BYTES)
+CONFIGS = {
+    'per_delta': (0, 0),
+    'window_30ms': (30, 1 << 20),
+    'window_50ms': (50, 1 << 20),
+    'bytes_256': (10_000, 256),
+    'default': (None, None),
+}
+
+
+def _reply_tokens(count: int) -> list:
+    rng = random.Random(7)
+    words = ['the', 'model', 'streams', 'a', 'reply', 'token', 'by', 'token', 'and', 'each', 'one',
+             'used', 'to', 'become', 'its', 'own', 'frame', 'with', 'JSON', 'framing', 'overhead']
+    return [' ' + rng.choice(words) for _ in range(count)]
+
+
+def _stream_once(client, user, chat_id) -> dict:
+    started = time.perf_counter()
+    first_chunk_ms = None
+    body = b''
+    response = client.post(
+        f'/api/chats/{chat_id}/send/',
+        json.dumps({'message': 'Tell me a story.'}),
+        content_type='application/json',
+        HTTP_X_AUTH_TOKEN=user['token'],
+    )
+    for part in response.streaming_content:
+        if first_chunk_ms is None and b'"chunk"' in part:
+            first_chunk_ms = (time.perf_counter() - started) * 1000
+        body += part
+    frames = [f for f in body.decode().split('\n\n') if f]
+    return {
+        'frames': len(frames),
+        'chunk_frames': sum(1 for f in frames if f.startswith('data: {"chunk"')),
+        'bytes': len(body),
+        'first_chunk_ms': round(first_chunk_ms or 0, 1),
+        'total_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def run(tokens: int, token_ms: float) -> list:
+    defaults = (settings.SSE_COALESCE_MS, settings.SSE_COALESCE_BYTES)
+    results = []
+    with use_fakes(llm_words=_reply_tokens(tokens), llm_token_delay=token_ms / 1000):
+        client = Client()
+        user = storage.create_user('bench-sse@example.com')
+        chat = storage.create_chat(user['email'], 'SSE benchmark')
+        for name, (window_ms, max_bytes) in CONFIGS.items():
+            settings.SSE_COALESCE_MS = defaults[0] if window_ms is None else window_ms
+            settings.SSE_COALESCE_BYTES = defaults[1] if max_bytes is None else max_bytes
+            result = _stream_once(client, user, chat['id'])
+            result.update({
+                'config': name,
+                'coalesce_ms': settings.SSE_COALESCE_MS,
+                'coalesce_bytes': settings.SSE_COALESCE_BYTES,
+                'tokens': tokens,
+            })
+            results.append(result)
+    settings.SSE_COALESCE_MS, settings.SSE_COALESCE_BYTES = defaults
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tokens', type=int, default=400)
+    parser.add_argument('--token-ms', type=float, default=5)
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    args = parser.parse_args()
+
+    results = run(args.tokens, args.token_ms)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f'{"config":<12} {"frames":>7} {"chunks":>7} {"bytes":>8} {"first ms":>9} {"total ms":>9}')
+    for r in results:
+        print(f'{r["config"]:<12} {r["frames"]:>7} {r["chunk_frames"]:>7} {r["bytes"]:>8} '
+              f'{r["first_chunk_ms"]:>9} {r["total_ms"]:>9}')
+
+
+if __name__ == '__main__':
+    main()
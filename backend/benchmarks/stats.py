@@ -0,0 +1,7 @@
+"""Summary statistics shared by the benchmarks."""
+
+
+def percentile(values: list, q: float) -> float:
+    """The q-quantile (0 to 1) of values, nearest-rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
@@ -0,0 +1,258 @@
+"""Async variants of the chat endpoints, used when served over ASGI.
+
+Enabled with CHAT_ASYNC_VIEWS=True (config/asgi.py turns it on). Replies
+are generated by tasks over an async OpenAI client and streamed by async
+generators, so an open stream holds no worker thread while it waits on the
+model.
+"""
+import asyncio
+import functools
+import logging
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+
+from .services import context, storage, user_profile
+from .services.ads import submit_thrad_ad
+from .services.claude import astream_response
+from .prompts import build_system_prompt
+from .streaming import acoalesce
+from . import generation
+from .views import _feedback_response, _json_body, _turn_number
+
+logger = logging.getLogger(__name__)
+
+
+def _allow_methods(*methods):
+    """require_http_methods for async views (Django 4.2's wraps them as sync)."""
+    def decorator(view):
+        @functools.wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+        inner.csrf_exempt = True
+        return inner
+    return decorator
+
+
+async def _get_auth_user(request, session):
+    token = request.headers.get('X-Auth-Token', '')
+    if not token:
+        return None
+    return await session.get_user_by_token(token)
+
+
+async def _load_owned_chat(request, session, chat_id, keys=()):
+    """Return (user, chat, error_response) for a chat the caller must own."""
+    user = await _get_auth_user(request, session)
+    if not user:
+        return None, None, JsonResponse({'error': 'Unauthorized'}, status=401)
+    await session.load(chat_ids=[chat_id], keys=keys)
+    chat = session.get_chat(chat_id)
+    if not chat:
+        return user, None, JsonResponse({'error': 'Chat not found'}, status=404)
+    if chat['user_email'] != user['email']:
+        return user, None, JsonResponse({'error': 'Forbidden'}, status=403)
+    return user, chat, None
+
+
+async def _ad_event(future, timeout=None) -> dict:
+    try:
+        ad = await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except Exception:
+        logger.warning('Inline ad was not ready in time or failed', exc_info=True)
+        ad = None
+    return {'ad': ad}
+
+
+async def _flush_generation(session, gen):
+    offset = gen.queue_flush(session)
+    try:
+        await session.flush()
+    except Exception:
+        logger.warning('Could not buffer generation %s', gen.key, exc_info=True)
+        return
+    gen.flushed(offset)
+
+
+async def _refresh_summary(session, chat):
+    try:
+        summary, upto = await sync_to_async(context.summarize_older, thread_sensitive=False)(chat)
+        session.set_chat_summary(chat['id'], summary, upto)
+        await session.flush()
+    except Exception:
+        logger.warning('Could not summarize chat %s', chat['id'], exc_info=True)
+
+
+@_allow_methods('GET', 'POST')
+async def chats(request):
+    session = storage.AsyncStorageSession()
+    user = await _get_auth_user(request, session)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+
+    if request.method == 'GET':
+        try:
+            limit = int(request.GET.get('limit', storage.CHAT_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+        limit = max(1, min(limit, storage.MAX_CHAT_PAGE_SIZE))
+        chat_list, next_cursor = await sync_to_async(storage.list_user_chats, thread_sensitive=False)(
+            user['email'], limit=limit, cursor=request.GET.get('cursor'),
+        )
+        return JsonResponse({'chats': chat_list, 'next_cursor': next_cursor})
+
+    body = _json_body(request)
+    message = body.get('message', '').strip()
+    if not message:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+
+    chat = await sync_to_async(storage.create_chat, thread_sensitive=False)(user['email'], message)
+    return JsonResponse({'chat': chat}, status=201)
+
+
+@_allow_methods('GET')
+async def chat_detail(request, chat_id):
+    session = storage.AsyncStorageSession()
+    _, chat, error = await _load_owned_chat(request, session, chat_id)
+    if error:
+        return error
+    return JsonResponse({'chat': chat})
+
+
+@_allow_methods('POST')
+async def chat_send(request, chat_id):
+    session = storage.AsyncStorageSession()
+    user, chat, error = await _load_owned_chat(request, session, chat_id)
+    if error:
+        return error
+
+    body = _json_body(request)
+    message = body.get('message', '').strip()
+    if not message:
+        return JsonResponse({'error': 'Message is required'}, status=400)
+    try:
+        turn_number = _turn_number(body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid turn_number'}, status=400)
+
+    session.add_message(chat_id, 'user', message)
+    user_profile.update_interests(user['email'], message, session=session)
+
+    system_prompt = build_system_prompt()
+    messages = context.llm_window(chat)
+
+    # The ad is bid for once the reply is stored, none on a first turn; see views.chat_send
+    inline_ad = bool(body.get('inline_ad'))
+    first_turn = len(chat['messages']) < 2
+    turn_number = turn_number or sum(1 for m in chat['messages'] if m['role'] == 'assistant') + 1
+
+    gen = generation.Generation(chat_id)
+
+    async def generate():
+        full_response = []
+        try:
+            async for chunk in acoalesce(astream_response(messages, system_prompt), heartbeat=0):
+                full_response.append(chunk)
+                gen.append({'chunk': chunk})
+                if gen.flush_due():
+                    await _flush_generation(session, gen)
+
+            # Stored before 'done' is appended, as in views.chat_send
+            assistant_msg = session.add_message(chat_id, 'assistant', ''.join(full_response))
+            offset = gen.queue_flush(session)
+            await session.flush()
+            gen.flushed(offset)
+            gen.append({'done': True, 'message_id': assistant_msg.get('id', '')})
+
+            if inline_ad and first_turn:
+                gen.append({'ad': None})
+            elif inline_ad:
+                ad_future = submit_thrad_ad(context.ad_window(chat), user['email'], chat_id, turn_number=turn_number)
+                gen.append(await _ad_event(ad_future, timeout=settings.THRAD_INLINE_AD_WAIT_SECONDS))
+        except Exception as e:
+            gen.append({'error': str(e)})
+        finally:
+            gen.finish()
+            await _flush_generation(session, gen)
+
+        if context.summary_due(chat):
+            await _refresh_summary(session, chat)
+
+    offset = gen.queue_flush(session)
+    await session.flush()
+    gen.flushed(offset)
+    generation.astart(gen, generate())
+
+    response = StreamingHttpResponse(
+        generation.atail(gen.key, gen=gen),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@_allow_methods('GET')
+async def chat_stream(request, chat_id, gen_id):
+    session = storage.AsyncStorageSession()
+    user = await _get_auth_user(request, session)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+    try:
+        offset = max(0, int(request.GET.get('from', 0)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid offset'}, status=400)
+
+    owner = await storage.ageneration_owner(chat_id, gen_id)
+    if not owner:
+        return JsonResponse({'error': 'Generation not found'}, status=404)
+    if owner != user['email']:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+
+    response = StreamingHttpResponse(
+        generation.atail(storage.generation_key(chat_id, gen_id), offset),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@_allow_methods('POST')
+async def chat_feedback(request, chat_id):
+    session = storage.AsyncStorageSession()
+    user = await _get_auth_user(request, session)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
+
+    body = _json_body(request)
+    message_id = body.get('message_id', '')
+    feedback = body.get('feedback', '')  # 'like' or 'dislike'
+
+    if not message_id or feedback not in ('like', 'dislike'):
+        return JsonResponse({'error': 'Invalid feedback'}, status=400)
+
+    result = await storage.aset_message_feedback(chat_id, message_id, feedback, user['email'])
+    return _feedback_response(result)
+
+
+@_allow_methods('POST')
+async def chat_ads(request, chat_id):
+    session = storage.AsyncStorageSession()
+    user, chat, error = await _load_owned_chat(request, session, chat_id)
+    if error:
+        return error
+
+    try:
+        turn_number = _turn_number(_json_body(request))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid turn_number'}, status=400)
+
+    # The SSP client is blocking; run it on the ads worker pool
+    ad = await asyncio.wrap_future(
+        submit_thrad_ad(context.ad_window(chat), user['email'], chat_id, turn_number=turn_number)
+    )
+    return JsonResponse({'ad': ad})
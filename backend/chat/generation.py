@@ -0,0 +1,214 @@
+"""Resumable reply generation for chat_send.
+
+A reply is generated by a background worker (a thread, or a task under
+the async views) that appends its SSE events to a Generation: the
+`generation` event carrying its id, `chunk`s, the inline `ad`, `done` or
+`error`. The send response, and any later GET /chats/<id>/stream/<gen_id>/,
+only tail that buffer, so a client that drops mid-reply does not stop the
+generation or lose its tokens; it reconnects with ?from=<events received>.
+
+Events are flushed to the gen:{chat_id}:{gen_id} Redis stream every
+GENERATION_FLUSH_MS (one XADD per flush), riding on the request session's
+pipeline. Tailers in the same process read the in-memory buffer and are
+woken on each append; a resume that lands on another process polls Redis
+every GENERATION_POLL_MS.
+"""
+import asyncio
+import contextvars
+import json
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from .services import storage
+from .streaming import HEARTBEAT_FRAME
+
+# Closes the buffer; never sent to clients
+_END = {'end': True}
+
+# Generations still running in this process, by Redis key
+_active = {}
+# Strong references to running async workers (the loop only keeps weak ones)
+_tasks = set()
+
+
+class Generation:
+    """The events of one reply, buffered in memory and flushed to Redis."""
+
+    def __init__(self, chat_id: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = storage.generation_key(chat_id, self.id)
+        self.events = []
+        self.finished = False
+        self._flushed = 0
+        self._flushed_at = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiters = set()
+        self.append({'generation': self.id})
+
+    def append(self, event: dict):
+        """Add an event and wake the tailers."""
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        for loop, wakeup in waiters:
+            loop.call_soon_threadsafe(wakeup.set)
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.append(_END)
+
+    def flush_due(self) -> bool:
+        interval = settings.GENERATION_FLUSH_MS / 1000
+        return len(self.events) > self._flushed and time.monotonic() - self._flushed_at >= interval
+
+    def queue_flush(self, session) -> int:
+        """Queue the events not yet in Redis on the session's next flush().
+
+        Returns the offset to pass to flushed() once that flush succeeds.
+        Until then the events count as unwritten, so a failed flush leaves
+        no hole in the stream: the next one sends them again.
+        """
+        with self._cond:
+            offset, events = self._flushed, self.events[self._flushed:]
+        self._flushed_at = time.monotonic()
+        if events:
+            session.append_generation_events(self.key, offset, events)
+        return offset + len(events)
+
+    def flushed(self, offset: int):
+        """Mark the events before `offset` as written to Redis."""
+        with self._cond:
+            self._flushed = max(self._flushed, offset)
+
+    def wait(self, offset: int, timeout: float | None) -> list:
+        """Events after `offset`, waiting up to `timeout` seconds for one."""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self.events) > offset, timeout)
+            return self.events[offset:]
+
+    async def await_events(self, offset: int, timeout: float | None) -> list:
+        wakeup = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wakeup)
+        with self._cond:
+            if len(self.events) > offset:
+                return self.events[offset:]
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+        return self.events[offset:]
+
+
+def start(gen: Generation, work):
+    """Run `work()` on a thread that outlives the request."""
+    _active[gen.key] = gen
+
+    def run():
+        try:
+            work()
+        finally:
+            _active.pop(gen.key, None)
+
+    # A copy of the context so the worker's timing spans land on this request
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(run,),
+        name='generation', daemon=True,
+    ).start()
+
+
+def astart(gen: Generation, work):
+    """Run the coroutine `work` as a task that outlives the request."""
+    _active[gen.key] = gen
+
+    async def run():
+        try:
+            await work
+        finally:
+            _active.pop(gen.key, None)
+
+    task = asyncio.ensure_future(run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def active(key: str) -> Generation | None:
+    return _active.get(key)
+
+
+class _Tail:
+    """Framing, heartbeat and stall bookkeeping shared by tail() and atail()."""
+
+    def __init__(self, offset: int):
+        self.offset = offset
+        self.heartbeat = settings.SSE_HEARTBEAT_SECONDS
+        self.last_event = self.last_sent = time.monotonic()
+        self.ended = False
+
+    def wait_timeout(self) -> float | None:
+        return self.heartbeat or None
+
+    def frames(self, events: list | None) -> list:
+        """SSE frames for newly read events (None: the buffer is gone)."""
+        now = time.monotonic()
+        if events is None:
+            self.ended = True
+            return [f'data: {json.dumps({"error": "Generation not found or expired"})}\n\n']
+        if events:
+            self.last_event = self.last_sent = now
+        frames = []
+        for event in events:
+            self.offset += 1
+            if event == _END:
+                self.ended = True
+                break
+            frames.append(f'data: {json.dumps(event)}\n\n')
+        if frames or self.ended:
+            return frames
+        if now - self.last_event >= settings.GENERATION_STALL_SECONDS:
+            self.ended = True
+            return [f'data: {json.dumps({"error": "Generation stalled"})}\n\n']
+        if self.heartbeat and now - self.last_sent >= self.heartbeat:
+            self.last_sent = now
+            return [HEARTBEAT_FRAME]
+        return []
+
+
+def tail(key: str, offset: int = 0, gen: Generation | None = None):
+    """SSE frames of a generation from event `offset` until it ends."""
+    gen = gen or active(key)
+    state = _Tail(offset)
+    poll = settings.GENERATION_POLL_MS / 1000
+    while not state.ended:
+        if gen is not None:
+            events = gen.wait(state.offset, state.wait_timeout())
+        else:
+            events = storage.read_generation_events(key, state.offset)
+            if events == []:
+                time.sleep(poll)
+        yield from state.frames(events)
+
+
+async def atail(key: str, offset: int = 0, gen: Generation | None = None):
+    """Async counterpart of tail()."""
+    gen = gen or active(key)
+    state = _Tail(offset)
+    poll = settings.GENERATION_POLL_MS / 1000
+    while not state.ended:
+        if gen is not None:
+            events = await gen.await_events(state.offset, state.wait_timeout())
+        else:
+            events = await storage.aread_generation_events(key, state.offset)
+            if events == []:
+                await asyncio.sleep(poll)
+        for frame in state.frames(events):
+            yield frame
+
@@ -0,0 +1,19 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from chat.services import outbox
+
+
+class Command(BaseCommand):
+    help = 'Send queued verification emails (EMAIL_OUTBOX) until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='exit once no email is due')
+
+    def handle(self, *args, once=False, **options):
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        outbox.run_worker(stop, once=once)
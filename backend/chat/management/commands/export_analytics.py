@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.services import export
+
+
+class Command(BaseCommand):
+    help = 'Export every chat and interest profile as JSON lines, resumably.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='JSONL file to write; gzip-compressed if it ends in .gz')
+        parser.add_argument('--kinds', default=','.join(export.KINDS),
+                            help='comma-separated subset of ' + ', '.join(export.KINDS))
+        parser.add_argument('--batch-size', type=int, help='keys per SCAN page (default EXPORT_BATCH_SIZE)')
+        parser.add_argument('--rate', type=float,
+                            help='max keys read per second, 0 for no cap (default EXPORT_KEYS_PER_SECOND)')
+        parser.add_argument('--cursor-file', help='where progress is saved (default <output>.cursor)')
+        parser.add_argument('--resume', action='store_true',
+                            help='append to output from the cursor saved by an interrupted run')
+
+    def handle(self, *args, output, kinds, batch_size=None, rate=None, cursor_file=None, resume=False, **options):
+        kinds = tuple(kind for kind in kinds.split(',') if kind)
+        unknown = set(kinds) - set(export.KINDS)
+        if unknown:
+            raise CommandError(f'Unknown kinds: {", ".join(sorted(unknown))}')
+        cursor_file = cursor_file or f'{output}.cursor'
+
+        cursor = None
+        if resume:
+            if not os.path.exists(cursor_file):
+                raise CommandError(f'No saved cursor at {cursor_file}; nothing to resume')
+            with open(cursor_file) as f:
+                cursor = f.read().strip()
+            try:
+                export.parse_cursor(cursor)
+            except ValueError as e:
+                raise CommandError(str(e)) from e
+
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+
+        opener = gzip.open if output.endswith('.gz') else open
+        written = 0
+        # Appending after a resume adds a gzip member, which readers concatenate
+        with opener(output, 'at' if resume else 'wt', encoding='utf-8') as out:
+            for records, cursor in export.export(kinds, cursor, batch_size, rate):
+                for record in records:
+                    out.write(json.dumps(record, separators=(',', ':')) + '\n')
+                written += len(records)
+                out.flush()
+                if cursor is None:
+                    break
+                _save_cursor(cursor_file, cursor)
+                if stop.is_set():
+                    self.stderr.write(f'Stopped after {written} records; continue with --resume')
+                    return
+
+        if os.path.exists(cursor_file):
+            os.remove(cursor_file)
+        self.stdout.write(f'Exported {written} records to {output}')
+
+
+def _save_cursor(path: str, cursor: str):
+    # Write then rename, so a crash never leaves a half-written cursor
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(cursor)
+    os.replace(f'{path}.tmp', path)
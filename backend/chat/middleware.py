@@ -0,0 +1,125 @@
+import json
+import logging
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .services import storage, timing
+
+logger = logging.getLogger(__name__)
+
+
+class StorageSessionMiddleware:
+    """Attach a request-scoped StorageSession and count its Redis round trips.
+
+    The count is returned in an X-Redis-Round-Trips header; streaming
+    responses log it once the stream has been fully sent instead. Runs
+    natively under ASGI too, where the async views build their own
+    AsyncStorageSession.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        counter = storage.count_round_trips()
+        request.storage = storage.StorageSession()
+        return self._finish(request, self.get_response(request), counter)
+
+    async def __acall__(self, request):
+        counter = storage.count_round_trips()
+        request.storage = storage.StorageSession()
+        return self._finish(request, await self.get_response(request), counter)
+
+    def _finish(self, request, response, counter):
+        if response.streaming:
+            log_when_done = self._alog_when_done if response.is_async else self._log_when_done
+            response.streaming_content = log_when_done(
+                response.streaming_content, request, counter,
+            )
+        else:
+            response['X-Redis-Round-Trips'] = str(counter.count)
+            logger.debug('%s %s: %d Redis round trips', request.method, request.path, counter.count)
+        return response
+
+    @staticmethod
+    def _log_when_done(content, request, counter):
+        yield from content
+        logger.debug('%s %s: %d Redis round trips', request.method, request.path, counter.count)
+
+    @staticmethod
+    async def _alog_when_done(content, request, counter):
+        async for chunk in content:
+            yield chunk
+        logger.debug('%s %s: %d Redis round trips', request.method, request.path, counter.count)
+
+
+class TimingMiddleware:
+    """Collect timing spans for each request and report them.
+
+    JSON responses get a Server-Timing header. Event streams end with a
+    `data: {"timing": {...}}` event, since their headers go out before the
+    work is done. Each request's total also feeds a per-route histogram,
+    which the metrics endpoint reports.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = timing.start_request()
+        return self._finish(request, self.get_response(request), timings)
+
+    async def __acall__(self, request):
+        timings = timing.start_request()
+        return self._finish(request, await self.get_response(request), timings)
+
+    def _finish(self, request, response, timings):
+        if timings is None:
+            return response
+        if not response.streaming:
+            response['Server-Timing'] = timings.server_timing()
+            self._observe(request, timings)
+        elif response.get('Content-Type', '').startswith('text/event-stream'):
+            with_timing = self._aappend_timing if response.is_async else self._append_timing
+            response.streaming_content = with_timing(response.streaming_content, request, timings)
+        return response
+
+    @staticmethod
+    def _observe(request, timings):
+        match = request.resolver_match
+        route = match.route if match else 'unmatched'
+        timing.histogram(f'request:{route}').observe(timings.elapsed() * 1000)
+
+    @classmethod
+    def _timing_event(cls, request, timings) -> bytes:
+        cls._observe(request, timings)
+        return f'data: {json.dumps({"timing": timings.as_dict()})}\n\n'.encode()
+
+    @classmethod
+    def _append_timing(cls, content, request, timings):
+        # The stream is iterated after the view returned; spans recorded
+        # while generating it belong to this request
+        timing.activate(timings)
+        yield from content
+        yield cls._timing_event(request, timings)
+
+    @classmethod
+    async def _aappend_timing(cls, content, request, timings):
+        timing.activate(timings)
+        async for chunk in content:
+            yield chunk
+        yield cls._timing_event(request, timings)
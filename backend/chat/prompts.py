@@ -1,3 +1,13 @@
 def build_system_prompt() -> str:
     """Build system prompt for the AI assistant."""
     return "You are a helpful AI assistant. Respond conversationally and helpfully."
+
+
+def build_summary_prompt() -> str:
+    """System prompt for folding older turns into a chat's rolling summary."""
+    return (
+        "Summarize the conversation below for an assistant that will continue it. "
+        "Keep facts, decisions, open questions and the user's stated preferences; "
+        "drop pleasantries. If a previous summary is given, merge it in. "
+        "Reply with the summary only."
+    )
@@ -1,13 +1,47 @@
+import contextvars
 import hashlib
+import json
 import logging
 import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
-import requests
 from datetime import datetime, timezone
 from django.conf import settings
 
+from . import fill_rate, timing
+from .cache import SingleFlight, TTLCache
+from .storage import get_doc, set_doc
+
 logger = logging.getLogger(__name__)
 
+# Background workers for bid requests started while a reply is streaming
+_executor = ThreadPoolExecutor(
+    max_workers=settings.THRAD_AD_WORKERS,
+    thread_name_prefix='thrad-ad',
+)
+
+# Workers for individual SSP calls. Kept apart from _executor so a hedged
+# call never waits for a slot held by the get_thrad_ad that launched it.
+_call_executor = ThreadPoolExecutor(
+    max_workers=settings.THRAD_AD_WORKERS * 2,
+    thread_name_prefix='thrad-call',
+)
+
+# One keep-alive session for every SSP call, sync or background, created
+# on the first call so importing the views does not pay for requests
+_http = None
+_http_lock = threading.Lock()
+
+# Bids for a conversation state that was already auctioned; see _cached_bid
+_bid_cache = TTLCache(
+    maxsize=settings.THRAD_AD_CACHE_MAXSIZE,
+    ttl=settings.THRAD_AD_CACHE_TTL_SECONDS,
+)
+_bid_flights = SingleFlight()
+
 MOCK_ADS = [
     {
         'advertiser': 'Nike',
@@ -40,7 +74,20 @@ MOCK_ADS = [
 ]
 
 
-def _call_thrad_api(api_key: str, payload: dict) -> dict | None:
+def _get_http():
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_maxsize=settings.THRAD_AD_WORKERS * 2))
+                _http = session
+    return _http
+
+
+def _call_thrad_api(api_key: str, payload: dict, timeout: float) -> dict | None:
     """Make a single Thrad SSP bid request with the given API key.
 
     Returns the bid dict on success, or None on failure.
@@ -50,12 +97,13 @@ def _call_thrad_api(api_key: str, payload: dict) -> dict | None:
         'Content-Type': 'application/json',
     }
     # No Origin header — server-to-server call avoids the 403
-    resp = requests.post(
-        'https://ssp.thrads.ai/api/v1/ssp/bid-request',
-        headers=headers,
-        json=payload,
-        timeout=10,
-    )
+    with timing.span('ssp'):
+        resp = _get_http().post(
+            settings.THRAD_SSP_URL,
+            headers=headers,
+            json=payload,
+            timeout=timeout,
+        )
     logger.info('Thrad API [key=…%s] status=%s body=%s', api_key[-6:], resp.status_code, resp.text[:500])
     resp.raise_for_status()
 
@@ -63,12 +111,214 @@ def _call_thrad_api(api_key: str, payload: dict) -> dict | None:
     return data.get('bid')
 
 
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one Thrad API key.
+
+    Closed: calls go through and outcomes fill a sliding window. Once the
+    window holds at least ``min_calls`` outcomes and the failure rate reaches
+    ``failure_rate`` the breaker opens and calls are skipped. After
+    ``open_seconds`` it lets a single probe through (half-open); the probe's
+    outcome closes the breaker again or re-opens it.
+    """
+
+    def __init__(self, window: int, min_calls: int, failure_rate: float, open_seconds: float):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. A True in half-open claims the probe."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.open_seconds:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, success: bool):
+        with self._lock:
+            if self._opened_at is not None:
+                # Only the half-open probe decides; stragglers from before the
+                # breaker opened are ignored.
+                if self._probing:
+                    self._probing = False
+                    if success:
+                        self._opened_at = None
+                        self._outcomes.clear()
+                    else:
+                        self._opened_at = time.monotonic()
+                return
+            self._outcomes.append(success)
+            failures = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+                logger.warning('Thrad circuit opened after %d/%d failed calls', failures, len(self._outcomes))
+                self._opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def _breaker(api_key: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if api_key not in _breakers:
+            _breakers[api_key] = CircuitBreaker(
+                window=settings.THRAD_BREAKER_WINDOW,
+                min_calls=settings.THRAD_BREAKER_MIN_CALLS,
+                failure_rate=settings.THRAD_BREAKER_FAILURE_RATE,
+                open_seconds=settings.THRAD_BREAKER_OPEN_SECONDS,
+            )
+        return _breakers[api_key]
+
+
+def _attempt(api_key: str, payload: dict, deadline: float) -> tuple[dict | None, float | None]:
+    """One SSP call whose outcome feeds the key's breaker. Never raises.
+
+    The call may take whatever is left of the budget ending at `deadline`
+    (time.monotonic()) when it starts, so a hedged call or one that waited
+    for a worker does not outlive the request it belongs to; starting with
+    nothing left counts as a timeout.
+
+    Returns (bid, latency in ms). The latency is None when the call failed,
+    so a failure can be told apart from an answer without a bid.
+    """
+    breaker = _breaker(api_key)
+    timeout = deadline - time.monotonic()
+    if timeout <= 0:
+        breaker.record(False)
+        logger.warning('Thrad API budget spent before the call for key …%s started', api_key[-6:])
+        return None, None
+    started = time.perf_counter()
+    try:
+        bid = _call_thrad_api(api_key, payload, timeout)
+    except Exception as e:
+        breaker.record(False)
+        logger.exception('Thrad API call failed for key …%s: %s', api_key[-6:], str(e))
+        return None, None
+    breaker.record(True)
+    if not bid:
+        logger.warning('Thrad API returned no bid for key …%s', api_key[-6:])
+    return bid, (time.perf_counter() - started) * 1000
+
+
+def _request_bid(payload: dict) -> tuple[dict | None, float | None]:
+    """Get a bid within THRAD_AD_BUDGET_SECONDS, hedging across API keys.
+
+    The primary key goes first. If it fails, returns no bid, or has not
+    answered after THRAD_HEDGE_DELAY_SECONDS, the fallback key is tried
+    alongside it and the first bid wins. Keys whose breaker is open are
+    skipped without a call. Each call's HTTP timeout is the budget left
+    when it starts.
+
+    Returns (bid, latency in ms of the SSP answer it is based on). The
+    latency is None when the SSP never answered: every call failed or
+    timed out, or no call went out.
+    """
+    keys = []
+    for key in [settings.THRAD_API_KEY, settings.THRAD_API_KEY_FALLBACK]:
+        if key:
+            keys.append(key)
+        else:
+            logger.warning('Thrad API key is empty/missing, skipping')
+
+    deadline = time.monotonic() + settings.THRAD_AD_BUDGET_SECONDS
+    pending = set()
+    remaining = deque(keys)
+
+    def launch_next() -> bool:
+        while remaining:
+            key = remaining.popleft()
+            if _breaker(key).allow():
+                pending.add(_call_executor.submit(contextvars.copy_context().run, _attempt, key, payload, deadline))
+                return True
+            logger.info('Thrad circuit open for key …%s, skipping', key[-6:])
+        return False
+
+    launch_next()
+    hedge_at = time.monotonic() + settings.THRAD_HEDGE_DELAY_SECONDS
+    answered_ms = None
+    while pending:
+        now = time.monotonic()
+        if now >= deadline:
+            logger.warning('Thrad API budget of %ss exhausted', settings.THRAD_AD_BUDGET_SECONDS)
+            break
+        wake_at = min(deadline, hedge_at) if remaining else deadline
+        done, pending = wait(pending, timeout=wake_at - now, return_when=FIRST_COMPLETED)
+        for future in done:
+            bid, latency_ms = future.result()
+            if bid:
+                return bid, latency_ms
+            if latency_ms is not None:
+                answered_ms = latency_ms
+        if (done or time.monotonic() >= hedge_at) and launch_next():
+            hedge_at = time.monotonic() + settings.THRAD_HEDGE_DELAY_SECONDS
+    return None, answered_ms
+
+
+def _bid_cache_key(anon_id: str, chat_id: str, turn_number: int, messages: list) -> str:
+    window = json.dumps([[m['role'], m['content']] for m in messages], separators=(',', ':'))
+    digest = hashlib.sha256(window.encode()).hexdigest()[:32]
+    return f'{anon_id}:{chat_id}:{turn_number}:{digest}'
+
+
+def _cached_bid(cache_key: str) -> dict | None:
+    """Look a bid up in the in-process LRU, then the optional Redis tier.
+
+    {} is a cached answer without a bid; None means nothing is cached.
+    """
+    bid = _bid_cache.get(cache_key)
+    if bid is None and settings.THRAD_AD_CACHE_REDIS:
+        try:
+            bid = get_doc(f'ad_cache:{cache_key}')
+        except Exception:
+            logger.warning('Ad cache read from Redis failed', exc_info=True)
+        if bid is not None:
+            _bid_cache.set(cache_key, bid)
+    return bid
+
+
+def _fetch_bid(cache_key: str, payload: dict, cells: tuple) -> dict | None:
+    bid, latency_ms = _request_bid(payload)
+    # Only SSP answers say anything about fill: errors, timeouts and open
+    # breakers would otherwise read as no-fills and starve every cell
+    if latency_ms is not None:
+        fill_rate.record(cells, bool(bid), latency_ms)
+    if bid:
+        ttl = settings.THRAD_AD_CACHE_TTL_SECONDS
+    elif latency_ms is not None and settings.THRAD_AD_NO_BID_TTL_SECONDS > 0:
+        # The SSP answered without a bid: cache that as {} for a short while,
+        # so retries of the same state don't ask again, but a later one can
+        # still be filled. Failures aren't cached; the breakers handle them.
+        bid, ttl = {}, settings.THRAD_AD_NO_BID_TTL_SECONDS
+    else:
+        return bid
+    _bid_cache.set(cache_key, bid, ttl=ttl)
+    if settings.THRAD_AD_CACHE_REDIS:
+        try:
+            set_doc(f'ad_cache:{cache_key}', bid, ex=max(1, int(ttl)))
+        except Exception:
+            logger.warning('Ad cache write to Redis failed', exc_info=True)
+    return bid
+
+
 def get_thrad_ad(messages: list, user_id: str, chat_id: str, turn_number: int = 0) -> dict | None:
     """
     Call the Thrad SSP API to get a real-time ad bid (server-to-server).
 
-    Tries the primary API key first, then the fallback key.
+    Tries the primary API key first and hedges onto the fallback key, all
+    within the configured latency budget (see _request_bid).
     If both fail, returns a random mock ad so the UI never breaks.
+
+    Bids are cached per (user, chat, turn, message window), so reloads and
+    duplicate calls for an unchanged conversation don't go back to the SSP,
+    and identical requests in flight at the same time share one SSP call.
+    Answers without a bid are cached too, for THRAD_AD_NO_BID_TTL_SECONDS.
+    Requests unlikely to be filled are skipped (see fill_rate.py).
     """
     # Thrad requires minimum 2 messages (user + assistant, alternating)
     if len(messages) < 2:
@@ -83,7 +333,7 @@ def get_thrad_ad(messages: list, user_id: str, chat_id: str, turn_number: int =
         {
             'role': m['role'],
             'content': m['content'],
-            'timestamp': now,
+            'timestamp': m.get('timestamp') or now,
         }
         for m in messages
     ]
@@ -97,19 +347,27 @@ def get_thrad_ad(messages: list, user_id: str, chat_id: str, turn_number: int =
         'adtype': '',
     }
 
-    # Try primary key, then fallback key
-    for key in [settings.THRAD_API_KEY, settings.THRAD_API_KEY_FALLBACK]:
-        if not key:
-            logger.warning('Thrad API key is empty/missing, skipping')
-            continue
-        try:
-            bid = _call_thrad_api(key, payload)
-            if bid:
-                return bid
-            logger.warning('Thrad API returned no bid for key …%s', key[-6:])
-        except Exception as e:
-            logger.exception('Thrad API call failed for key …%s: %s', key[-6:], str(e))
+    cache_key = _bid_cache_key(anon_id, chat_id, turn_number, messages)
+    bid = _cached_bid(cache_key)
+    if bid is None:
+        cells = fill_rate.features(messages, turn_number)
+        if not fill_rate.should_request(cells):
+            return random.choice(MOCK_ADS)
+        bid = _bid_flights.do(cache_key, lambda: _fetch_bid(cache_key, payload, cells))
+    if bid:
+        return bid
 
     # Both keys failed or returned no bid — return mock ad
     logger.warning('All Thrad API keys failed; returning mock ad')
     return random.choice(MOCK_ADS)
+
+
+def submit_thrad_ad(messages: list, user_id: str, chat_id: str, turn_number: int = 0) -> Future:
+    """Start get_thrad_ad on a background worker and return its Future.
+
+    Runs in a copy of the caller's context so its spans land on the request.
+    """
+    return _executor.submit(
+        contextvars.copy_context().run,
+        get_thrad_ad, messages, user_id, chat_id, turn_number=turn_number,
+    )
@@ -0,0 +1,44 @@
+"""Storage backends: the Redis clients storage.py sends its commands through.
+
+STORAGE_BACKEND picks one:
+
+- 'upstash' (default): Vercel KV / Upstash over its REST API
+- 'redis': a self-hosted Redis over its native protocol, at REDIS_URL
+- 'sqlite': an embedded SQLite database in WAL mode, at SQLITE_STORAGE_PATH,
+  for single-node setups
+- 'memory': per-process dicts, for tests and benchmarks
+
+Each exposes the upstash_redis client API (commands, pipeline(), multi())
+with the same reply formatting, so storage code does not change between
+them. Only the configured backend's module is imported.
+"""
+import importlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+BACKENDS = {
+    'upstash': 'upstash',
+    'redis': 'resp',
+    'sqlite': 'sqlite',
+    'memory': 'memory',
+}
+
+
+def _backend():
+    name = settings.STORAGE_BACKEND
+    if name not in BACKENDS:
+        raise ImproperlyConfigured(
+            f'Unknown STORAGE_BACKEND {name!r}; expected one of {", ".join(BACKENDS)}'
+        )
+    return importlib.import_module(f'{__name__}.{BACKENDS[name]}')
+
+
+def create_client():
+    """A new sync client for the configured backend."""
+    return _backend().create_client()
+
+
+def create_async_client():
+    """A new async client for the configured backend, bound to the running loop."""
+    return _backend().create_async_client()
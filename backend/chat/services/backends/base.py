@@ -0,0 +1,153 @@
+"""The client API shared by the non-Upstash backends.
+
+Backends subclass Client (or AsyncClient) and implement _run(commands,
+transaction), which sends a batch of commands in one round trip and returns
+their raw replies: str, int, None or nested lists, as the Upstash REST API
+returns them, with an UpstashError in place of each error reply. Everything
+else — the command methods, pipeline() and multi(), and the reply
+formatting (HGETALL as a dict, scores as floats, ...) — comes from
+upstash_redis, so storage code runs unchanged on every backend.
+"""
+import asyncio
+import contextvars
+
+from upstash_redis.commands import Commands
+from upstash_redis.errors import UpstashError
+from upstash_redis.format import cast_response
+
+from .. import timing
+
+
+class RoundTripCounter:
+    """Number of round trips made to the storage backend within one request."""
+
+    __slots__ = ('count',)
+
+    def __init__(self):
+        self.count = 0
+
+
+_round_trips = contextvars.ContextVar('redis_round_trips', default=None)
+
+
+def count_round_trips() -> RoundTripCounter:
+    """Start counting storage round trips made from the current context."""
+    counter = RoundTripCounter()
+    _round_trips.set(counter)
+    return counter
+
+
+def count_round_trip():
+    counter = _round_trips.get()
+    if counter is not None:
+        counter.count += 1
+
+
+def _results(commands: list, replies: list, client) -> list:
+    for reply in replies:
+        if isinstance(reply, UpstashError):
+            raise reply
+    return [cast_response(command, reply, client) for command, reply in zip(commands, replies)]
+
+
+class Client(Commands):
+    """Sync client: each command, pipeline or transaction is one _run()."""
+
+    def _run(self, commands: list, transaction: bool) -> list:
+        raise NotImplementedError
+
+    def _send(self, commands: list, transaction: bool) -> list:
+        if not commands:
+            return []
+        count_round_trip()
+        with timing.span('redis'):
+            replies = self._run(commands, transaction)
+        return _results(commands, replies, self)
+
+    def execute(self, command: list):
+        return self._send([command], False)[0]
+
+    def pipeline(self) -> 'Pipeline':
+        return Pipeline(self, transaction=False)
+
+    def multi(self) -> 'Pipeline':
+        return Pipeline(self, transaction=True)
+
+    def close(self):
+        pass
+
+
+class Pipeline(Commands):
+    """Queues commands until exec(); multi() pipelines run them atomically."""
+
+    def __init__(self, client, transaction: bool):
+        self._client = client
+        self._transaction = transaction
+        self._command_stack = []
+
+    def execute(self, command: list) -> 'Pipeline':
+        self._command_stack.append(command)
+        return self
+
+    def exec(self) -> list:
+        commands, self._command_stack = self._command_stack, []
+        return self._client._send(commands, self._transaction)
+
+    def reset(self):
+        self._command_stack = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.reset()
+
+
+class AsyncClient(Commands):
+    """Async client: command methods return awaitables, like upstash_redis.asyncio.Redis."""
+
+    async def _run(self, commands: list, transaction: bool) -> list:
+        raise NotImplementedError
+
+    async def _send(self, commands: list, transaction: bool) -> list:
+        if not commands:
+            return []
+        count_round_trip()
+        with timing.span('redis'):
+            replies = await self._run(commands, transaction)
+        return _results(commands, replies, self)
+
+    async def execute(self, command: list):
+        return (await self._send([command], False))[0]
+
+    def pipeline(self) -> 'AsyncPipeline':
+        return AsyncPipeline(self, transaction=False)
+
+    def multi(self) -> 'AsyncPipeline':
+        return AsyncPipeline(self, transaction=True)
+
+    async def close(self):
+        pass
+
+
+class AsyncPipeline(Pipeline):
+    async def exec(self) -> list:
+        commands, self._command_stack = self._command_stack, []
+        return await self._client._send(commands, self._transaction)
+
+
+class ThreadedAsyncClient(AsyncClient):
+    """Async client over a sync one whose _run() blocks on local I/O.
+
+    With offload, each batch runs on the default executor so the event loop
+    keeps serving other requests meanwhile.
+    """
+
+    def __init__(self, client: Client, offload: bool = True):
+        self._client = client
+        self._offload = offload
+
+    async def _run(self, commands: list, transaction: bool) -> list:
+        if self._offload:
+            return await asyncio.to_thread(self._client._run, commands, transaction)
+        return self._client._run(commands, transaction)
@@ -0,0 +1,467 @@
+"""A Redis command engine over in-process data structures.
+
+Covers the commands the app uses on strings, hashes, lists, sets, sorted
+sets and streams, with replies shaped like the Upstash REST API's (strings,
+integers, None and nested lists). EVAL and EVALSHA run the Python version
+registered for a script (see script.py) instead of its Lua source. The memory backend runs it over plain
+dicts; the sqlite backend over keys loaded from its database; the
+benchmark fakes serve it over HTTP and RESP.
+"""
+import fnmatch
+import hashlib
+import threading
+import time
+
+from upstash_redis.errors import UpstashError
+
+
+class CommandError(UpstashError):
+    """An error reply (raised like the Upstash client raises one)."""
+
+
+# Python versions of the Lua scripts, by SHA1 of the script's source
+_scripts = {}
+
+
+def register_script(sha: str, local):
+    _scripts[sha] = local
+
+
+def _text(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _score(value: str) -> float:
+    if value in ('+inf', 'inf'):
+        return float('inf')
+    if value == '-inf':
+        return float('-inf')
+    return float(value)
+
+
+def _format_score(score: float) -> str:
+    return str(int(score)) if score == int(score) else repr(score)
+
+
+class Engine:
+    """Redis commands over `data` (key → (kind, value)) and `expires` (key → epoch seconds).
+
+    Both default to plain dicts; any mapping with get/pop/in/item access works.
+    Keys expire lazily, when a command next touches them. `scripts` is the
+    set of script SHA1s EVALSHA accepts, filled by EVAL and SCRIPT LOAD.
+    """
+
+    def __init__(self, data=None, expires=None, scripts=None):
+        self.data = {} if data is None else data
+        self.expires = {} if expires is None else expires
+        self.scripts = set() if scripts is None else scripts
+        self.lock = threading.RLock()
+
+    def execute(self, command: list):
+        with self.lock:
+            name = _text(command[0]).lower()
+            handler = getattr(self, f'cmd_{name}', None)
+            if handler is None:
+                raise CommandError(f'ERR unknown command {name.upper()}')
+            return handler(*[_text(arg) for arg in command[1:]])
+
+    def run(self, commands: list) -> list:
+        """Replies to a batch of commands, with the error in place of each failed one."""
+        replies = []
+        with self.lock:
+            for command in commands:
+                try:
+                    replies.append(self.execute(command))
+                except CommandError as e:
+                    replies.append(e)
+        return replies
+
+    def _alive(self, key) -> bool:
+        expires_at = self.expires.get(key)
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _get(self, key, kind):
+        if not self._alive(key):
+            return None
+        stored_kind, value = self.data[key]
+        if stored_kind != kind:
+            raise CommandError('WRONGTYPE Operation against a key holding the wrong kind of value')
+        return value
+
+    def _ensure(self, key, kind, factory):
+        value = self._get(key, kind)
+        if value is None:
+            value = factory()
+            self.data[key] = (kind, value)
+        return value
+
+    def _drop_if_empty(self, key, value):
+        if not value:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+
+    # ── Keys and strings ──
+
+    def cmd_ping(self):
+        return 'PONG'
+
+    def cmd_get(self, key):
+        return self._get(key, 'string')
+
+    def cmd_mget(self, *keys):
+        return [
+            self.data[key][1] if self._alive(key) and self.data[key][0] == 'string' else None
+            for key in keys
+        ]
+
+    def cmd_set(self, key, value, *options):
+        options = [o.upper() for o in options]
+        expires_at = None
+        flags = set()
+        i = 0
+        while i < len(options):
+            if options[i] in ('EX', 'PX'):
+                seconds = float(options[i + 1]) / (1000 if options[i] == 'PX' else 1)
+                expires_at = time.time() + seconds
+                i += 2
+                continue
+            flags.add(options[i])
+            i += 1
+        exists = self._alive(key)
+        old = self.data[key][1] if exists and self.data[key][0] == 'string' else None
+        if ('NX' in flags and exists) or ('XX' in flags and not exists):
+            return old if 'GET' in flags else None
+        self.data[key] = ('string', value)
+        if expires_at is not None:
+            self.expires[key] = expires_at
+        elif 'KEEPTTL' not in flags:
+            self.expires.pop(key, None)
+        return old if 'GET' in flags else 'OK'
+
+    def cmd_incrby(self, key, amount):
+        value = int(self._get(key, 'string') or 0) + int(amount)
+        self.data[key] = ('string', str(value))
+        return value
+
+    def cmd_incr(self, key):
+        return self.cmd_incrby(key, 1)
+
+    def cmd_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_type(self, key):
+        return self.data[key][0] if self._alive(key) else 'none'
+
+    def cmd_expire(self, key, seconds, *options):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = time.time() + float(seconds)
+        return 1
+
+    def cmd_ttl(self, key):
+        if not self._alive(key):
+            return -2
+        expires_at = self.expires.get(key)
+        return -1 if expires_at is None else max(0, round(expires_at - time.time()))
+
+    def cmd_scan(self, cursor, *options):
+        pattern, count, kind = '*', 10, None
+        for i in range(0, len(options) - 1, 2):
+            option = options[i].upper()
+            if option == 'MATCH':
+                pattern = options[i + 1]
+            elif option == 'COUNT':
+                count = int(options[i + 1])
+            elif option == 'TYPE':
+                kind = options[i + 1]
+        keys = sorted(key for key in list(self.data) if self._alive(key))
+        start = int(cursor)
+        next_cursor = start + count if start + count < len(keys) else 0
+        batch = [
+            key for key in keys[start:start + count]
+            if fnmatch.fnmatchcase(key, pattern) and (kind is None or self.data[key][0] == kind)
+        ]
+        return [str(next_cursor), batch]
+
+    def cmd_flushall(self):
+        self.data.clear()
+        self.expires.clear()
+        return 'OK'
+
+    # ── Scripts ──
+
+    def _load_script(self, sha):
+        if sha not in _scripts:
+            raise CommandError(f'ERR no Python version registered for script {sha}')
+        self.scripts.add(sha)
+
+    def _call_script(self, sha, numkeys, args):
+        n = int(numkeys)
+        return _scripts[sha](self, list(args[:n]), list(args[n:]))
+
+    def cmd_eval(self, body, numkeys, *args):
+        sha = hashlib.sha1(body.encode()).hexdigest()
+        self._load_script(sha)
+        return self._call_script(sha, numkeys, args)
+
+    def cmd_evalsha(self, sha, numkeys, *args):
+        if sha not in self.scripts:
+            raise CommandError('NOSCRIPT No matching script. Please use EVAL.')
+        return self._call_script(sha, numkeys, args)
+
+    def cmd_script(self, subcommand, *args):
+        subcommand = subcommand.upper()
+        if subcommand == 'LOAD':
+            sha = hashlib.sha1(args[0].encode()).hexdigest()
+            self._load_script(sha)
+            return sha
+        if subcommand == 'EXISTS':
+            return [int(sha in self.scripts) for sha in args]
+        if subcommand == 'FLUSH':
+            self.scripts.clear()
+            return 'OK'
+        raise CommandError(f'ERR unknown subcommand SCRIPT {subcommand}')
+
+    # ── Hashes ──
+
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise CommandError("ERR wrong number of arguments for 'hset' command")
+        fields = self._ensure(key, 'hash', dict)
+        added = 0
+        for i in range(0, len(pairs), 2):
+            added += pairs[i] not in fields
+            fields[pairs[i]] = pairs[i + 1]
+        return added
+
+    def cmd_hsetnx(self, key, field, value):
+        fields = self._ensure(key, 'hash', dict)
+        if field in fields:
+            return 0
+        fields[field] = value
+        return 1
+
+    def cmd_hget(self, key, field):
+        return (self._get(key, 'hash') or {}).get(field)
+
+    def cmd_hmget(self, key, *fields):
+        stored = self._get(key, 'hash') or {}
+        return [stored.get(field) for field in fields]
+
+    def cmd_hgetall(self, key):
+        return [item for pair in (self._get(key, 'hash') or {}).items() for item in pair]
+
+    def cmd_hdel(self, key, *fields):
+        stored = self._get(key, 'hash') or {}
+        deleted = sum(1 for field in fields if stored.pop(field, None) is not None)
+        self._drop_if_empty(key, stored)
+        return deleted
+
+    def cmd_hexists(self, key, field):
+        return int(field in (self._get(key, 'hash') or {}))
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, 'hash') or {})
+
+    def cmd_hincrby(self, key, field, amount):
+        fields = self._ensure(key, 'hash', dict)
+        value = int(fields.get(field, 0)) + int(amount)
+        fields[field] = str(value)
+        return value
+
+    # ── Lists ──
+
+    def cmd_rpush(self, key, *values):
+        items = self._ensure(key, 'list', list)
+        items.extend(values)
+        return len(items)
+
+    def cmd_lpush(self, key, *values):
+        items = self._ensure(key, 'list', list)
+        for value in values:
+            items.insert(0, value)
+        return len(items)
+
+    @staticmethod
+    def _slice(items, start, stop):
+        start, stop = int(start), int(stop)
+        if start < 0:
+            start = max(0, len(items) + start)
+        if stop < 0:
+            stop = len(items) + stop
+        return items[start:stop + 1]
+
+    def cmd_lrange(self, key, start, stop):
+        return self._slice(self._get(key, 'list') or [], start, stop)
+
+    def cmd_llen(self, key):
+        return len(self._get(key, 'list') or [])
+
+    def cmd_ltrim(self, key, start, stop):
+        items = self._get(key, 'list')
+        if items is not None:
+            items[:] = self._slice(items, start, stop)
+            self._drop_if_empty(key, items)
+        return 'OK'
+
+    def cmd_lrem(self, key, count, value):
+        items = self._get(key, 'list') or []
+        count = int(count)
+        matches = [i for i, item in enumerate(items) if item == value]
+        if count > 0:
+            matches = matches[:count]
+        elif count < 0:
+            matches = matches[count:]
+        for i in reversed(matches):
+            del items[i]
+        self._drop_if_empty(key, items)
+        return len(matches)
+
+    def cmd_lpop(self, key, count=None):
+        items = self._get(key, 'list')
+        if not items:
+            return None
+        if count is None:
+            value = items.pop(0)
+        else:
+            value, items[:] = items[:int(count)], items[int(count):]
+        self._drop_if_empty(key, items)
+        return value
+
+    # ── Sets ──
+
+    def cmd_sadd(self, key, *members):
+        stored = self._ensure(key, 'set', set)
+        added = len(set(members) - stored)
+        stored.update(members)
+        return added
+
+    def cmd_srem(self, key, *members):
+        stored = self._get(key, 'set') or set()
+        removed = len(stored & set(members))
+        stored.difference_update(members)
+        self._drop_if_empty(key, stored)
+        return removed
+
+    def cmd_smembers(self, key):
+        return sorted(self._get(key, 'set') or set())
+
+    def cmd_scard(self, key):
+        return len(self._get(key, 'set') or set())
+
+    # ── Sorted sets ──
+
+    def cmd_zadd(self, key, *args):
+        scores = self._ensure(key, 'zset', dict)
+        flags = set()
+        i = 0
+        while args[i].upper() in ('NX', 'XX', 'GT', 'LT', 'CH'):
+            flags.add(args[i].upper())
+            i += 1
+        added = 0
+        for j in range(i, len(args), 2):
+            score, member = _score(args[j]), args[j + 1]
+            exists = member in scores
+            if ('NX' in flags and exists) or ('XX' in flags and not exists):
+                continue
+            if exists and (('GT' in flags and score <= scores[member]) or ('LT' in flags and score >= scores[member])):
+                continue
+            added += not exists
+            scores[member] = score
+        return added
+
+    def cmd_zrem(self, key, *members):
+        scores = self._get(key, 'zset') or {}
+        removed = sum(1 for member in members if scores.pop(member, None) is not None)
+        self._drop_if_empty(key, scores)
+        return removed
+
+    def cmd_zcard(self, key):
+        return len(self._get(key, 'zset') or {})
+
+    def cmd_zscore(self, key, member):
+        scores = self._get(key, 'zset') or {}
+        return _format_score(scores[member]) if member in scores else None
+
+    def _by_score(self, key, low, high, reverse, options):
+        def bound(value):
+            if value.startswith('('):
+                return _score(value[1:]), True
+            return _score(value), False
+        (low, low_open), (high, high_open) = bound(low), bound(high)
+        items = [
+            (member, score)
+            for member, score in sorted((self._get(key, 'zset') or {}).items(), key=lambda kv: (kv[1], kv[0]))
+            if (score > low if low_open else score >= low) and (score < high if high_open else score <= high)
+        ]
+        if reverse:
+            items.reverse()
+        options = [o.upper() for o in options]
+        if 'LIMIT' in options:
+            i = options.index('LIMIT')
+            offset, count = int(options[i + 1]), int(options[i + 2])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+        withscores = 'WITHSCORES' in options
+        reply = []
+        for member, score in items:
+            reply.append(member)
+            if withscores:
+                reply.append(_format_score(score))
+        return reply
+
+    def cmd_zrangebyscore(self, key, low, high, *options):
+        return self._by_score(key, low, high, False, options)
+
+    def cmd_zrevrangebyscore(self, key, high, low, *options):
+        return self._by_score(key, low, high, True, options)
+
+    # ── Streams (explicit or auto ids; no trimming or consumer groups) ──
+
+    @staticmethod
+    def _stream_id(value: str, default_seq: int) -> tuple[int, int]:
+        ms, _, seq = value.partition('-')
+        return int(ms), int(seq) if seq else default_seq
+
+    def cmd_xadd(self, key, *args):
+        entries = self._ensure(key, 'stream', list)
+        requested, fields = args[0], list(args[1:])
+        last = entries[-1][0] if entries else (0, 0)
+        if requested == '*':
+            ms = max(int(time.time() * 1000), last[0])
+            entry_id = (ms, last[1] + 1 if ms == last[0] else 0)
+        else:
+            entry_id = self._stream_id(requested, 0)
+            if entry_id <= last:
+                raise CommandError('ERR The ID specified in XADD is equal or smaller than the target stream top item')
+        entries.append((entry_id, fields))
+        return f'{entry_id[0]}-{entry_id[1]}'
+
+    def cmd_xrange(self, key, start, end, *options):
+        low = (0, 0) if start == '-' else self._stream_id(start, 0)
+        high = (float('inf'), 0) if end == '+' else self._stream_id(end, 2 ** 63)
+        count = int(options[1]) if len(options) > 1 and options[0].upper() == 'COUNT' else None
+        reply = [
+            [f'{ms}-{seq}', list(fields)]
+            for (ms, seq), fields in (self._get(key, 'stream') or [])
+            if low <= (ms, seq) <= high
+        ]
+        return reply[:count] if count is not None else reply
+
+    def cmd_xlen(self, key):
+        return len(self._get(key, 'stream') or [])
@@ -0,0 +1,29 @@
+"""In-process storage (STORAGE_BACKEND=memory), for tests and benchmarks.
+
+Data lives in one Engine per process and is gone when the process exits.
+Every batch runs under the engine's lock, so pipelines and multi() are
+both atomic.
+"""
+from .base import Client, ThreadedAsyncClient
+from .engine import Engine
+
+engine = Engine()
+
+
+class MemoryClient(Client):
+    def _run(self, commands: list, transaction: bool) -> list:
+        return engine.run(commands)
+
+
+def create_client() -> MemoryClient:
+    return MemoryClient()
+
+
+def create_async_client() -> ThreadedAsyncClient:
+    # Nothing blocks, so there is no point handing batches to a thread
+    return ThreadedAsyncClient(MemoryClient(), offload=False)
+
+
+def flush():
+    """Drop every key (between tests)."""
+    engine.execute(['FLUSHALL'])
@@ -0,0 +1,346 @@
+"""Self-hosted Redis over its native protocol (STORAGE_BACKEND=redis).
+
+Speaks RESP2 to REDIS_URL over TCP (redis://) or TLS (rediss://), e.g.
+redis://:password@localhost:6379/0. A pipeline is written in one send and
+its replies read back in order, so like an Upstash /pipeline request it
+costs one round trip; multi() wraps the batch in MULTI/EXEC. Connections
+are pooled per process (up to KV_POOL_MAXSIZE, idle ones closed after
+KV_KEEPALIVE_SECONDS) and reused across requests.
+
+Values are str both ways, as with the Upstash client. Bulk replies are
+decoded as UTF-8 with surrogateescape, so a value that is not valid UTF-8
+(written by another client) reads back without an error and is written
+back byte for byte.
+
+This is a small RESP2 client rather than a redis-py dependency so that it
+plugs into the same Client/Pipeline layer (backends/base.py) and reply
+formats as the Upstash backend, sync and async, and adds no package to the
+serverless bundle; it only needs the commands that layer sends.
+"""
+import asyncio
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+from upstash_redis.errors import UpstashError
+
+from .base import AsyncClient, Client
+
+
+class _StaleConnection(ConnectionError):
+    """A pooled connection was closed while idle; nothing was sent on it."""
+
+
+class Address:
+    """Where and how to connect, parsed from a redis:// or rediss:// URL."""
+
+    def __init__(self, url: str):
+        parts = urlsplit(url)
+        if parts.scheme not in ('redis', 'rediss'):
+            raise ValueError(f'REDIS_URL must start with redis:// or rediss://, got {url!r}')
+        self.host = parts.hostname or 'localhost'
+        self.port = parts.port or 6379
+        self.tls = parts.scheme == 'rediss'
+        self.username = unquote(parts.username) if parts.username else None
+        self.password = unquote(parts.password) if parts.password else None
+        self.db = int(parts.path.strip('/') or 0)
+
+    def setup_commands(self) -> list:
+        commands = []
+        if self.password:
+            commands.append(['AUTH', self.username, self.password] if self.username else ['AUTH', self.password])
+        if self.db:
+            commands.append(['SELECT', self.db])
+        return commands
+
+
+# ── Protocol ──
+
+def _text(data: bytes) -> str:
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def _encode_arg(arg) -> bytes:
+    if isinstance(arg, bytes):
+        return arg
+    if isinstance(arg, str):
+        return arg.encode('utf-8', 'surrogateescape')
+    if isinstance(arg, (int, float)) and not isinstance(arg, bool):
+        return str(arg).encode()
+    # As the Upstash client sends anything else
+    return json.dumps(arg).encode()
+
+
+def pack(commands: list) -> bytes:
+    """RESP arrays of bulk strings for a batch of commands."""
+    out = []
+    for command in commands:
+        out.append(b'*%d\r\n' % len(command))
+        for arg in command:
+            data = _encode_arg(arg)
+            out.append(b'$%d\r\n%s\r\n' % (len(data), data))
+    return b''.join(out)
+
+
+def _simple(kind: bytes, rest: bytes):
+    if kind == b'+':
+        return rest.decode()
+    if kind == b'-':
+        return UpstashError(rest.decode())
+    if kind == b':':
+        return int(rest)
+    raise ConnectionError(f'Unexpected reply type from Redis: {kind!r}')
+
+
+def _read_reply(file):
+    line = file.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Redis closed the connection')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'$':
+        size = int(rest)
+        if size < 0:
+            return None
+        data = file.read(size + 2)
+        if len(data) != size + 2:
+            raise ConnectionError('Redis closed the connection')
+        return _text(data[:-2])
+    if kind == b'*':
+        size = int(rest)
+        return None if size < 0 else [_read_reply(file) for _ in range(size)]
+    return _simple(kind, rest)
+
+
+async def _aread_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line.endswith(b'\r\n'):
+        raise ConnectionError('Redis closed the connection')
+    kind, rest = line[:1], line[1:-2]
+    if kind == b'$':
+        size = int(rest)
+        if size < 0:
+            return None
+        return _text((await reader.readexactly(size + 2))[:-2])
+    if kind == b'*':
+        size = int(rest)
+        return None if size < 0 else [await _aread_reply(reader) for _ in range(size)]
+    return _simple(kind, rest)
+
+
+def _batch(commands: list, transaction: bool) -> list:
+    return [['MULTI'], *commands, ['EXEC']] if transaction else commands
+
+
+def _unbatch(replies: list, transaction: bool) -> list:
+    if not transaction:
+        return replies
+    result = replies[-1]
+    if isinstance(result, list):
+        return result
+    # EXECABORT: report the error of the command that failed to queue
+    queued = replies[1:-1]
+    error = next((r for r in queued if isinstance(r, UpstashError)), result)
+    return [error] * len(queued)
+
+
+def _check_setup(replies: list):
+    for reply in replies:
+        if isinstance(reply, UpstashError):
+            raise reply
+
+
+# ── Sync ──
+
+class _Connection:
+    def __init__(self, address: Address):
+        sock = socket.create_connection((address.host, address.port), timeout=settings.KV_TIMEOUT_SECONDS)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if address.tls:
+            sock = ssl.create_default_context().wrap_socket(sock, server_hostname=address.host)
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        self.used_at = time.monotonic()
+        setup = address.setup_commands()
+        if setup:
+            _check_setup(self.call(setup))
+
+    def call(self, commands: list, reused: bool = False) -> list:
+        try:
+            self.sock.sendall(pack(commands))
+            first = self.file.peek(1) if reused else True
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise _StaleConnection(str(e)) if reused else e
+        if not first:
+            raise _StaleConnection('Redis closed the idle connection')
+        replies = [_read_reply(self.file) for _ in commands]
+        self.used_at = time.monotonic()
+        return replies
+
+    def close(self):
+        try:
+            self.file.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _Pool:
+    """At most `maxsize` connections; the most recently used is reused first."""
+
+    def __init__(self, address: Address, maxsize: int):
+        self.address = address
+        self._slots = threading.BoundedSemaphore(maxsize)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def _checkout(self) -> _Connection | None:
+        with self._lock:
+            if self._pid != os.getpid():
+                # Sockets inherited across fork() belong to the parent
+                self._idle, self._pid = [], os.getpid()
+            expired_before = time.monotonic() - settings.KV_KEEPALIVE_SECONDS
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.used_at >= expired_before:
+                    return conn
+                conn.close()
+        return None
+
+    def _checkin(self, conn: _Connection):
+        with self._lock:
+            self._idle.append(conn)
+
+    def run(self, commands: list) -> list:
+        if not self._slots.acquire(timeout=settings.KV_TIMEOUT_SECONDS):
+            raise TimeoutError('Timed out waiting for a Redis connection')
+        try:
+            conn = self._checkout()
+            try:
+                if conn is None:
+                    conn = _Connection(self.address)
+                    replies = conn.call(commands)
+                else:
+                    try:
+                        replies = conn.call(commands, reused=True)
+                    except _StaleConnection:
+                        conn.close()
+                        conn = _Connection(self.address)
+                        replies = conn.call(commands)
+            except BaseException:
+                if conn is not None:
+                    conn.close()
+                raise
+            self._checkin(conn)
+            return replies
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RespClient(Client):
+    def __init__(self, url: str, maxsize: int):
+        self._pool = _Pool(Address(url), maxsize)
+
+    def _run(self, commands: list, transaction: bool) -> list:
+        return _unbatch(self._pool.run(_batch(commands, transaction)), transaction)
+
+    def close(self):
+        self._pool.close()
+
+
+# ── Async ──
+
+class _AsyncConnection:
+    @classmethod
+    async def open(cls, address: Address) -> '_AsyncConnection':
+        conn = cls()
+        conn.reader, conn.writer = await asyncio.open_connection(
+            address.host, address.port,
+            ssl=ssl.create_default_context() if address.tls else None,
+            server_hostname=address.host if address.tls else None,
+        )
+        conn.used_at = time.monotonic()
+        setup = address.setup_commands()
+        if setup:
+            _check_setup(await conn.call(setup))
+        return conn
+
+    async def call(self, commands: list) -> list:
+        self.writer.write(pack(commands))
+        await self.writer.drain()
+        replies = [await _aread_reply(self.reader) for _ in commands]
+        self.used_at = time.monotonic()
+        return replies
+
+    def close(self):
+        self.writer.close()
+
+
+class _AsyncPool:
+    """_Pool for one event loop."""
+
+    def __init__(self, address: Address, maxsize: int):
+        self.address = address
+        self._slots = asyncio.Semaphore(maxsize)
+        self._idle = []
+
+    def _checkout(self) -> _AsyncConnection | None:
+        expired_before = time.monotonic() - settings.KV_KEEPALIVE_SECONDS
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.used_at >= expired_before and not conn.reader.at_eof():
+                return conn
+            conn.close()
+        return None
+
+    async def _call(self, commands: list) -> tuple:
+        conn = self._checkout()
+        try:
+            if conn is None:
+                conn = await _AsyncConnection.open(self.address)
+            return conn, await conn.call(commands)
+        except BaseException:
+            if conn is not None:
+                conn.close()
+            raise
+
+    async def run(self, commands: list) -> list:
+        async with self._slots:
+            conn, replies = await asyncio.wait_for(self._call(commands), settings.KV_TIMEOUT_SECONDS)
+            self._idle.append(conn)
+            return replies
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class AsyncRespClient(AsyncClient):
+    def __init__(self, url: str, maxsize: int):
+        self._pool = _AsyncPool(Address(url), maxsize)
+
+    async def _run(self, commands: list, transaction: bool) -> list:
+        return _unbatch(await self._pool.run(_batch(commands, transaction)), transaction)
+
+    async def close(self):
+        await self._pool.close()
+
+
+def create_client() -> RespClient:
+    return RespClient(settings.REDIS_URL, settings.KV_POOL_MAXSIZE)
+
+
+def create_async_client() -> AsyncRespClient:
+    return AsyncRespClient(settings.REDIS_URL, settings.KV_POOL_MAXSIZE)
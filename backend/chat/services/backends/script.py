@@ -0,0 +1,45 @@
+"""Server-side Lua scripts, called by SHA1 and loaded on first use.
+
+A Script runs with EVALSHA; if the server answers NOSCRIPT (first call, or
+after a restart or SCRIPT FLUSH) it is sent once with EVAL, which also
+caches it, so every call after the first is a single round trip. Scripts
+run atomically on the server, which makes a read-modify-write safe without
+WATCH or a lock.
+
+The backends built on engine.Engine (memory, sqlite and the benchmark
+fakes) have no Lua interpreter: each Script also carries the same operation
+in Python, local(engine, keys, args), which they run under the engine's
+lock in place of the Lua source.
+"""
+import hashlib
+
+from upstash_redis.errors import UpstashError
+
+from .engine import register_script
+
+
+def _noscript(error: UpstashError) -> bool:
+    return 'NOSCRIPT' in str(error)
+
+
+class Script:
+    def __init__(self, lua: str, local):
+        self.lua = lua
+        self.sha = hashlib.sha1(lua.encode()).hexdigest()
+        register_script(self.sha, local)
+
+    def __call__(self, client, keys: list, args: list):
+        try:
+            return client.evalsha(self.sha, keys, args)
+        except UpstashError as e:
+            if not _noscript(e):
+                raise
+        return client.eval(self.lua, keys, args)
+
+    async def acall(self, client, keys: list, args: list):
+        try:
+            return await client.evalsha(self.sha, keys, args)
+        except UpstashError as e:
+            if not _noscript(e):
+                raise
+        return await client.eval(self.lua, keys, args)
@@ -0,0 +1,487 @@
+"""Embedded storage in SQLite (STORAGE_BACKEND=sqlite), for single-node setups.
+
+The database at SQLITE_STORAGE_PATH is opened in WAL mode, so readers never
+wait on the writer. Each key is one row in kv holding its type and expiry,
+and its value for strings, sets, sorted sets and streams (JSON for the last
+three). A hash has one kv_hash row per field and a list one kv_list row per
+element, so HSET writes one row and RPUSH adds rows without reading the rest
+of the list. A batch of commands runs the Engine over the rows it touches
+inside one transaction and writes back only the rows that changed, so every
+pipeline is atomic and processes can share the file. Batches with a write
+command take the write lock up front (BEGIN IMMEDIATE); read-only batches
+use a deferred BEGIN, which reads a snapshot without ever taking it, and
+leave keys they find expired to the periodic purge.
+"""
+import fnmatch
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping, MutableSequence
+from pathlib import Path
+
+from django.conf import settings
+
+from .base import Client, ThreadedAsyncClient
+from .engine import Engine
+
+_SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS kv (
+        key TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        expires_at REAL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS kv_hash (
+        key TEXT NOT NULL,
+        field TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (key, field)
+    ) WITHOUT ROWID
+    ''',
+    # A list's positions are contiguous but need not start at 0, so LPUSH
+    # and LPOP add or remove rows at the front without renumbering the rest
+    '''
+    CREATE TABLE IF NOT EXISTS kv_list (
+        key TEXT NOT NULL,
+        position INTEGER NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (key, position)
+    ) WITHOUT ROWID
+    ''',
+)
+_PURGE_INTERVAL_SECONDS = 60
+
+# Commands that never change a row; a batch of only these runs without the write lock
+_READ_COMMANDS = frozenset({
+    'PING', 'GET', 'MGET', 'EXISTS', 'TYPE', 'TTL', 'SCAN',
+    'HGET', 'HMGET', 'HGETALL', 'HEXISTS', 'HLEN',
+    'LRANGE', 'LLEN', 'SMEMBERS', 'SCARD',
+    'ZCARD', 'ZSCORE', 'ZRANGEBYSCORE', 'ZREVRANGEBYSCORE',
+    'XRANGE', 'XLEN',
+})
+
+
+def _dump(kind: str, value) -> str:
+    if kind == 'string':
+        return value
+    if kind in ('hash', 'list'):
+        return ''  # the value is in kv_hash or kv_list
+    if kind == 'set':
+        return json.dumps(sorted(value))
+    if kind == 'stream':
+        return json.dumps([[ms, seq, fields] for (ms, seq), fields in value])
+    return json.dumps(value)
+
+
+def _load(kind: str, text: str):
+    if kind == 'string':
+        return text
+    value = json.loads(text)
+    if kind == 'set':
+        return set(value)
+    if kind == 'stream':
+        return [((ms, seq), fields) for ms, seq, fields in value]
+    return value
+
+
+class _Hash(MutableMapping):
+    """A stored hash's fields, read one at a time until the whole hash is needed."""
+
+    def __init__(self, conn: sqlite3.Connection, key: str):
+        self._conn = conn
+        self._key = key
+        self._fields = {}  # field → value, or None if missing
+        self._complete = False  # every stored field is in _fields
+        self._changed = set()
+        self._replace = False  # drop the stored fields first
+
+    @classmethod
+    def replacing(cls, conn: sqlite3.Connection, key: str, fields: dict) -> '_Hash':
+        """A hash written in full over whatever the key held."""
+        stored = cls(conn, key)
+        stored._fields, stored._complete, stored._replace = dict(fields), True, True
+        stored._changed = set(fields)
+        return stored
+
+    def _load_all(self):
+        if not self._complete:
+            for field, value in self._conn.execute('SELECT field, value FROM kv_hash WHERE key = ?', (self._key,)):
+                self._fields.setdefault(field, value)  # keeps this batch's changes
+            self._complete = True
+
+    def __getitem__(self, field):
+        if field not in self._fields and not self._complete:
+            stored = self._conn.execute(
+                'SELECT value FROM kv_hash WHERE key = ? AND field = ?', (self._key, field),
+            ).fetchone()
+            self._fields[field] = stored and stored[0]
+        value = self._fields.get(field)
+        if value is None:
+            raise KeyError(field)
+        return value
+
+    def __setitem__(self, field, value):
+        self._fields[field] = value
+        self._changed.add(field)
+
+    def __delitem__(self, field):
+        self[field]  # KeyError if missing
+        self._fields[field] = None
+        self._changed.add(field)
+
+    def __iter__(self):
+        self._load_all()
+        return iter([field for field, value in self._fields.items() if value is not None])
+
+    def __len__(self):
+        self._load_all()
+        return sum(value is not None for value in self._fields.values())
+
+    def commit(self):
+        if self._replace:
+            self._conn.execute('DELETE FROM kv_hash WHERE key = ?', (self._key,))
+        for field in self._changed:
+            value = self._fields[field]
+            if value is None:
+                self._conn.execute('DELETE FROM kv_hash WHERE key = ? AND field = ?', (self._key, field))
+            else:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO kv_hash (key, field, value) VALUES (?, ?, ?)', (self._key, field, value),
+                )
+
+
+class _List(MutableSequence):
+    """A stored list's elements. Appending only counts them; anything else reads them all."""
+
+    def __init__(self, conn: sqlite3.Connection, key: str):
+        self._conn = conn
+        self._key = key
+        self._stored = None  # [(position, value)] as read, once needed
+        self._items = None  # the current elements, once read
+        self._bounds = None  # (first, count) of the stored positions
+        self._appended = []  # pushed on the right before the elements were read
+
+    @classmethod
+    def replacing(cls, conn: sqlite3.Connection, key: str, items: list) -> '_List':
+        """A list written in full over whatever the key held."""
+        stored = cls(conn, key)
+        stored._stored = [
+            (position, value) for position, value in conn.execute(
+                'SELECT position, value FROM kv_list WHERE key = ? ORDER BY position', (key,),
+            )
+        ]
+        stored._items = list(items)
+        return stored
+
+    def _read(self) -> list:
+        if self._items is None:
+            self._stored = self._conn.execute(
+                'SELECT position, value FROM kv_list WHERE key = ? ORDER BY position', (self._key,),
+            ).fetchall()
+            self._items = [value for _, value in self._stored] + self._appended
+            self._appended = []
+        return self._items
+
+    def _count_stored(self) -> tuple[int, int]:
+        if self._bounds is None:
+            first, count = self._conn.execute(
+                'SELECT MIN(position), COUNT(*) FROM kv_list WHERE key = ?', (self._key,),
+            ).fetchone()
+            self._bounds = (first or 0, count)
+        return self._bounds
+
+    def __len__(self):
+        if self._items is None:
+            return self._count_stored()[1] + len(self._appended)
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._read()[index]
+
+    def __setitem__(self, index, value):
+        self._read()[index] = value
+
+    def __delitem__(self, index):
+        del self._read()[index]
+
+    def __iter__(self):
+        return iter(self._read())
+
+    def insert(self, index, value):
+        if self._items is None and index >= len(self):
+            self._appended.append(value)
+        else:
+            self._read().insert(index, value)
+
+    def commit(self):
+        if self._items is None:
+            if not self._appended:
+                return
+            first, count = self._count_stored()
+            self._conn.executemany(
+                'INSERT INTO kv_list (key, position, value) VALUES (?, ?, ?)',
+                [(self._key, first + count + i, value) for i, value in enumerate(self._appended)],
+            )
+            return
+        stored = dict(self._stored)
+        first = self._stored[0][0] if self._stored else 0
+        # Keep the elements lined up with the stored ones from the front
+        # (RPUSH, LTRIM from 0) or from the back (LPUSH, LPOP), whichever
+        # leaves fewer rows to write
+        plans = []
+        for start in {first, first + len(self._stored) - len(self._items)}:
+            writes = [
+                (self._key, start + i, value) for i, value in enumerate(self._items)
+                if stored.get(start + i) != value
+            ]
+            deletes = [(self._key, position) for position in stored if not start <= position < start + len(self._items)]
+            plans.append((len(writes) + len(deletes), start, writes, deletes))
+        _, _, writes, deletes = min(plans)
+        self._conn.executemany('DELETE FROM kv_list WHERE key = ? AND position = ?', deletes)
+        self._conn.executemany('INSERT OR REPLACE INTO kv_list (key, position, value) VALUES (?, ?, ?)', writes)
+
+
+_COLLECTIONS = {'hash': _Hash, 'list': _List}
+
+
+class _Rows:
+    """The rows one transaction has read, as the Engine's data mapping.
+
+    Values are loaded on first access and handed to the Engine, which may
+    change them in place; commit() compares each against what was loaded.
+    Hashes and lists are loaded as _Hash and _List, which track their own
+    changes; a hash or list the Engine creates is a plain dict or list and
+    is written in full.
+    """
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+        self._loaded = {}  # key → (kind, text, expires_at) as stored, or None
+        self._rows = {}  # key → [kind, value, expires_at], or None once deleted
+
+    def _row(self, key):
+        if key not in self._rows:
+            stored = self._conn.execute(
+                'SELECT kind, value, expires_at FROM kv WHERE key = ?', (key,)
+            ).fetchone()
+            self._loaded[key] = stored
+            if stored is None:
+                self._rows[key] = None
+            elif stored[0] in _COLLECTIONS:
+                self._rows[key] = [stored[0], _COLLECTIONS[stored[0]](self._conn, key), stored[2]]
+            else:
+                self._rows[key] = [stored[0], _load(stored[0], stored[1]), stored[2]]
+        return self._rows[key]
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return row[0], row[1]
+
+    def __setitem__(self, key, item):
+        row = self._row(key)
+        kind, value = item
+        self._rows[key] = [kind, value, row[2] if row else None]
+
+    def __delitem__(self, key):
+        if self._row(key) is None:
+            raise KeyError(key)
+        self._rows[key] = None
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, default=None):
+        item = self.get(key, default)
+        if key in self:
+            del self[key]
+        return item
+
+    def clear(self):
+        for table in ('kv', 'kv_hash', 'kv_list'):
+            self._conn.execute(f'DELETE FROM {table}')
+        self._loaded = {key: None for key in self._loaded}
+        self._rows = {key: None for key in self._rows}
+
+    def commit(self):
+        for key, row in self._rows.items():
+            stored = self._loaded.get(key)
+            if row is None:
+                if stored is not None:
+                    _delete_keys(self._conn, [key])
+                continue
+            kind, value, expires_at = row
+            if stored is not None and stored[0] != kind and stored[0] in _COLLECTIONS:
+                _delete_keys(self._conn, [key], tables=('kv_hash', 'kv_list'))
+            if kind in _COLLECTIONS:
+                if not isinstance(value, _COLLECTIONS[kind]):
+                    value = _COLLECTIONS[kind].replacing(self._conn, key, value)
+                value.commit()
+            current = (kind, _dump(kind, value), expires_at)
+            if current != stored:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO kv (key, kind, value, expires_at) VALUES (?, ?, ?, ?)',
+                    (key, *current),
+                )
+
+
+def _delete_keys(conn: sqlite3.Connection, keys: list, tables=('kv', 'kv_hash', 'kv_list')):
+    for table in tables:
+        conn.executemany(f'DELETE FROM {table} WHERE key = ?', [(key,) for key in keys])
+
+
+def _split_collections(conn: sqlite3.Connection):
+    """Move hashes and lists written whole into kv, before kv_hash and kv_list, to their own rows."""
+    query = "SELECT key, kind, value FROM kv WHERE kind IN ('hash', 'list') AND value != ''"
+    if conn.execute(query).fetchone() is None:
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for key, kind, text in conn.execute(query).fetchall():
+            if kind == 'hash':
+                conn.executemany(
+                    'INSERT OR REPLACE INTO kv_hash (key, field, value) VALUES (?, ?, ?)',
+                    [(key, field, value) for field, value in json.loads(text).items()],
+                )
+            else:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO kv_list (key, position, value) VALUES (?, ?, ?)',
+                    [(key, position, value) for position, value in enumerate(json.loads(text))],
+                )
+            conn.execute("UPDATE kv SET value = '' WHERE key = ?", (key,))
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+
+
+class _Expiries:
+    """Expiry times of the same rows, as the Engine's expires mapping."""
+
+    def __init__(self, rows: _Rows):
+        self._rows = rows
+
+    def get(self, key, default=None):
+        row = self._rows._row(key)
+        return row[2] if row and row[2] is not None else default
+
+    def __setitem__(self, key, expires_at):
+        row = self._rows._row(key)
+        if row is not None:
+            row[2] = expires_at
+
+    def pop(self, key, default=None):
+        row = self._rows._row(key)
+        if row is None or row[2] is None:
+            return default
+        expires_at, row[2] = row[2], None
+        return expires_at
+
+
+# Scripts loaded with EVAL or SCRIPT LOAD; kept per process like a server's script cache
+_loaded_scripts = set()
+
+
+class _SqliteEngine(Engine):
+    def __init__(self, conn: sqlite3.Connection):
+        rows = _Rows(conn)
+        super().__init__(rows, _Expiries(rows), _loaded_scripts)
+        self.conn = conn
+
+    def cmd_scan(self, cursor, *options):
+        # Walks the key index instead of loading every value
+        pattern, count, kind = '*', 10, None
+        for i in range(0, len(options) - 1, 2):
+            option = options[i].upper()
+            if option == 'MATCH':
+                pattern = options[i + 1]
+            elif option == 'COUNT':
+                count = int(options[i + 1])
+            elif option == 'TYPE':
+                kind = options[i + 1]
+        start = int(cursor)
+        rows = self.conn.execute(
+            'SELECT key, kind, expires_at FROM kv ORDER BY key LIMIT ? OFFSET ?', (count + 1, start),
+        ).fetchall()
+        next_cursor = start + count if len(rows) > count else 0
+        now = time.time()
+        batch = [
+            key for key, stored_kind, expires_at in rows[:count]
+            if (expires_at is None or expires_at > now)
+            and fnmatch.fnmatchcase(key, pattern) and (kind is None or stored_kind == kind)
+        ]
+        return [str(next_cursor), batch]
+
+    def cmd_flushall(self):
+        self.data.clear()
+        return 'OK'
+
+
+class SqliteClient(Client):
+    """One connection per thread to the database at `path`."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._purged_at = 0.0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=settings.KV_TIMEOUT_SECONDS, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            _split_collections(conn)
+            self._local.conn = conn
+        return conn
+
+    def _run(self, commands: list, transaction: bool) -> list:
+        conn = self._connection()
+        writes = any(str(command[0]).upper() not in _READ_COMMANDS for command in commands)
+        conn.execute('BEGIN IMMEDIATE' if writes else 'BEGIN')
+        try:
+            engine = _SqliteEngine(conn)
+            replies = engine.run(commands)
+            if writes:
+                engine.data.commit()
+                self._purge_expired(conn)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return replies
+
+    def _purge_expired(self, conn: sqlite3.Connection):
+        # Keys also expire lazily when read; this catches the ones never read again
+        now = time.time()
+        if now - self._purged_at >= _PURGE_INTERVAL_SECONDS:
+            self._purged_at = now
+            expired = conn.execute(
+                'SELECT key FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?', (now,),
+            ).fetchall()
+            _delete_keys(conn, [key for key, in expired])
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_client() -> SqliteClient:
+    return SqliteClient(settings.SQLITE_STORAGE_PATH)
+
+
+def create_async_client() -> ThreadedAsyncClient:
+    return ThreadedAsyncClient(create_client())
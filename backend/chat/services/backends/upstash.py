@@ -0,0 +1,75 @@
+"""Vercel KV / Upstash over its REST API (STORAGE_BACKEND=upstash, the default).
+
+upstash_redis has no option for the httpx client it builds, which has no
+timeout and default pool limits, so the clients here swap in one tuned
+for a long-lived, shared client through its private ``_http._client``.
+requirements.txt pins upstash-redis to the minor version this was checked
+against.
+"""
+import asyncio
+
+import httpx
+from django.conf import settings
+from upstash_redis import Redis
+from upstash_redis.asyncio import Redis as AsyncRedis
+
+from .. import timing
+from .base import count_round_trip
+
+
+class _Transport(httpx.HTTPTransport):
+    """Counts each Redis round trip and times it (until response headers)."""
+
+    def handle_request(self, request):
+        count_round_trip()
+        with timing.span('redis'):
+            return super().handle_request(request)
+
+
+class _AsyncTransport(httpx.AsyncHTTPTransport):
+    async def handle_async_request(self, request):
+        count_round_trip()
+        with timing.span('redis'):
+            return await super().handle_async_request(request)
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.KV_POOL_MAXSIZE,
+        max_keepalive_connections=settings.KV_POOL_MAXSIZE,
+        keepalive_expiry=settings.KV_KEEPALIVE_SECONDS,
+    )
+
+
+# aclose() tasks of replaced async clients, kept until done so they aren't collected
+_closing = set()
+
+
+def create_client() -> Redis:
+    client = Redis(
+        url=settings.KV_REST_API_URL,
+        token=settings.KV_REST_API_TOKEN,
+    )
+    old, client._http._client = client._http._client, httpx.Client(
+        timeout=settings.KV_TIMEOUT_SECONDS,
+        transport=_Transport(limits=_http_limits()),
+    )
+    old.close()
+    return client
+
+
+def create_async_client() -> AsyncRedis:
+    client = AsyncRedis(
+        url=settings.KV_REST_API_URL,
+        token=settings.KV_REST_API_TOKEN,
+    )
+    old, client._http._client = client._http._client, httpx.AsyncClient(
+        timeout=settings.KV_TIMEOUT_SECONDS,
+        transport=_AsyncTransport(limits=_http_limits()),
+    )
+    # Created on the loop it serves (see storage._get_async_redis), which
+    # can close the old one
+    task = asyncio.get_running_loop().create_task(old.aclose())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+    return client
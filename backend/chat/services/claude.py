@@ -1,25 +1,167 @@
-from openai import OpenAI
+import asyncio
+import logging
+import threading
+import time
+import weakref
+
+from typing import TYPE_CHECKING
+
+import httpx
 from django.conf import settings
 
+from . import timing
+from ..prompts import build_summary_prompt
 
-def stream_response(messages: list, system_prompt: str):
-    """
-    Generator that yields text chunks from OpenAI API streaming response.
-    messages: list of {"role": "user"|"assistant", "content": "..."}
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+MODEL = 'gpt-4.1-nano'
+MAX_TOKENS = 1024
+
+_client = None
+_client_lock = threading.Lock()
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _client_options() -> dict:
+    return {
+        'api_key': settings.OPENAI_API_KEY,
+        'base_url': settings.OPENAI_BASE_URL or None,
+        'timeout': httpx.Timeout(
+            settings.OPENAI_TIMEOUT_SECONDS,
+            connect=settings.OPENAI_CONNECT_TIMEOUT_SECONDS,
+        ),
+        'max_retries': settings.OPENAI_MAX_RETRIES,
+    }
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.OPENAI_POOL_MAXSIZE,
+        max_keepalive_connections=settings.OPENAI_POOL_MAXSIZE,
+        keepalive_expiry=settings.OPENAI_KEEPALIVE_SECONDS,
+    )
+
+
+def _get_client() -> 'OpenAI':
+    """Get the process-wide OpenAI client.
+
+    Created lazily and shared across threads, so streamed replies reuse warm
+    keep-alive connections instead of paying a new TLS handshake each time.
     """
-    client = OpenAI(api_key=settings.OPENAI_API_KEY)
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # Imported on first use: the openai package takes longer to
+                # import than the rest of the app, and auth requests never need it
+                from openai import OpenAI
+                _client = OpenAI(
+                    http_client=httpx.Client(limits=_http_limits(), follow_redirects=True),
+                    **_client_options(),
+                )
+    return _client
 
+
+def _get_async_client() -> 'AsyncOpenAI':
+    """Get the AsyncOpenAI client for the running event loop (one per loop)."""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        from openai import AsyncOpenAI
+        client = AsyncOpenAI(
+            http_client=httpx.AsyncClient(limits=_http_limits(), follow_redirects=True),
+            **_client_options(),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+def _api_messages(messages: list, system_prompt: str) -> list:
     api_messages = [{'role': 'system', 'content': system_prompt}]
     for msg in messages:
         api_messages.append({'role': msg['role'], 'content': msg['content']})
+    return api_messages
+
 
-    stream = client.chat.completions.create(
-        model='gpt-4.1-nano',
-        max_tokens=1024,
-        messages=api_messages,
-        stream=True,
+def _log_timing(started: float, first_token_at: float | None, chunks: int):
+    total = time.perf_counter() - started
+    timing.record('llm', total)
+    if first_token_at is not None:
+        timing.record('llm-ttft', first_token_at - started)
+    total_ms = total * 1000
+    if first_token_at is None:
+        logger.info('LLM stream: no tokens, total %.0f ms', total_ms)
+        return
+    logger.info(
+        'LLM stream: first token %.0f ms, total %.0f ms, %d chunks',
+        (first_token_at - started) * 1000, total_ms, chunks,
     )
 
-    for chunk in stream:
-        if chunk.choices and chunk.choices[0].delta.content:
-            yield chunk.choices[0].delta.content
+
+def stream_response(messages: list, system_prompt: str):
+    """
+    Stream a response from OpenAI.
+    Yields text chunks as they arrive.
+    """
+    started = time.perf_counter()
+    first_token_at = None
+    chunks = 0
+    try:
+        stream = _get_client().chat.completions.create(
+            model=MODEL,
+            max_tokens=MAX_TOKENS,
+            messages=_api_messages(messages, system_prompt),
+            stream=True,
+        )
+
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks += 1
+                yield chunk.choices[0].delta.content
+    finally:
+        _log_timing(started, first_token_at, chunks)
+
+
+async def astream_response(messages: list, system_prompt: str):
+    """Async generator counterpart of stream_response for ASGI views."""
+    started = time.perf_counter()
+    first_token_at = None
+    chunks = 0
+    try:
+        stream = await _get_async_client().chat.completions.create(
+            model=MODEL,
+            max_tokens=MAX_TOKENS,
+            messages=_api_messages(messages, system_prompt),
+            stream=True,
+        )
+
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                chunks += 1
+                yield chunk.choices[0].delta.content
+    finally:
+        _log_timing(started, first_token_at, chunks)
+
+
+def summarize(previous_summary: str, messages: list, max_tokens: int) -> str:
+    """Merge older messages into a rolling conversation summary (one LLM call)."""
+    transcript = '\n\n'.join(f"{m['role']}: {m['content']}" for m in messages)
+    if previous_summary:
+        transcript = f'Previous summary:\n{previous_summary}\n\nConversation:\n{transcript}'
+    with timing.span('llm-summary'):
+        response = _get_client().chat.completions.create(
+            model=MODEL,
+            max_tokens=max_tokens,
+            messages=[
+                {'role': 'system', 'content': build_summary_prompt()},
+                {'role': 'user', 'content': transcript},
+            ],
+        )
+    return (response.choices[0].message.content or '').strip()
@@ -0,0 +1,131 @@
+"""Versioned encoding for the values storage writes to Redis.
+
+Small values are written as plain JSON, which is also how every value
+written before this module looks. Values of at least
+STORAGE_COMPRESS_MIN_BYTES of JSON are written compressed:
+
+    ~1<serializer><compression>:<base64 payload>
+
+for example '~1mz:eNp...', which is msgpack (m, when installed; j for JSON)
+compressed with zlib (z). The Upstash REST API only carries text, hence
+base64. A value is only stored compressed when the result is still the
+smaller one. decode() reads every format, so STORAGE_CODEC=json (write plain
+JSON only) is always a safe rollback.
+"""
+import base64
+import json
+import threading
+import time
+import zlib
+
+from django.conf import settings
+
+try:
+    import msgpack
+except ImportError:  # optional; JSON is used for the payload instead
+    msgpack = None
+
+MAGIC = '~'
+VERSION = '1'
+
+
+class CodecStats:
+    """Process-wide counters for encode() and decode()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.encoded = 0
+        self.compressed = 0
+        self.json_bytes = 0
+        self.stored_bytes = 0
+        self.encode_seconds = 0.0
+        self.decoded = 0
+        self.decode_seconds = 0.0
+
+    def add_encode(self, json_bytes: int, stored_bytes: int, compressed: bool, seconds: float):
+        with self._lock:
+            self.encoded += 1
+            self.compressed += compressed
+            self.json_bytes += json_bytes
+            self.stored_bytes += stored_bytes
+            self.encode_seconds += seconds
+
+    def add_decode(self, seconds: float):
+        with self._lock:
+            self.decoded += 1
+            self.decode_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'encoded': self.encoded,
+                'compressed': self.compressed,
+                'json_bytes': self.json_bytes,
+                'stored_bytes': self.stored_bytes,
+                'ratio': round(self.json_bytes / self.stored_bytes, 3) if self.stored_bytes else None,
+                'encode_us_mean': round(self.encode_seconds / self.encoded * 1e6, 1) if self.encoded else None,
+                'decoded': self.decoded,
+                'decode_us_mean': round(self.decode_seconds / self.decoded * 1e6, 1) if self.decoded else None,
+            }
+
+
+_stats = CodecStats()
+
+
+def stats() -> dict:
+    return _stats.snapshot()
+
+
+def reset_stats():
+    _stats.reset()
+
+
+def is_encoded(data) -> bool:
+    return isinstance(data, str) and data.startswith(MAGIC)
+
+
+def _pack(value) -> str:
+    if msgpack is not None:
+        kind, raw = 'm', msgpack.packb(value, default=str)
+    else:
+        kind, raw = 'j', json.dumps(value, default=str, separators=(',', ':')).encode()
+    payload = zlib.compress(raw, settings.STORAGE_COMPRESS_LEVEL)
+    return f'{MAGIC}{VERSION}{kind}z:' + base64.b64encode(payload).decode('ascii')
+
+
+def encode(value) -> str:
+    """Text to store for `value` (plain JSON, or the compressed format)."""
+    started = time.perf_counter()
+    text = json.dumps(value, default=str)
+    stored = text
+    if settings.STORAGE_CODEC == 'v1' and len(text) >= settings.STORAGE_COMPRESS_MIN_BYTES:
+        packed = _pack(value)
+        if len(packed) < len(text):
+            stored = packed
+    _stats.add_encode(len(text), len(stored), stored is not text, time.perf_counter() - started)
+    return stored
+
+
+def _unpack(data: str):
+    header, _, body = data.partition(':')
+    if len(header) != 4 or header[1] != VERSION or header[3] != 'z':
+        raise ValueError(f'Unsupported stored value format {header!r}')
+    raw = zlib.decompress(base64.b64decode(body))
+    if header[2] == 'm':
+        if msgpack is None:
+            raise ValueError('Stored value is msgpack-encoded but msgpack is not installed')
+        return msgpack.unpackb(raw, raw=False)
+    return json.loads(raw)
+
+
+def decode(data):
+    """The value behind stored text; None and already-parsed values pass through."""
+    if not isinstance(data, str):
+        return data
+    started = time.perf_counter()
+    value = _unpack(data) if data.startswith(MAGIC) else json.loads(data)
+    _stats.add_decode(time.perf_counter() - started)
+    return value
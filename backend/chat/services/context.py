@@ -0,0 +1,148 @@
+"""Token-budgeted conversation windows for the LLM and the ad request.
+
+Each stored message carries a cached token estimate ('tokens', set when the
+message is created), so building a window only sums integers over the most
+recent messages instead of re-measuring the whole history on every turn.
+
+Optionally (CHAT_CONTEXT_SUMMARY), turns that no longer fit the LLM window
+are folded into a rolling summary kept in the chat's meta hash. The summary
+is computed after a reply has been sent, in batches, and is reused until
+enough new turns have fallen out of the window to refresh it.
+"""
+import logging
+import math
+
+from django.conf import settings
+
+from .claude import summarize
+
+logger = logging.getLogger(__name__)
+
+CHARS_PER_TOKEN = 4
+# Role and framing tokens the chat format adds to every message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_tokens(message: dict) -> int:
+    tokens = message.get('tokens')
+    if tokens is None:
+        # Messages stored before token counts were cached
+        tokens = estimate_tokens(message['content'])
+    return tokens + MESSAGE_OVERHEAD_TOKENS
+
+
+def _window_start(messages: list, budget: int, floor: int = 0, keep: int = 1) -> int:
+    """Index of the oldest message in the newest run that fits the budget.
+
+    The last `keep` messages are always kept, from the user turn they start
+    at, even when they alone are over budget. Older messages are added while
+    they fit, and the window is then moved forward to start on a user turn
+    so that it never opens with an orphaned reply.
+    """
+    kept = max(floor, len(messages) - keep)
+    while kept > floor and messages[kept]['role'] != 'user':
+        kept -= 1
+    used = sum(message_tokens(m) for m in messages[kept:])
+    start = kept
+    while start > floor:
+        cost = message_tokens(messages[start - 1])
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    while start < kept and messages[start]['role'] != 'user':
+        start += 1
+    return start
+
+
+def _content_limits(messages: list, budget: int) -> list:
+    """How many characters of each message's content fit the budget (None: all).
+
+    Only the longest messages are cut, all to the same length: the longest
+    that brings the window within budget.
+    """
+    costs = [message_tokens(m) for m in messages]
+    if sum(costs) <= budget:
+        return [None] * len(messages)
+    low, high = MESSAGE_OVERHEAD_TOKENS, max(costs)
+    while low < high:
+        cap = (low + high + 1) // 2
+        if sum(min(cost, cap) for cost in costs) <= budget:
+            low = cap
+        else:
+            high = cap - 1
+    chars = (low - MESSAGE_OVERHEAD_TOKENS) * CHARS_PER_TOKEN
+    return [chars if cost > low else None for cost in costs]
+
+
+def _summary(chat: dict) -> tuple[str, int]:
+    if not settings.CHAT_CONTEXT_SUMMARY:
+        return '', 0
+    return chat.get('summary') or '', int(chat.get('summary_upto') or 0)
+
+
+def _summary_message(summary: str) -> dict:
+    return {
+        'role': 'system',
+        'content': f'Summary of the earlier conversation:\n{summary}',
+    }
+
+
+def llm_window(chat: dict) -> list:
+    """Messages to send to the LLM: recent turns within CHAT_LLM_CONTEXT_TOKENS."""
+    messages = chat['messages']
+    summary, upto = _summary(chat)
+    budget = settings.CHAT_LLM_CONTEXT_TOKENS
+    if summary:
+        budget -= message_tokens({'content': summary})
+    start = _window_start(messages, budget, floor=upto)
+    window = [{'role': m['role'], 'content': m['content']} for m in messages[start:]]
+    if summary:
+        window.insert(0, _summary_message(summary))
+    return window
+
+
+def ad_window(chat: dict) -> list:
+    """Messages for the Thrad bid request, within THRAD_AD_CONTEXT_TOKENS.
+
+    Always includes the last user turn and the reply to it, since the SSP
+    only bids on both; when they alone are over the budget their content is
+    shortened to fit instead. Keeps each message's timestamp so the SSP sees
+    when turns happened.
+    """
+    budget = settings.THRAD_AD_CONTEXT_TOKENS
+    messages = chat['messages']
+    window = messages[_window_start(messages, budget, keep=2):]
+    return [
+        {'role': m['role'], 'content': m['content'][:limit], 'timestamp': m.get('timestamp')}
+        for m, limit in zip(window, _content_limits(window, budget))
+    ]
+
+
+def summary_due(chat: dict) -> bool:
+    """True when enough turns have fallen out of the LLM window to (re)summarize."""
+    if not settings.CHAT_CONTEXT_SUMMARY:
+        return False
+    _, upto = _summary(chat)
+    budget = settings.CHAT_LLM_CONTEXT_TOKENS - settings.CHAT_SUMMARY_MAX_TOKENS
+    start = _window_start(chat['messages'], budget, floor=upto)
+    return start - upto >= settings.CHAT_SUMMARY_MIN_MESSAGES
+
+
+def summarize_older(chat: dict) -> tuple[str, int]:
+    """Fold the turns outside the LLM window into the chat's rolling summary.
+
+    Returns (summary, upto): the new summary text and the number of leading
+    messages it covers. Makes one (non-streaming) LLM call.
+    """
+    summary, upto = _summary(chat)
+    budget = settings.CHAT_LLM_CONTEXT_TOKENS - settings.CHAT_SUMMARY_MAX_TOKENS
+    start = _window_start(chat['messages'], budget, floor=upto)
+    summary = summarize(summary, chat['messages'][upto:start], settings.CHAT_SUMMARY_MAX_TOKENS)
+    logger.info('Summarized messages %d-%d of chat %s', upto, start, chat['id'])
+    return summary, start
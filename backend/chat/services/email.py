@@ -1,9 +1,41 @@
-import requests
+import threading
+
 from django.conf import settings
 
+from . import timing
 
-def send_verification_code(to_email: str, code: str):
-    """Send a 6-digit verification code via Brevo HTTP API."""
+# One keep-alive session for every Brevo call, from views or the outbox worker
+_http = None
+_http_lock = threading.Lock()
+
+
+def _get_http():
+    # requests is imported on first send, not when the views load: it is one
+    # of the slower imports and most cold starts never send an email
+    global _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                session.mount('https://', HTTPAdapter(pool_maxsize=4))
+                _http = session
+    return _http
+
+
+class SendError(Exception):
+    """A Brevo request failed; `permanent` when retrying cannot help."""
+
+    def __init__(self, message: str, status: int | None = None):
+        super().__init__(message)
+        self.status = status
+        # 4xx other than rate limiting means the request itself is bad
+        self.permanent = status is not None and 400 <= status < 500 and status != 429
+
+
+def verification_email(to_email: str, code: str) -> dict:
+    """Recipient, subject and HTML of a verification code email."""
     html = f"""
     <div style="font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', Roboto, sans-serif; max-width: 400px; margin: 0 auto; padding: 40px 20px;">
       <h2 style="color: #1A1714; margin-bottom: 8px;">Your verification code</h2>
@@ -14,19 +46,50 @@ def send_verification_code(to_email: str, code: str):
       <p style="color: #7A7067; font-size: 12px;">This code expires in 10 minutes. If you didn't request this, you can ignore this email.</p>
     </div>
     """
+    return {
+        'to': [{'email': to_email}],
+        'subject': f'Your verification code is {code}',
+        'htmlContent': html,
+    }
 
-    resp = requests.post(
-        "https://api.brevo.com/v3/smtp/email",
-        headers={
-            "api-key": settings.BREVO_API_KEY,
-            "Content-Type": "application/json",
-        },
-        json={
-            "sender": {"email": settings.EMAIL_FROM_ADDRESS},
-            "to": [{"email": to_email}],
-            "subject": f"Your verification code is {code}",
-            "htmlContent": html,
-        },
-        timeout=10,
-    )
-    resp.raise_for_status()
+
+def _post(payload: dict):
+    http = _get_http()
+    import requests
+    try:
+        with timing.span('email'):
+            resp = http.post(
+                settings.BREVO_API_URL,
+                headers={
+                    'api-key': settings.BREVO_API_KEY,
+                    'Content-Type': 'application/json',
+                },
+                json={'sender': {'email': settings.EMAIL_FROM_ADDRESS}, **payload},
+                timeout=settings.BREVO_TIMEOUT_SECONDS,
+            )
+    except requests.RequestException as e:
+        raise SendError(str(e)) from e
+    if resp.status_code >= 400:
+        raise SendError(f'Brevo returned {resp.status_code}: {resp.text[:200]}', resp.status_code)
+
+
+def send_messages(messages: list):
+    """Send emails built by verification_email() in one Brevo request.
+
+    Several messages go out as messageVersions of a single request, which
+    Brevo accepts for up to 1000 recipients. Raises SendError.
+    """
+    if len(messages) == 1:
+        _post(messages[0])
+        return
+    first = messages[0]
+    _post({
+        'subject': first['subject'],
+        'htmlContent': first['htmlContent'],
+        'messageVersions': messages,
+    })
+
+
+def send_verification_code(to_email: str, code: str):
+    """Send a 6-digit verification code via Brevo HTTP API."""
+    send_messages([verification_email(to_email, code)])
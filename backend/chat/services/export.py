@@ -0,0 +1,113 @@
+"""Bulk export of chats and interest profiles, for analytics.
+
+export() walks the keyspace with SCAN instead of the per-user indexes, so
+it needs no list of users and never holds more than one batch in memory:
+each SCAN page of up to EXPORT_BATCH_SIZE keys is loaded in one pipeline
+(MGET for JSON blobs), decoded and yielded before the next page is read.
+Reads are capped at EXPORT_KEYS_PER_SECOND so an export can run against
+production without starving live requests.
+
+Sources are exported in order: chats (chat_meta:*, with messages and their
+feedback), legacy chat blobs (chats:*), profiles (profile:*) and legacy
+profile blobs (profiles:*). Nothing is migrated or otherwise written.
+
+Every batch comes with a cursor ('<source>:<scan cursor>') to resume
+after it. SCAN returns each key that exists for the whole walk at least
+once, so a resumed or concurrent export can repeat a record: deduplicate
+on (type, id) or (type, email).
+"""
+import time
+
+from django.conf import settings
+
+from . import codec
+from .storage import assemble_chat, get_redis, pipeline, queue_chat_load
+from .user_profile import assemble_profile, topics_key
+
+KINDS = ('chats', 'profiles')
+
+
+def _load_chats(keys: list) -> list:
+    pipe = pipeline()
+    for key in keys:
+        queue_chat_load(pipe, key.split(':', 1)[1])
+    results = pipe.exec()
+    records = []
+    for i in range(len(keys)):
+        meta, stored, message_ids = results[i * 3:i * 3 + 3]
+        if meta:  # deleted or migrated since the SCAN
+            records.append({'type': 'chat', **assemble_chat(meta, stored, message_ids)})
+    return records
+
+
+def _load_profiles(keys: list) -> list:
+    pipe = pipeline()
+    for key in keys:
+        pipe.hgetall(key)
+        pipe.lrange(topics_key(key.split(':', 1)[1]), 0, -1)
+    results = pipe.exec()
+    return [
+        {'type': 'profile', **assemble_profile(stored, topics)}
+        for stored, topics in zip(results[::2], results[1::2]) if stored
+    ]
+
+
+def _blob_loader(kind: str):
+    def load(keys: list) -> list:
+        values = get_redis().mget(*keys)
+        return [{'type': kind, **codec.decode(value)} for value in values if value is not None]
+    return load
+
+
+# (name, kind, SCAN pattern, loader), in export order
+SOURCES = (
+    ('chats', 'chats', 'chat_meta:*', _load_chats),
+    ('legacy_chats', 'chats', 'chats:*', _blob_loader('chat')),
+    ('profiles', 'profiles', 'profile:*', _load_profiles),
+    ('legacy_profiles', 'profiles', 'profiles:*', _blob_loader('profile')),
+)
+
+
+def parse_cursor(cursor: str | None) -> tuple[int, int]:
+    """(index into SOURCES, SCAN cursor) for an export cursor."""
+    if not cursor:
+        return 0, 0
+    name, _, scan_cursor = cursor.rpartition(':')
+    names = [source[0] for source in SOURCES]
+    if name not in names or not scan_cursor.isdigit():
+        raise ValueError(f'Invalid export cursor {cursor!r}')
+    return names.index(name), int(scan_cursor)
+
+
+def export(kinds=KINDS, cursor: str | None = None, batch_size: int | None = None,
+           keys_per_second: float | None = None):
+    """Yield (records, cursor) per SCAN page; cursor is None after the last page.
+
+    Pass a yielded cursor back in to resume right after its page.
+    """
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    if keys_per_second is None:
+        keys_per_second = settings.EXPORT_KEYS_PER_SECOND
+    start, scan_cursor = parse_cursor(cursor)
+    r = get_redis()
+    started, keys_read = time.monotonic(), 0
+
+    for index in range(start, len(SOURCES)):
+        name, kind, pattern, load = SOURCES[index]
+        if kind not in kinds:
+            scan_cursor = 0
+            continue
+        while True:
+            scan_cursor, keys = r.scan(scan_cursor, match=pattern, count=batch_size)
+            records = load(keys) if keys else []
+            keys_read += len(keys)
+            if keys_per_second:
+                delay = keys_read / keys_per_second - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            if scan_cursor == 0:
+                break
+            yield records, f'{name}:{scan_cursor}'
+        # A source's last page resumes at the start of the next one
+        following = next((s[0] for s in SOURCES[index + 1:] if s[1] in kinds), None)
+        yield records, f'{following}:0' if following else None
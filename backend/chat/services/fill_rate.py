@@ -0,0 +1,171 @@
+"""Online estimate of how likely a Thrad bid request is to be filled.
+
+Each SSP call is counted (calls, fills, total latency) under the turn
+number, the interest category of the latest user message (see
+user_profile.match_interests) and the size of the ad window, and under the
+joint cell of all three. A cell's fill rate is the mean of a Beta posterior,
+(fills + PRIOR_FILLS) / (calls + PRIOR_FILLS + PRIOR_MISSES), and the joint
+cell is shrunk towards the mean of its three marginals until it has enough
+calls of its own. Updates and predictions are O(1).
+
+Counts are shared across processes as integer fields of one Redis hash
+(STATS_KEY): each process adds its increments with HINCRBY and reloads the
+totals in the same pipeline, at most once every THRAD_FILL_SYNC_SECONDS.
+The sync runs in whichever ad lookup finds it due (usually an ad worker
+thread); the others keep using the counts they have meanwhile.
+"""
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .context import estimate_tokens
+from .storage import pipeline
+from .user_profile import match_interests
+
+logger = logging.getLogger(__name__)
+
+STATS_KEY = 'ad_fill_stats'
+
+# Beta(1, 1): an unseen cell starts at 0.5, so nothing is skipped until
+# there is evidence against it
+PRIOR_FILLS = 1
+PRIOR_MISSES = 1
+# Calls a joint cell needs before its own rate outweighs its marginals'
+JOINT_SHRINKAGE = 20
+MAX_TURN = 10
+MAX_LENGTH_BUCKET = 8
+
+
+def features(messages: list, turn_number: int) -> tuple[str, str, str]:
+    """Marginal cells for a bid request: turn, interest category, window size."""
+    latest = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+    category = next(iter(match_interests(latest)), 'none')
+    tokens = sum(estimate_tokens(m['content']) for m in messages)
+    length = min((tokens // 64).bit_length(), MAX_LENGTH_BUCKET)
+    try:
+        turn = min(int(turn_number), MAX_TURN)
+    except (TypeError, ValueError, OverflowError):
+        turn = 0
+    return (
+        f'turn={turn}',
+        f'category={category}',
+        f'length={length}',
+    )
+
+
+def _rate(calls: int, fills: int) -> float:
+    return (fills + PRIOR_FILLS) / (calls + PRIOR_FILLS + PRIOR_MISSES)
+
+
+class FillRateEstimator:
+    """Fill counts per cell, kept in process and synced through a Redis hash."""
+
+    def __init__(self, key: str, sync_seconds: float):
+        self.key = key
+        self.sync_seconds = sync_seconds
+        self._counts = {}   # field -> int, the last synced totals plus local increments
+        self._pending = {}  # field -> int, increments not yet written
+        self._synced_at = None
+        self._syncing = False
+        self._lock = threading.Lock()
+
+    def _get(self, cell: str, stat: str) -> int:
+        return self._counts.get(f'{cell}:{stat}', 0)
+
+    def predict(self, cells: tuple) -> float:
+        self._maybe_sync()
+        joint = ','.join(cells)
+        with self._lock:
+            prior = sum(_rate(self._get(c, 'calls'), self._get(c, 'fills')) for c in cells) / len(cells)
+            calls, fills = self._get(joint, 'calls'), self._get(joint, 'fills')
+        return (fills + JOINT_SHRINKAGE * prior) / (calls + JOINT_SHRINKAGE)
+
+    def record(self, cells: tuple, filled: bool, latency_ms: float):
+        increments = {'calls': 1, 'fills': int(filled), 'ms': round(latency_ms)}
+        with self._lock:
+            for cell in (*cells, ','.join(cells)):
+                for stat, amount in increments.items():
+                    if amount:
+                        field = f'{cell}:{stat}'
+                        self._counts[field] = self._counts.get(field, 0) + amount
+                        self._pending[field] = self._pending.get(field, 0) + amount
+        self._maybe_sync()
+
+    def _maybe_sync(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._syncing or (self._synced_at is not None and now - self._synced_at < self.sync_seconds):
+                return
+            self._syncing = True
+            self._synced_at = now
+            pending, self._pending = self._pending, {}
+        stored = None
+        try:
+            pipe = pipeline()
+            for field, amount in pending.items():
+                pipe.hincrby(self.key, field, amount)
+            pipe.hgetall(self.key)
+            stored = pipe.exec()[-1]
+        except Exception:
+            logger.warning('Ad fill stats sync failed', exc_info=True)
+        with self._lock:
+            self._syncing = False
+            if stored is None:
+                # Keep the increments for the next sync
+                for field, amount in pending.items():
+                    self._pending[field] = self._pending.get(field, 0) + amount
+                return
+            counts = {field: int(value) for field, value in stored.items()}
+            for field, amount in self._pending.items():  # recorded during the sync
+                counts[field] = counts.get(field, 0) + amount
+            self._counts = counts
+
+    def clear(self):
+        """Forget the local counts; the next call reloads them from Redis."""
+        with self._lock:
+            self._counts, self._pending, self._synced_at = {}, {}, None
+
+    def stats(self) -> dict:
+        """Calls, fill rate and mean latency per marginal cell, for /api/metrics/."""
+        with self._lock:
+            cells = {field.rsplit(':', 1)[0] for field in self._counts if ',' not in field}
+            return {
+                cell: {
+                    'calls': self._get(cell, 'calls'),
+                    'fill_rate': round(_rate(self._get(cell, 'calls'), self._get(cell, 'fills')), 3),
+                    'mean_ms': round(self._get(cell, 'ms') / max(1, self._get(cell, 'calls')), 1),
+                }
+                for cell in sorted(cells)
+            }
+
+
+_estimator = FillRateEstimator(STATS_KEY, settings.THRAD_FILL_SYNC_SECONDS)
+
+
+def should_request(cells: tuple) -> bool:
+    """Whether a bid request is worth sending: likely enough to fill, or exploring."""
+    if settings.THRAD_FILL_THRESHOLD <= 0:
+        return True
+    expected = _estimator.predict(cells)
+    if expected >= settings.THRAD_FILL_THRESHOLD:
+        return True
+    if random.random() < settings.THRAD_FILL_EXPLORE_RATE:
+        logger.info('Exploring %s despite expected fill %.3f', ','.join(cells), expected)
+        return True
+    logger.info('Skipping Thrad API: expected fill %.3f for %s', expected, ','.join(cells))
+    return False
+
+
+def record(cells: tuple, filled: bool, latency_ms: float):
+    _estimator.record(cells, filled, latency_ms)
+
+
+def stats() -> dict:
+    return _estimator.stats()
+
+
+def clear():
+    _estimator.clear()
@@ -0,0 +1,180 @@
+"""Outbox for verification emails, so send_code never waits on Brevo.
+
+With EMAIL_OUTBOX on, send_code stores the code and an email job in one
+round trip and returns; `python manage.py email_worker` sends the queued
+emails. Keys:
+
+    email_job:{id}  the job (to, code, status, attempts, error), expiring
+                    with the code it carries
+    email_outbox    sorted set of job ids by when each is next due
+
+The worker takes due jobs in batches of EMAIL_BATCH_SIZE (sent as one
+Brevo request) and, in the same server-side script, pushes each one
+EMAIL_SEND_LEASE_SECONDS into the future while it sends, so concurrent
+workers never claim the same job and a job whose worker died is retried
+once the lease runs out. Failed sends are retried with exponential backoff; after
+EMAIL_MAX_ATTEMPTS, on an error retrying cannot fix, or once the code has
+expired, the job is marked failed and its code revoked. The status
+endpoint reports queued, retrying, sent or failed for a job id.
+"""
+import logging
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+
+from . import codec, email
+from .backends.script import Script
+from .storage import VERIFY_TTL, get_redis, pipeline, delete_verification_code, queue_verification_code
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = 'email_outbox'
+
+
+def job_key(job_id: str) -> str:
+    return f'email_job:{job_id}'
+
+
+def queue_verification_email(to_email: str) -> dict:
+    """Create a verification code for to_email and queue the email carrying it."""
+    job = {
+        'id': uuid.uuid4().hex,
+        'to': to_email,
+        'status': 'queued',
+        'attempts': 0,
+        'error': None,
+        'queued_at': time.time(),
+    }
+    pipe = pipeline()
+    job['code'] = queue_verification_code(pipe, to_email)
+    pipe.set(job_key(job['id']), codec.encode(job), ex=VERIFY_TTL)
+    pipe.zadd(OUTBOX_KEY, {job['id']: job['queued_at']})
+    pipe.exec()
+    return job
+
+
+def get_status(job_id: str) -> dict | None:
+    """A job's public state: status, attempts and the last error."""
+    job = codec.decode(get_redis().get(job_key(job_id)))
+    if job is None:
+        return None
+    return {'id': job['id'], 'status': job['status'], 'attempts': job['attempts'], 'error': job['error']}
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(settings.EMAIL_RETRY_MAX_SECONDS, settings.EMAIL_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# Takes up to ARGV[2] ids due by ARGV[1] and pushes them to the lease end,
+# ARGV[3], in one step: two workers polling together never get the same job
+_CLAIM_LUA = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, id in ipairs(ids) do
+  redis.call('ZADD', KEYS[1], 'XX', ARGV[3], id)
+end
+return ids
+"""
+
+
+def _claim_local(engine, keys: list, args: list) -> list:
+    ids = engine.cmd_zrangebyscore(keys[0], '-inf', args[0], 'LIMIT', '0', args[1])
+    for job_id in ids:
+        engine.cmd_zadd(keys[0], 'XX', args[2], job_id)
+    return ids
+
+
+_claim_due = Script(_CLAIM_LUA, _claim_local)
+
+
+def _claim(limit: int, now: float) -> list:
+    """Due jobs (at most `limit`), each leased to this worker."""
+    r = get_redis()
+    lease = now + settings.EMAIL_SEND_LEASE_SECONDS
+    ids = _claim_due(r, [OUTBOX_KEY], [repr(now), str(limit), repr(lease)])
+    if not ids:
+        return []
+    stored = r.mget(*[job_key(job_id) for job_id in ids])
+    jobs, gone = [], []
+    for job_id, value in zip(ids, stored):
+        if value is None:
+            gone.append(job_id)  # expired with its code
+        else:
+            jobs.append(codec.decode(value))
+    if gone:
+        r.zrem(OUTBOX_KEY, *gone)
+    return jobs
+
+
+def _send(jobs: list) -> dict:
+    """Send jobs in one request; {job id: SendError or None}."""
+    try:
+        email.send_messages([email.verification_email(job['to'], job['code']) for job in jobs])
+        return {job['id']: None for job in jobs}
+    except email.SendError as e:
+        if len(jobs) == 1 or not e.permanent:
+            return {job['id']: e for job in jobs}
+    # One bad recipient rejects the whole batch; find it by sending each alone
+    outcomes = {}
+    for job in jobs:
+        outcomes.update(_send([job]))
+    return outcomes
+
+
+def process_batch(limit: int | None = None) -> dict:
+    """Send one batch of due jobs. Returns how many were sent, retried and failed."""
+    now = time.time()
+    jobs = _claim(limit or settings.EMAIL_BATCH_SIZE, now)
+    counts = {'sent': 0, 'retrying': 0, 'failed': 0}
+    if not jobs:
+        return counts
+
+    live = [job for job in jobs if now - job['queued_at'] < VERIFY_TTL]
+    outcomes = _send(live) if live else {}
+    for job in live:
+        job['attempts'] += 1
+
+    pipe = pipeline()
+    revoke = []
+    for job in jobs:
+        error = outcomes.get(job['id'], email.SendError('Code expired before it could be sent'))
+        if error is None:
+            job['status'], job['error'] = 'sent', None
+        elif job['id'] in outcomes and not error.permanent and job['attempts'] < settings.EMAIL_MAX_ATTEMPTS:
+            job['status'], job['error'] = 'retrying', str(error)
+            pipe.zadd(OUTBOX_KEY, {job['id']: now + _backoff(job['attempts'])}, xx=True)
+        else:
+            job['status'], job['error'] = 'failed', str(error)
+            revoke.append(job)
+        if job['status'] != 'retrying':
+            pipe.zrem(OUTBOX_KEY, job['id'])
+        pipe.set(job_key(job['id']), codec.encode(job), xx=True, keepttl=True)
+        counts[job['status']] += 1
+    pipe.exec()
+
+    for job in revoke:
+        logger.warning('Giving up on verification email %s after %d attempts: %s',
+                       job['id'], job['attempts'], job['error'])
+        # The user never got this code; make them request a new one
+        delete_verification_code(job['to'], job['code'])
+    return counts
+
+
+def run_worker(stop: threading.Event | None = None, once: bool = False):
+    """Send queued emails until `stop` is set (or the queue is empty, with once)."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            counts = process_batch()
+        except Exception:
+            logger.exception('Email outbox batch failed')
+            counts = None
+        if counts and any(counts.values()):
+            logger.info('Email outbox: %(sent)d sent, %(retrying)d retrying, %(failed)d failed', counts)
+            continue
+        if once:
+            return
+        stop.wait(settings.EMAIL_POLL_SECONDS)
@@ -1,37 +1,85 @@
+import asyncio
 import json
 import random
+import threading
 import uuid
 import hashlib
+import weakref
 from datetime import datetime, timezone
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from upstash_redis import Redis
 
+from . import backends, codec
+from .backends.base import count_round_trips  # noqa: F401 (used by the middleware)
+from .backends.script import Script
+from .cache import TTLCache
+from .context import estimate_tokens
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_redis():
+    """Get the process-wide Redis client for the configured storage backend.
+
+    The client is created lazily on first use and shared across threads, so
+    its connection pool (and the TLS sessions in it) is reused by every
+    request instead of being rebuilt on each call.
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = backends.create_client()
+    return _client
+
+
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _get_async_redis():
+    """Get the async Redis client for the running event loop.
+
+    Async connection pools are bound to the loop that created them, so
+    there is one client per loop (in practice, one per ASGI worker process).
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = backends.create_async_client()
+    return client
 
-def _get_redis():
-    """Get Redis client connected to Vercel KV (Upstash)."""
-    return Redis(
-        url=settings.KV_REST_API_URL,
-        token=settings.KV_REST_API_TOKEN,
-    )
 
+def pipeline():
+    """Start a batch of commands that is sent to Redis in one round trip.
 
-def _email_hash(email: str) -> str:
+    Queue commands on the returned pipeline and call ``exec()`` to send them;
+    results come back as a list in the order the commands were queued.
+    """
+    return get_redis().pipeline()
+
+
+def email_hash(email: str) -> str:
     return hashlib.sha256(email.lower().strip().encode()).hexdigest()[:16]
 
 
-def _redis_get(key: str) -> dict | None:
-    r = _get_redis()
-    data = r.get(key)
-    if data is None:
-        return None
-    if isinstance(data, str):
-        return json.loads(data)
-    return data
+def _decode(data) -> dict | None:
+    return codec.decode(data)
+
+
+# get_redis(), pipeline(), email_hash(), get_doc() and set_doc() are also
+# what the other services (ads, profiles, outbox, export) build on
+
+def get_doc(key: str) -> dict | None:
+    """A stored document, or None if the key does not exist."""
+    return _decode(get_redis().get(key))
 
 
-def _redis_set(key: str, data: dict):
-    r = _get_redis()
-    r.set(key, json.dumps(data, default=str))
+def set_doc(key: str, data: dict, ex: int | None = None):
+    """Store a document, expiring after `ex` seconds if given."""
+    r = get_redis()
+    r.set(key, codec.encode(data), ex=ex)
 
 
 # ── Verification code operations ──
@@ -40,84 +88,390 @@ VERIFY_TTL = 600  # 10 minutes
 MAX_ATTEMPTS = 5
 
 
-def create_verification_code(email: str) -> str:
-    """Generate a 6-digit code, store in Redis with 10-min TTL."""
+def queue_verification_code(pipe, email: str) -> str:
+    """Queue storing a new 6-digit code with a 10-min TTL; returns the code."""
     code = f'{random.randint(0, 999999):06d}'
-    eh = _email_hash(email)
-    r = _get_redis()
-    r.set(f'verify:{eh}', json.dumps({'code': code, 'attempts': 0}), ex=VERIFY_TTL)
+    eh = email_hash(email)
+    pipe.set(f'verify:{eh}', json.dumps({'code': code, 'attempts': 0}), ex=VERIFY_TTL)
     return code
 
 
+def create_verification_code(email: str) -> str:
+    """Generate a 6-digit code, store in Redis with 10-min TTL."""
+    return queue_verification_code(get_redis(), email)
+
+
+_VERIFY_CODE_LUA = """
+local stored = redis.call('GET', KEYS[1])
+if not stored then return 0 end
+local entry = cjson.decode(stored)
+local attempts = entry.attempts or 0
+if attempts >= tonumber(ARGV[2]) then
+  redis.call('DEL', KEYS[1])
+  return 0
+end
+if entry.code == ARGV[1] then
+  redis.call('DEL', KEYS[1])
+  return 1
+end
+entry.attempts = attempts + 1
+redis.call('SET', KEYS[1], cjson.encode(entry), 'KEEPTTL')
+return 0
+"""
+
+
+def _verify_code_local(engine, keys: list, args: list) -> int:
+    stored = engine.cmd_get(keys[0])
+    if stored is None:
+        return 0
+    entry = json.loads(stored)
+    attempts = entry.get('attempts', 0)
+    if attempts >= int(args[1]):
+        engine.cmd_del(keys[0])
+        return 0
+    if entry['code'] == args[0]:
+        engine.cmd_del(keys[0])
+        return 1
+    entry['attempts'] = attempts + 1
+    engine.cmd_set(keys[0], json.dumps(entry), 'KEEPTTL')
+    return 0
+
+
+_verify_code = Script(_VERIFY_CODE_LUA, _verify_code_local)
+
+
 def verify_code(email: str, code: str) -> bool:
-    """Check code, delete on success, track failed attempts (max 5)."""
-    eh = _email_hash(email)
-    r = _get_redis()
-    key = f'verify:{eh}'
-    data = r.get(key)
-    if data is None:
-        return False
-    if isinstance(data, str):
-        data = json.loads(data)
-
-    if data.get('attempts', 0) >= MAX_ATTEMPTS:
-        r.delete(key)
-        return False
-
-    if data['code'] == code.strip():
-        r.delete(key)
-        return True
-
-    # Wrong code — increment attempts
-    data['attempts'] = data.get('attempts', 0) + 1
-    ttl = r.ttl(key)
-    if ttl and ttl > 0:
-        r.set(key, json.dumps(data), ex=ttl)
-    else:
-        r.delete(key)
-    return False
+    """Check code, delete on success, track failed attempts (max 5).
+
+    Runs as one server-side script: a single round trip, and concurrent
+    guesses cannot both use the same attempt or both match.
+    """
+    key = f'verify:{email_hash(email)}'
+    return _verify_code(get_redis(), [key], [code.strip(), MAX_ATTEMPTS]) == 1
+
+
+_DELETE_CODE_LUA = """
+local stored = redis.call('GET', KEYS[1])
+if not stored or cjson.decode(stored).code ~= ARGV[1] then return 0 end
+return redis.call('DEL', KEYS[1])
+"""
+
 
+def _delete_code_local(engine, keys: list, args: list) -> int:
+    stored = engine.cmd_get(keys[0])
+    if stored is None or json.loads(stored).get('code') != args[0]:
+        return 0
+    return engine.cmd_del(keys[0])
 
-def delete_verification_code(email: str):
-    """Clean up verification code (e.g. on email send failure)."""
-    eh = _email_hash(email)
-    r = _get_redis()
-    r.delete(f'verify:{eh}')
+
+_delete_code = Script(_DELETE_CODE_LUA, _delete_code_local)
+
+
+def delete_verification_code(email: str, code: str | None = None):
+    """Clean up verification code (e.g. on email send failure).
+
+    With `code`, only if that is still the current code, so a failed send
+    does not revoke a newer one; the compare and the delete are one script.
+    """
+    key = f'verify:{email_hash(email)}'
+    if code is None:
+        get_redis().delete(key)
+    else:
+        _delete_code(get_redis(), [key], [code])
 
 
 # ── User operations ──
+#
+# Every authenticated request resolves its X-Auth-Token, so lookups go
+# through an in-process TTL cache (unknown tokens are cached too, for a
+# shorter time, so a flood of bad tokens stays cheap). With
+# AUTH_TOKEN_INLINE_USER, tokens:{token} holds the user record itself rather
+# than the email hash, so a cache miss is one read; older hash-only entries
+# are rewritten inline the first time they are read. Anything that changes a
+# user record must call invalidate_token() (and, with inline users, rewrite
+# tokens:{token} as well).
+
+_token_cache = TTLCache(maxsize=settings.AUTH_CACHE_MAXSIZE, ttl=settings.AUTH_CACHE_TTL_SECONDS)
+_MISSING = object()
+
+
+def invalidate_token(token: str):
+    """Drop a token from this process's auth cache."""
+    _token_cache.delete(token)
+
+
+def clear_token_cache():
+    _token_cache.clear()
+
+
+def _cache_token(token: str, user: dict | None):
+    if user is None:
+        _token_cache.set(token, None, ttl=settings.AUTH_CACHE_NEGATIVE_TTL_SECONDS)
+    else:
+        _token_cache.set(token, dict(user))
+
+
+def _cached_user(token: str):
+    user = _token_cache.get(token, _MISSING)
+    if user is _MISSING or user is None:
+        return user
+    return dict(user)
+
+
+def _token_value(user: dict, eh: str) -> str:
+    if settings.AUTH_TOKEN_INLINE_USER:
+        return codec.encode(user)
+    return eh
+
+
+def _inline_user(value) -> dict | None:
+    """The user stored under tokens:{token}, or None if it holds an email hash."""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, str) and (value.startswith('{') or codec.is_encoded(value)):
+        return codec.decode(value)
+    return None
+
 
 def get_user(email: str) -> dict | None:
-    return _redis_get(f'users:{_email_hash(email)}')
+    return get_doc(f'users:{email_hash(email)}')
 
 
 def create_user(email: str) -> dict:
     token = uuid.uuid4().hex
-    eh = _email_hash(email)
+    eh = email_hash(email)
     user = {
         'email': email.lower().strip(),
         'created_at': datetime.now(timezone.utc).isoformat(),
         'token': token,
     }
-    r = _get_redis()
-    r.set(f'users:{eh}', json.dumps(user, default=str))
-    # Secondary index: token → email hash for fast lookup
-    r.set(f'tokens:{token}', eh)
+    pipe = pipeline()
+    pipe.set(f'users:{eh}', codec.encode(user))
+    # Secondary index: token → email hash (or the user itself) for fast lookup
+    pipe.set(f'tokens:{token}', _token_value(user, eh))
+    pipe.exec()
+    _cache_token(token, user)
     return user
 
 
 def get_user_by_token(token: str) -> dict | None:
-    r = _get_redis()
-    eh = r.get(f'tokens:{token}')
-    if not eh:
-        return None
-    return _redis_get(f'users:{eh}')
+    user = _cached_user(token)
+    if user is not _MISSING:
+        return user
+    r = get_redis()
+    value = r.get(f'tokens:{token}')
+    user = _inline_user(value)
+    if user is None and value:
+        user = get_doc(f'users:{value}')
+        if user and settings.AUTH_TOKEN_INLINE_USER:
+            r.set(f'tokens:{token}', _token_value(user, value))
+    _cache_token(token, user)
+    return user
+
+
+async def aget_user_by_token(token: str) -> dict | None:
+    user = _cached_user(token)
+    if user is not _MISSING:
+        return user
+    r = _get_async_redis()
+    value = await r.get(f'tokens:{token}')
+    user = _inline_user(value)
+    if user is None and value:
+        user = _decode(await r.get(f'users:{value}'))
+        if user and settings.AUTH_TOKEN_INLINE_USER:
+            await r.set(f'tokens:{token}', _token_value(user, value))
+    _cache_token(token, user)
+    return user
 
 
 # ── Chat operations ──
+#
+# A chat is split over three keys so that appending a message or changing its
+# feedback only touches that one message:
+#   chat_meta:{id}         hash — id, user_email, title, created_at, plus
+#                          updated_at and message_count for the chat list,
+#                          and the optional rolling summary (context.py)
+#   chat_messages:{id}     hash — message id → message JSON, and
+#                          feedback:{message id} → like/dislike for feedback
+#                          given after the message was stored
+#   chat_message_ids:{id}  list — message ids in the order they were sent
+#   user_chat_index:{eh}   sorted set — the user's chat ids scored by last
+#                          activity, so listing never loads messages
+# Chats written before this layout are a single JSON blob under chats:{id};
+# they are migrated to the new keys the first time they are touched. The
+# old unordered user_chats:{eh} set is folded into the index on first list.
+
+CHAT_FIELDS = ('id', 'user_email', 'title', 'created_at')
+CHAT_PAGE_SIZE = 50
+MAX_CHAT_PAGE_SIZE = 200
+
+
+def _chat_keys(chat_id: str) -> tuple[str, str, str]:
+    return (
+        f'chat_meta:{chat_id}',
+        f'chat_messages:{chat_id}',
+        f'chat_message_ids:{chat_id}',
+    )
+
+
+def _chat_meta_values(chat: dict, message_count: int = 0) -> dict:
+    values = {field: chat[field] for field in CHAT_FIELDS}
+    values['updated_at'] = chat['created_at']
+    values['message_count'] = message_count
+    return values
+
+
+def _queue_chat_meta(pipe, chat: dict, message_count: int = 0):
+    meta_key, _, _ = _chat_keys(chat['id'])
+    pipe.hset(meta_key, values=_chat_meta_values(chat, message_count))
+
+
+def _queue_touch(pipe, chat_id: str, user_email: str, **fields):
+    """Set updated_at (and any other meta fields) and move the chat to the top of its owner's list."""
+    now = datetime.now(timezone.utc)
+    meta_key, _, _ = _chat_keys(chat_id)
+    pipe.hset(meta_key, values={**fields, 'updated_at': now.isoformat()})
+    pipe.zadd(f'user_chat_index:{email_hash(user_email)}', {chat_id: now.timestamp()})
+
+
+def _queue_activity(pipe, chat_id: str, user_email: str, added: int):
+    """Bump a chat's message count and move it to the top of its owner's list."""
+    meta_key, _, _ = _chat_keys(chat_id)
+    pipe.hincrby(meta_key, 'message_count', added)
+    _queue_touch(pipe, chat_id, user_email)
+
+
+def _queue_messages(pipe, chat_id: str, messages: list):
+    if not messages:
+        return
+    _, messages_key, ids_key = _chat_keys(chat_id)
+    pipe.hset(messages_key, values={
+        m['id']: codec.encode(m) for m in messages
+    })
+    pipe.rpush(ids_key, *[m['id'] for m in messages])
+
+
+def assemble_chat(meta: dict, stored: dict, message_ids: list) -> dict:
+    chat = {field: meta.get(field) for field in CHAT_FIELDS}
+    if meta.get('summary'):
+        chat['summary'] = meta['summary']
+        chat['summary_upto'] = int(meta.get('summary_upto') or 0)
+    chat['messages'] = []
+    for mid in message_ids:
+        if mid not in stored:
+            continue
+        message = codec.decode(stored[mid])
+        feedback = stored.get(f'feedback:{mid}')
+        if feedback:
+            message['feedback'] = feedback
+        chat['messages'].append(message)
+    return chat
+
+
+# KEYS: chats:{id}, chat_meta, chat_messages, chat_message_ids.
+# ARGV: number of meta arguments, meta field/value pairs, then message
+# id/encoded pairs in order. Returns 1 if migrated here, 0 if the chat
+# already has its split keys, -1 if the blob is gone.
+_MIGRATE_CHAT_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 1 then return 0 end
+if redis.call('EXISTS', KEYS[1]) == 0 then return -1 end
+redis.call('DEL', KEYS[3], KEYS[4])
+local n = tonumber(ARGV[1])
+redis.call('HSET', KEYS[2], unpack(ARGV, 2, n + 1))
+for i = n + 2, #ARGV, 2 do
+  redis.call('HSET', KEYS[3], ARGV[i], ARGV[i + 1])
+  redis.call('RPUSH', KEYS[4], ARGV[i])
+end
+redis.call('DEL', KEYS[1])
+return 1
+"""
+
+
+def _migrate_chat_local(engine, keys: list, args: list) -> int:
+    if engine.cmd_exists(keys[1]):
+        return 0
+    if not engine.cmd_exists(keys[0]):
+        return -1
+    engine.cmd_del(keys[2], keys[3])
+    n = int(args[0])
+    engine.cmd_hset(keys[1], *args[1:n + 1])
+    pairs = args[n + 1:]
+    if pairs:
+        engine.cmd_hset(keys[2], *pairs)
+        engine.cmd_rpush(keys[3], *pairs[::2])
+    engine.cmd_del(keys[0])
+    return 1
+
+
+_migrate_chat = Script(_MIGRATE_CHAT_LUA, _migrate_chat_local)
+
+
+def _migrate_legacy_chat(chat_id: str) -> dict | None:
+    """Move a chats:{id} JSON blob to the split layout. Returns the chat.
+
+    The blob is rewritten by one script that first checks the chat has no
+    split keys yet, so concurrent first reads migrate it once; the others
+    load what the first one wrote, with anything appended since. Messages
+    without an id get one derived from their position, the same on every
+    attempt.
+    """
+    chat = get_doc(f'chats:{chat_id}')
+    if chat:
+        messages = chat.get('messages', [])
+        for i, message in enumerate(messages):
+            message.setdefault('id', hashlib.sha256(f'{chat_id}:{i}'.encode()).hexdigest()[:8])
+        meta = [str(v) for pair in _chat_meta_values(chat, len(messages)).items() for v in pair]
+        args = [len(meta), *meta]
+        for message in messages:
+            args += [message['id'], codec.encode(message)]
+        if _migrate_chat(get_redis(), [f'chats:{chat_id}', *_chat_keys(chat_id)], args) == 1:
+            return chat
+    # Migrated by a concurrent call, or gone
+    pipe = pipeline()
+    queue_chat_load(pipe, chat_id)
+    meta, stored, message_ids = pipe.exec()
+    return assemble_chat(meta, stored, message_ids) if meta else None
+
+
+def _chat_owner(chat_id: str) -> str | None:
+    """Return the chat's user_email, or None if the chat does not exist."""
+    owner = get_redis().hget(f'chat_meta:{chat_id}', 'user_email')
+    if owner is None:
+        chat = _migrate_legacy_chat(chat_id)
+        owner = chat['user_email'] if chat else None
+    return owner
+
+
+def queue_chat_load(pipe, chat_id: str):
+    """Queue the three reads that make up a chat; see _chat_from_load."""
+    meta_key, messages_key, ids_key = _chat_keys(chat_id)
+    pipe.hgetall(meta_key)
+    pipe.hgetall(messages_key)
+    pipe.lrange(ids_key, 0, -1)
+
+
+def _chat_from_load(chat_id: str, results: list) -> dict | None:
+    meta, stored, message_ids = results
+    if not meta:
+        return _migrate_legacy_chat(chat_id)
+    return assemble_chat(meta, stored, message_ids)
+
+
+def _new_message(role: str, content: str) -> dict:
+    return {
+        'id': uuid.uuid4().hex[:8],
+        'role': role,
+        'content': content,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'feedback': None,
+        'tokens': estimate_tokens(content),
+    }
+
 
 def get_chat(chat_id: str) -> dict | None:
-    return _redis_get(f'chats:{chat_id}')
+    pipe = pipeline()
+    queue_chat_load(pipe, chat_id)
+    return _chat_from_load(chat_id, pipe.exec())
 
 
 def create_chat(user_email: str, first_message: str) -> dict:
@@ -125,7 +479,7 @@ def create_chat(user_email: str, first_message: str) -> dict:
     title = first_message[:50].strip()
     if len(first_message) > 50:
         title += '...'
-    eh = _email_hash(user_email)
+    eh = email_hash(user_email)
     chat = {
         'id': chat_id,
         'user_email': user_email.lower().strip(),
@@ -133,64 +487,418 @@ def create_chat(user_email: str, first_message: str) -> dict:
         'created_at': datetime.now(timezone.utc).isoformat(),
         'messages': [],
     }
-    r = _get_redis()
-    r.set(f'chats:{chat_id}', json.dumps(chat, default=str))
-    # Track chat IDs per user
-    r.sadd(f'user_chats:{eh}', chat_id)
+    pipe = pipeline()
+    _queue_chat_meta(pipe, chat)
+    # Index chat IDs per user by last activity
+    pipe.zadd(f'user_chat_index:{eh}', {chat_id: datetime.now(timezone.utc).timestamp()})
+    pipe.exec()
     return chat
 
 
 def update_chat(chat_id: str, messages: list):
-    chat = _redis_get(f'chats:{chat_id}')
-    if not chat:
+    owner = _chat_owner(chat_id)
+    if not owner:
         return
-    chat['messages'] = messages
-    _redis_set(f'chats:{chat_id}', chat)
+    meta_key, messages_key, ids_key = _chat_keys(chat_id)
+    pipe = get_redis().multi()
+    pipe.delete(messages_key, ids_key)
+    _queue_messages(pipe, chat_id, messages)
+    # The summary described the replaced messages
+    pipe.hdel(meta_key, 'summary', 'summary_upto')
+    _queue_touch(pipe, chat_id, owner, message_count=len(messages))
+    pipe.exec()
 
 
 def add_message(chat_id: str, role: str, content: str) -> dict:
-    chat = _redis_get(f'chats:{chat_id}')
-    if not chat:
+    owner = _chat_owner(chat_id)
+    if not owner:
         return {}
-    message = {
-        'id': uuid.uuid4().hex[:8],
-        'role': role,
-        'content': content,
-        'timestamp': datetime.now(timezone.utc).isoformat(),
-        'feedback': None,
-    }
-    chat['messages'].append(message)
-    _redis_set(f'chats:{chat_id}', chat)
+    message = _new_message(role, content)
+    pipe = pipeline()
+    _queue_messages(pipe, chat_id, [message])
+    _queue_activity(pipe, chat_id, owner, 1)
+    pipe.exec()
     return message
 
 
-def update_message_feedback(chat_id: str, message_id: str, feedback: str):
-    chat = _redis_get(f'chats:{chat_id}')
-    if not chat:
-        return
-    for msg in chat['messages']:
-        if msg.get('id') == message_id:
-            msg['feedback'] = feedback
-            break
-    _redis_set(f'chats:{chat_id}', chat)
-
-
-def list_user_chats(email: str) -> list:
-    eh = _email_hash(email)
-    r = _get_redis()
-    chat_ids = r.smembers(f'user_chats:{eh}')
-    if not chat_ids:
-        return []
+# Feedback is a field of its own next to the message, since the message
+# itself may be compressed (codec.py) where Lua cannot read it. Replies:
+# 1 stored, 0 no such chat, -1 chat owned by someone else, -2 no such message.
+_MESSAGE_FEEDBACK_LUA = """
+local owner = redis.call('HGET', KEYS[1], 'user_email')
+if not owner then return 0 end
+if owner ~= ARGV[3] then return -1 end
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 0 then return -2 end
+redis.call('HSET', KEYS[2], 'feedback:' .. ARGV[1], ARGV[2])
+return 1
+"""
+
+
+def _message_feedback_local(engine, keys: list, args: list) -> int:
+    owner = engine.cmd_hget(keys[0], 'user_email')
+    if owner is None:
+        return 0
+    if owner != args[2]:
+        return -1
+    if not engine.cmd_hexists(keys[1], args[0]):
+        return -2
+    engine.cmd_hset(keys[1], f'feedback:{args[0]}', args[1])
+    return 1
+
+
+_message_feedback = Script(_MESSAGE_FEEDBACK_LUA, _message_feedback_local)
+
+FEEDBACK_RESULTS = {1: 'ok', 0: 'chat_not_found', -1: 'forbidden', -2: 'message_not_found'}
+
+
+def _message_feedback_call(chat_id: str, message_id: str, feedback: str, user_email: str) -> tuple[list, list]:
+    meta_key, messages_key, _ = _chat_keys(chat_id)
+    return [meta_key, messages_key], [message_id, feedback, user_email]
+
+
+def set_message_feedback(chat_id: str, message_id: str, feedback: str, user_email: str) -> str:
+    """Record feedback on a message if user_email owns the chat.
+
+    The ownership check and the write are one script, so this is a single
+    round trip instead of loading the chat first. Returns a FEEDBACK_RESULTS
+    value.
+    """
+    keys, args = _message_feedback_call(chat_id, message_id, feedback, user_email)
+    result = _message_feedback(get_redis(), keys, args)
+    if result == 0 and _migrate_legacy_chat(chat_id):
+        result = _message_feedback(get_redis(), keys, args)
+    return FEEDBACK_RESULTS[result]
+
+
+async def aset_message_feedback(chat_id: str, message_id: str, feedback: str, user_email: str) -> str:
+    keys, args = _message_feedback_call(chat_id, message_id, feedback, user_email)
+    result = await _message_feedback.acall(_get_async_redis(), keys, args)
+    if result == 0 and await sync_to_async(_migrate_legacy_chat, thread_sensitive=False)(chat_id):
+        result = await _message_feedback.acall(_get_async_redis(), keys, args)
+    return FEEDBACK_RESULTS[result]
+
+
+def _parse_chat_cursor(cursor: str | None) -> tuple[float | str, int]:
+    """Cursors are '<score>:<skip>' — resume at score, skipping ties already seen."""
+    if cursor:
+        try:
+            score, skip = cursor.split(':')
+            return float(score), int(skip)
+        except ValueError:
+            pass
+    return '+inf', 0
+
+
+def _backfill_chat_index(eh: str):
+    """Fold the legacy user_chats:{eh} set into the sorted-set index."""
+    legacy_key = f'user_chats:{eh}'
+    chat_ids = list(get_redis().smembers(legacy_key))
+    scores = {}
+    if chat_ids:
+        pipe = pipeline()
+        for chat_id in chat_ids:
+            pipe.hmget(f'chat_meta:{chat_id}', 'updated_at', 'created_at')
+        for chat_id, (updated_at, created_at) in zip(chat_ids, pipe.exec()):
+            if created_at is None:
+                chat = _migrate_legacy_chat(chat_id)
+                if not chat:
+                    continue
+                created_at = chat['created_at']
+            scores[chat_id] = datetime.fromisoformat(updated_at or created_at).timestamp()
+    pipe = pipeline()
+    if scores:
+        pipe.zadd(f'user_chat_index:{eh}', scores)
+    pipe.delete(legacy_key)
+    pipe.exec()
+
+
+def list_user_chats(email: str, limit: int = CHAT_PAGE_SIZE, cursor: str | None = None) -> tuple[list, str | None]:
+    """Return one page of the user's chats, most recently active first.
+
+    Pass the returned cursor back in to get the next page; it is None once
+    the last page has been returned.
+    """
+    eh = email_hash(email)
+    index_key = f'user_chat_index:{eh}'
+    max_score, skip = _parse_chat_cursor(cursor)
+
+    pipe = pipeline()
+    pipe.zrevrangebyscore(index_key, max_score, '-inf', withscores=True, offset=skip, count=limit + 1)
+    pipe.exists(f'user_chats:{eh}')
+    page, has_legacy_set = pipe.exec()
+    if has_legacy_set:
+        _backfill_chat_index(eh)
+        page = get_redis().zrevrangebyscore(
+            index_key, max_score, '-inf', withscores=True, offset=skip, count=limit + 1,
+        )
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not page:
+        return [], None
+
+    pipe = pipeline()
+    for chat_id, _ in page:
+        pipe.hmget(f'chat_meta:{chat_id}', 'id', 'title', 'created_at', 'message_count')
     result = []
-    for chat_id in chat_ids:
-        chat = _redis_get(f'chats:{chat_id}')
-        if chat:
-            result.append({
-                'id': chat['id'],
-                'title': chat['title'],
-                'created_at': chat['created_at'],
-                'message_count': len(chat.get('messages', [])),
-            })
-    # Sort by created_at descending
-    result.sort(key=lambda c: c['created_at'], reverse=True)
-    return result
+    for chat_id, title, created_at, message_count in pipe.exec():
+        if chat_id is None:
+            continue
+        result.append({
+            'id': chat_id,
+            'title': title,
+            'created_at': created_at,
+            'message_count': int(message_count or 0),
+        })
+
+    next_cursor = None
+    if has_more:
+        last_score = page[-1][1]
+        ties = sum(1 for _, score in page if score == last_score)
+        if last_score == max_score:
+            ties += skip
+        next_cursor = f'{last_score!r}:{ties}'
+    return result, next_cursor
+
+
+# ── Generation buffers ──
+#
+# Each chat_send reply is buffered in a Redis stream so a client that drops
+# mid-reply can resume it (chat/generation.py):
+#   gen:{chat_id}:{gen_id}  stream — entry id 0-N carries the events up to
+#                           and including event N (1-based) as a JSON list,
+#                           so a flush of any number of events is one XADD
+# Event N is read with XRANGE from 0-N; the entry may start with events the
+# reader already has, which read_generation_events() drops.
+
+def generation_key(chat_id: str, gen_id: str) -> str:
+    return f'gen:{chat_id}:{gen_id}'
+
+
+def queue_generation_events(pipe, key: str, offset: int, events: list):
+    """Queue events offset+1 .. offset+len(events) of a generation."""
+    if not events:
+        return
+    pipe.xadd(key, f'0-{offset + len(events)}', {'events': codec.encode(events)})
+    if offset == 0:
+        pipe.expire(key, settings.GENERATION_TTL_SECONDS)
+
+
+def _queue_generation_read(pipe, key: str, offset: int):
+    pipe.exists(key)
+    pipe.xrange(key, f'0-{offset + 1}', '+')
+
+
+def _events_from_read(offset: int, results: list) -> list | None:
+    exists, entries = results
+    if not exists:
+        return None
+    events = []
+    for entry_id, fields in entries:
+        last = int(entry_id.split('-')[1])
+        batch = codec.decode(fields[fields.index('events') + 1])
+        events.extend(batch[max(0, offset - (last - len(batch))):])
+        offset = last
+    return events
+
+
+def read_generation_events(key: str, offset: int = 0) -> list | None:
+    """Events after the first `offset`, or None if the buffer does not exist."""
+    pipe = pipeline()
+    _queue_generation_read(pipe, key, offset)
+    return _events_from_read(offset, pipe.exec())
+
+
+async def aread_generation_events(key: str, offset: int = 0) -> list | None:
+    pipe = _get_async_redis().pipeline()
+    _queue_generation_read(pipe, key, offset)
+    return _events_from_read(offset, await pipe.exec())
+
+
+def _queue_generation_owner(pipe, chat_id: str, gen_id: str):
+    pipe.hget(f'chat_meta:{chat_id}', 'user_email')
+    pipe.exists(generation_key(chat_id, gen_id))
+
+
+def generation_owner(chat_id: str, gen_id: str) -> str | None:
+    """user_email of the chat a buffered generation belongs to, None if gone."""
+    pipe = pipeline()
+    _queue_generation_owner(pipe, chat_id, gen_id)
+    owner, exists = pipe.exec()
+    return owner if exists else None
+
+
+async def ageneration_owner(chat_id: str, gen_id: str) -> str | None:
+    pipe = _get_async_redis().pipeline()
+    _queue_generation_owner(pipe, chat_id, gen_id)
+    owner, exists = await pipe.exec()
+    return owner if exists else None
+
+
+# ── Request-scoped session ──
+
+class _BaseSession:
+    """State and in-memory mutations shared by the sync and async sessions."""
+
+    def __init__(self):
+        self._users = {}
+        self._chats = {}
+        self._docs = {}
+        self._pending = []
+
+    def _require(self, chat_ids=(), keys=()):
+        raise NotImplementedError
+
+    def _missing(self, chat_ids, keys) -> tuple[list, list]:
+        return (
+            [c for c in chat_ids if c not in self._chats],
+            [k for k in keys if k not in self._docs],
+        )
+
+    @staticmethod
+    def _queue_load(pipe, chat_ids, keys):
+        for chat_id in chat_ids:
+            queue_chat_load(pipe, chat_id)
+        for key in keys:
+            pipe.get(key)
+
+    def _apply_load(self, chat_ids, keys, results) -> list:
+        """Cache loaded results. Returns the ids of chats still stored as legacy blobs."""
+        legacy = []
+        for i, chat_id in enumerate(chat_ids):
+            meta, stored, message_ids = results[i * 3:i * 3 + 3]
+            if meta:
+                self._chats[chat_id] = assemble_chat(meta, stored, message_ids)
+            else:
+                legacy.append(chat_id)
+        for key, data in zip(keys, results[len(chat_ids) * 3:]):
+            self._docs[key] = _decode(data)
+        return legacy
+
+    def _take_pending(self) -> list:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def get_chat(self, chat_id: str) -> dict | None:
+        self._require(chat_ids=[chat_id])
+        return self._chats[chat_id]
+
+    def get_doc(self, key: str) -> dict | None:
+        self._require(keys=[key])
+        return self._docs[key]
+
+    def set_doc(self, key: str, data: dict):
+        self._docs[key] = data
+        self._pending.append(
+            lambda pipe: pipe.set(key, codec.encode(data))
+        )
+
+    def add_message(self, chat_id: str, role: str, content: str) -> dict:
+        chat = self.get_chat(chat_id)
+        if not chat:
+            return {}
+        message = _new_message(role, content)
+        chat['messages'].append(message)
+
+        def queue(pipe):
+            _queue_messages(pipe, chat_id, [message])
+            _queue_activity(pipe, chat_id, chat['user_email'], 1)
+        self._pending.append(queue)
+        return message
+
+    def set_chat_summary(self, chat_id: str, summary: str, upto: int):
+        """Store the chat's rolling summary, covering its first `upto` messages."""
+        chat = self.get_chat(chat_id)
+        if not chat:
+            return
+        chat['summary'] = summary
+        chat['summary_upto'] = upto
+        meta_key, _, _ = _chat_keys(chat_id)
+        self._pending.append(
+            lambda pipe: pipe.hset(meta_key, values={'summary': summary, 'summary_upto': upto})
+        )
+
+    def queue_write(self, queue):
+        """Queue queue(pipe), which adds commands to the pipeline of the next flush()."""
+        self._pending.append(queue)
+
+    def append_generation_events(self, key: str, offset: int, events: list):
+        """Queue events offset+1.. of a generation buffer (see queue_generation_events)."""
+        self._pending.append(
+            lambda pipe: queue_generation_events(pipe, key, offset, events)
+        )
+
+
+class StorageSession(_BaseSession):
+    """Unit of work over the storage operations for a single request.
+
+    Documents are cached once loaded, so a view never fetches the same chat
+    or user twice. Mutations are applied to the cached copy (views keep
+    working with the in-memory chat) and queued until flush() sends them to
+    Redis in one pipeline. Nothing is written until flush() is called.
+    """
+
+    def _require(self, chat_ids=(), keys=()):
+        self.load(chat_ids, keys)
+
+    def load(self, chat_ids=(), keys=()):
+        """Fetch any chats and JSON documents not yet cached in one round trip."""
+        chat_ids, keys = self._missing(chat_ids, keys)
+        if not chat_ids and not keys:
+            return
+        pipe = pipeline()
+        self._queue_load(pipe, chat_ids, keys)
+        for chat_id in self._apply_load(chat_ids, keys, pipe.exec()):
+            self._chats[chat_id] = _migrate_legacy_chat(chat_id)
+
+    def get_user_by_token(self, token: str) -> dict | None:
+        if token not in self._users:
+            self._users[token] = get_user_by_token(token)
+        return self._users[token]
+
+    def flush(self):
+        """Send all queued writes to Redis in a single pipeline."""
+        pending = self._take_pending()
+        if not pending:
+            return
+        pipe = pipeline()
+        for queue in pending:
+            queue(pipe)
+        pipe.exec()
+
+
+class AsyncStorageSession(_BaseSession):
+    """StorageSession for async views.
+
+    All I/O happens in the awaitable load(), get_user_by_token() and flush();
+    get_chat() and get_doc() only read what load() has already fetched.
+    """
+
+    def _require(self, chat_ids=(), keys=()):
+        chat_ids, keys = self._missing(chat_ids, keys)
+        if chat_ids or keys:
+            raise LookupError(f'await load() before reading {chat_ids + keys}')
+
+    async def load(self, chat_ids=(), keys=()):
+        chat_ids, keys = self._missing(chat_ids, keys)
+        if not chat_ids and not keys:
+            return
+        pipe = _get_async_redis().pipeline()
+        self._queue_load(pipe, chat_ids, keys)
+        for chat_id in self._apply_load(chat_ids, keys, await pipe.exec()):
+            # Rare one-off migration; run the sync version off the event loop
+            self._chats[chat_id] = await sync_to_async(_migrate_legacy_chat, thread_sensitive=False)(chat_id)
+
+    async def get_user_by_token(self, token: str) -> dict | None:
+        if token not in self._users:
+            self._users[token] = await aget_user_by_token(token)
+        return self._users[token]
+
+    async def flush(self):
+        pending = self._take_pending()
+        if not pending:
+            return
+        pipe = _get_async_redis().pipeline()
+        for queue in pending:
+            queue(pipe)
+        await pipe.exec()
@@ -0,0 +1,164 @@
+"""Per-request timing spans and process-wide latency histograms.
+
+Services wrap their outbound calls in span('redis' | 'llm' | 'ssp' | ...),
+or call record() for durations they measure themselves. Each span adds to
+the current request's RequestTimings, which TimingMiddleware turns into a
+Server-Timing header (or a final SSE event on streams), and to a histogram
+that the metrics endpoint reports. A span costs two perf_counter() calls
+and a couple of dict updates, so this stays on in production.
+"""
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds (ms) of the histogram buckets; the last bucket is unbounded
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+
+class RequestTimings:
+    """Count and total duration per span name within one request."""
+
+    __slots__ = ('started', 'spans', '_lock')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        # Background ad workers record into the same request
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [1, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> dict:
+        """{name: {'count': n, 'ms': total}} plus the request's total so far."""
+        with self._lock:
+            spans = {
+                name: {'count': count, 'ms': round(seconds * 1000, 1)}
+                for name, (count, seconds) in self.spans.items()
+            }
+        spans['total'] = {'count': 1, 'ms': round(self.elapsed() * 1000, 1)}
+        return spans
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. 'redis;dur=4.2;desc="3 calls", total;dur=18.0'."""
+        parts = []
+        for name, span in self.as_dict().items():
+            part = f'{name};dur={span["ms"]}'
+            if name != 'total':
+                part += f';desc="{span["count"]} call{"s" if span["count"] != 1 else ""}"'
+            parts.append(part)
+        return ', '.join(parts)
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (thread-safe)."""
+
+    __slots__ = ('counts', 'count', 'sum_ms', '_lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, ms: float):
+        i = bisect.bisect_left(BUCKETS_MS, ms)
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum_ms += ms
+
+    def quantile(self, q: float) -> float | None:
+        """Upper bound of the bucket holding the q-quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else float('inf')
+        return float('inf')
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            buckets = {str(bound): n for bound, n in zip(BUCKETS_MS, self.counts)}
+            buckets['+Inf'] = self.counts[-1]
+            return {
+                'count': self.count,
+                'sum_ms': round(self.sum_ms, 1),
+                'p50_ms': self.quantile(0.5),
+                'p95_ms': self.quantile(0.95),
+                'p99_ms': self.quantile(0.99),
+                'buckets': buckets,
+            }
+
+
+_current = contextvars.ContextVar('request_timings', default=None)
+_histograms = {}
+_histograms_lock = threading.Lock()
+
+
+def start_request() -> RequestTimings | None:
+    """Begin collecting spans for the current request (None if disabled)."""
+    if not settings.TIMING_ENABLED:
+        return None
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def activate(timings: RequestTimings | None):
+    """Make `timings` current again, e.g. when a response stream is iterated."""
+    _current.set(timings)
+
+
+def current() -> RequestTimings | None:
+    return _current.get()
+
+
+def histogram(name: str) -> Histogram:
+    hist = _histograms.get(name)
+    if hist is None:
+        with _histograms_lock:
+            hist = _histograms.setdefault(name, Histogram())
+    return hist
+
+
+def record(name: str, seconds: float):
+    """Record a duration measured by the caller."""
+    if not settings.TIMING_ENABLED:
+        return
+    timings = _current.get()
+    if timings is not None:
+        timings.add(name, seconds)
+    histogram(name).observe(seconds * 1000)
+
+
+@contextlib.contextmanager
+def span(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def metrics() -> dict:
+    """Snapshot of every histogram in this process."""
+    with _histograms_lock:
+        names = sorted(_histograms)
+    return {name: _histograms[name].snapshot() for name in names}
@@ -1,5 +1,16 @@
+import atexit
+import logging
+import os
+import re
+import threading
 from datetime import datetime, timezone
-from .storage import _email_hash, _redis_get, _redis_set
+
+from django.conf import settings
+
+from .backends.script import Script
+from .storage import email_hash, get_redis, pipeline, get_doc
+
+logger = logging.getLogger(__name__)
 
 INTEREST_KEYWORDS = {
     'technology': ['code', 'coding', 'programming', 'software', 'app', 'computer', 'tech', 'developer', 'api', 'python', 'javascript', 'react', 'ai', 'machine learning', 'data', 'algorithm', 'web', 'database', 'cloud', 'server'],
@@ -13,39 +24,330 @@ INTEREST_KEYWORDS = {
 }
 
 
+_WORD = re.compile(r'\w+')
+# For ASCII text: maps each byte to itself lowercased if it is a word
+# character (\w), else to a space, so one translate() and split() give the
+# same words as _WORD.findall(text.lower()) without the regex engine
+_ASCII_WORDS = bytes(
+    ord(chr(c).lower()) if chr(c).isalnum() or chr(c) == '_' else ord(' ')
+    for c in range(128)
+) + b' ' * 128
+
+
+def _keyword_categories() -> dict:
+    keyword_categories = {}
+    for category, keywords in INTEREST_KEYWORDS.items():
+        for keyword in keywords:
+            keyword_categories.setdefault(keyword, []).append(category)
+    return keyword_categories
+
+
+_KEYWORD_CATEGORIES = _keyword_categories()
+
+
+class _Keywords:
+    """Keyword lookups over words of one type: str, or bytes for ASCII text."""
+
+    def __init__(self, encode):
+        self.categories = {}  # keyword, as that type → [(category, keyword)]
+        self.phrases = {}  # first word of a multi-word keyword → {keyword as that type: pattern}
+        for keyword, categories in _KEYWORD_CATEGORIES.items():
+            self.categories[encode(keyword)] = [(category, keyword) for category in categories]
+            first, _, rest = keyword.partition(' ')
+            if rest:
+                pattern = re.compile(encode(r'\b' + re.escape(keyword) + r'\b'), re.IGNORECASE)
+                self.phrases.setdefault(encode(first), {})[encode(keyword)] = pattern
+        # Every word worth a look: the one-word keywords and the phrase starts
+        self.words = frozenset(k for k in self.categories if len(k.split()) == 1) | frozenset(self.phrases)
+
+    def match(self, text, words: list, count_words) -> dict:
+        """match_interests() for text and its lowercased words.
+
+        count_words(end) is how many words start before offset `end`.
+        """
+        present = self.words.intersection(words)
+        if present.isdisjoint(self.phrases):
+            ordered = sorted(present, key=words.index)
+        else:
+            positions = {word: words.index(word) for word in present if word in self.categories}
+            for first in present.intersection(self.phrases):
+                for keyword, pattern in self.phrases[first].items():
+                    match = pattern.search(text)
+                    if match:
+                        # Ahead of a keyword that is its own first word
+                        positions[keyword] = count_words(match.start()) - 0.5
+            ordered = sorted(positions, key=positions.get)
+        found = {}
+        for keyword in ordered:
+            for category, name in self.categories[keyword]:
+                found.setdefault(category, name)
+        return found
+
+
+_STR_KEYWORDS = _Keywords(lambda s: s)
+_ASCII_KEYWORDS = _Keywords(str.encode)
+
+
+def match_interests(text: str) -> dict:
+    """Map each interest category mentioned in text to its first keyword hit.
+
+    The text is split into words once and the words are intersected with
+    the keyword set, so the work is one tokenizing pass plus a set lookup
+    per word, however many keywords there are. Keywords only match whole
+    words, so 'ai' does not fire on 'said' nor 'app' on 'happy'; multi-word
+    ones ('machine learning') are only searched for when their first word
+    is there.
+    """
+    if text.isascii():
+        data = text.encode()
+        split = data.translate(_ASCII_WORDS)
+        return _ASCII_KEYWORDS.match(data, split.split(), lambda end: len(split[:end].split()))
+    lowered = text.lower()
+    return _STR_KEYWORDS.match(lowered, _WORD.findall(lowered), lambda end: len(_WORD.findall(lowered, 0, end)))
+
+
+# ── Profiles ──
+#
+# A profile is kept as counters that are only ever incremented, so
+# concurrent sends from the same user never lose an update:
+#   profile:{eh}         hash — email, last_active, total_messages and one
+#                        'interest:<category>' count per category
+#   profile_topics:{eh}  list — recent topic keywords, newest first, capped
+#                        at RECENT_TOPICS
+# Profiles written before this layout are a JSON blob under profiles:{eh};
+# get_profile() folds them into the new keys on first read.
+#
+# update_interests() never touches Redis on the request path. Updates are
+# merged per user in an in-process buffer (at most PROFILE_BUFFER_MAXSIZE
+# users; more are dropped and logged) that a background thread flushes in
+# one pipeline every PROFILE_FLUSH_SECONDS, or sooner once
+# PROFILE_FLUSH_BATCH users are waiting. What is left is flushed at exit.
+# With PROFILE_FLUSH_SECONDS=0 updates are written through instead, queued on
+# the request's StorageSession so they ride its next flush.
+
+RECENT_TOPICS = 20
+_INTEREST_PREFIX = 'interest:'
+
+
+def profile_key(email: str) -> str:
+    return f'profile:{email_hash(email)}'
+
+
+def topics_key(eh: str) -> str:
+    return f'profile_topics:{eh}'
+
+
+class _Update:
+    """Increments for one user's profile, merged across messages."""
+
+    __slots__ = ('email', 'interests', 'topics', 'messages', 'last_active')
+
+    def __init__(self, email: str):
+        self.email = email
+        self.interests = {}
+        self.topics = []  # newest first
+        self.messages = 0
+        self.last_active = None
+
+    def add(self, matches: dict):
+        for category, keyword in matches.items():
+            self.interests[category] = self.interests.get(category, 0) + 1
+            if keyword in self.topics:
+                self.topics.remove(keyword)
+            self.topics.insert(0, keyword)
+        del self.topics[RECENT_TOPICS:]
+        self.messages += 1
+        self.last_active = datetime.now(timezone.utc).isoformat()
+
+    def queue(self, pipe):
+        eh = email_hash(self.email)
+        key = f'profile:{eh}'
+        if self.last_active:
+            pipe.hset(key, values={'email': self.email, 'last_active': self.last_active})
+        pipe.hincrby(key, 'total_messages', self.messages)
+        for category, count in self.interests.items():
+            pipe.hincrby(key, _INTEREST_PREFIX + category, count)
+        if self.topics:
+            list_key = topics_key(eh)
+            for keyword in self.topics:
+                pipe.lrem(list_key, 0, keyword)
+            pipe.lpush(list_key, *reversed(self.topics))
+            pipe.ltrim(list_key, 0, RECENT_TOPICS - 1)
+
+
+class _WriteBehindBuffer:
+    """Pending profile updates by email, flushed by a background thread."""
+
+    def __init__(self):
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self.dropped = 0
+
+    def add(self, email: str, matches: dict):
+        with self._lock:
+            update = self._pending.get(email)
+            if update is None:
+                if len(self._pending) >= settings.PROFILE_BUFFER_MAXSIZE:
+                    self.dropped += 1
+                    logger.warning('Profile buffer full; dropped an update (%d so far)', self.dropped)
+                    self._wakeup.set()
+                    return
+                update = self._pending[email] = _Update(email)
+            update.add(matches)
+            if len(self._pending) >= settings.PROFILE_FLUSH_BATCH:
+                self._wakeup.set()
+            if self._thread is None:
+                self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='profile-flush', daemon=True)
+        self._thread.start()
+
+    def _after_fork(self):
+        # Threads don't survive fork(); a forked worker starts its own flusher
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(settings.PROFILE_FLUSH_SECONDS)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        """Write every pending update to Redis in one pipeline."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            pipe = pipeline()
+            for update in pending.values():
+                update.queue(pipe)
+            pipe.exec()
+        except Exception:
+            logger.warning('Could not flush %d profile updates', len(pending), exc_info=True)
+
+
+_buffer = _WriteBehindBuffer()
+atexit.register(_buffer.flush)
+os.register_at_fork(after_in_child=_buffer._after_fork)
+
+
+def flush():
+    """Write buffered profile updates now (e.g. before a process exits)."""
+    _buffer.flush()
+
+
+# KEYS: profiles:{eh}, profile:{eh}, profile_topics:{eh}. ARGV: email,
+# last_active, total_messages, topics cap, number of interests, interest
+# field/count pairs, then older topics. Adds the counts only if this call
+# deleted the blob, so concurrent reads fold it in once.
+_FOLD_PROFILE_LUA = """
+if redis.call('DEL', KEYS[1]) == 0 then return 0 end
+redis.call('HINCRBY', KEYS[2], 'total_messages', ARGV[3])
+local n = tonumber(ARGV[5])
+for i = 6, 5 + n * 2, 2 do
+  redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+end
+redis.call('HSETNX', KEYS[2], 'email', ARGV[1])
+redis.call('HSETNX', KEYS[2], 'last_active', ARGV[2])
+if #ARGV > 5 + n * 2 then
+  redis.call('RPUSH', KEYS[3], unpack(ARGV, 6 + n * 2))
+  redis.call('LTRIM', KEYS[3], 0, tonumber(ARGV[4]) - 1)
+end
+return 1
+"""
+
+
+def _fold_profile_local(engine, keys: list, args: list) -> int:
+    if not engine.cmd_del(keys[0]):
+        return 0
+    engine.cmd_hincrby(keys[1], 'total_messages', args[2])
+    n = int(args[4])
+    for i in range(5, 5 + n * 2, 2):
+        engine.cmd_hincrby(keys[1], args[i], args[i + 1])
+    engine.cmd_hsetnx(keys[1], 'email', args[0])
+    engine.cmd_hsetnx(keys[1], 'last_active', args[1])
+    older = args[5 + n * 2:]
+    if older:
+        engine.cmd_rpush(keys[2], *older)
+        engine.cmd_ltrim(keys[2], '0', str(int(args[3]) - 1))
+    return 1
+
+
+_fold_profile = Script(_FOLD_PROFILE_LUA, _fold_profile_local)
+
+
+def _migrate_legacy_profile(eh: str, topics: list):
+    """Fold a profiles:{eh} JSON blob into the counters."""
+    legacy = get_doc(f'profiles:{eh}')
+    if not legacy:
+        return
+    interests = legacy.get('interests', {})
+    # Anything recorded since the last legacy write is newer; keep it first
+    older = [t for t in legacy.get('recent_topics', []) if t not in topics]
+    args = [
+        legacy.get('email', ''),
+        legacy.get('last_active') or datetime.now(timezone.utc).isoformat(),
+        str(legacy.get('total_messages', 0)),
+        str(RECENT_TOPICS),
+        str(len(interests)),
+    ]
+    for category, count in interests.items():
+        args += [_INTEREST_PREFIX + category, str(count)]
+    _fold_profile(get_redis(), [f'profiles:{eh}', f'profile:{eh}', topics_key(eh)], args + older)
+
+
 def get_profile(email: str) -> dict:
-    eh = _email_hash(email)
-    profile = _redis_get(f'profiles:{eh}')
-    if profile:
-        return profile
+    """The user's interest profile (updates still buffered are not included)."""
+    eh = email_hash(email)
+    pipe = pipeline()
+    pipe.hgetall(f'profile:{eh}')
+    pipe.lrange(topics_key(eh), 0, -1)
+    pipe.exists(f'profiles:{eh}')
+    stored, topics, has_legacy = pipe.exec()
+    if has_legacy:
+        _migrate_legacy_profile(eh, topics)
+        return get_profile(email)
+    return assemble_profile(stored, topics, email)
+
+
+def assemble_profile(stored: dict, topics: list, email: str = '') -> dict:
     return {
-        'email': email.lower().strip(),
-        'interests': {},
-        'recent_topics': [],
-        'total_messages': 0,
-        'last_active': datetime.now(timezone.utc).isoformat(),
+        'email': stored.get('email') or email.lower().strip(),
+        'interests': {
+            field[len(_INTEREST_PREFIX):]: int(count)
+            for field, count in stored.items() if field.startswith(_INTEREST_PREFIX)
+        },
+        'recent_topics': topics,
+        'total_messages': int(stored.get('total_messages') or 0),
+        'last_active': stored.get('last_active') or datetime.now(timezone.utc).isoformat(),
     }
 
 
-def update_interests(email: str, message: str):
-    profile = get_profile(email)
-    message_lower = message.lower()
+def update_interests(email: str, message: str, session=None) -> dict:
+    """Count interest keywords in a message towards the user's profile.
 
-    matched_topics = []
-    for category, keywords in INTEREST_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword in message_lower:
-                current = profile['interests'].get(category, 0)
-                profile['interests'][category] = current + 1
-                if keyword not in profile['recent_topics']:
-                    matched_topics.append(keyword)
-                break
-
-    # Keep recent_topics to last 20
-    profile['recent_topics'] = (matched_topics + profile['recent_topics'])[:20]
-    profile['total_messages'] = profile.get('total_messages', 0) + 1
-    profile['last_active'] = datetime.now(timezone.utc).isoformat()
-
-    eh = _email_hash(email)
-    _redis_set(f'profiles:{eh}', profile)
-    return profile
+    Returns the matched {category: keyword}. The update goes to the
+    write-behind buffer; with write-behind off it is queued on `session`
+    (or written at once without one).
+    """
+    email = email.lower().strip()
+    matches = match_interests(message)
+    if settings.PROFILE_FLUSH_SECONDS > 0:
+        _buffer.add(email, matches)
+        return matches
+
+    update = _Update(email)
+    update.add(matches)
+    if session:
+        session.queue_write(update.queue)
+    else:
+        pipe = pipeline()
+        update.queue(pipe)
+        pipe.exec()
+    return matches
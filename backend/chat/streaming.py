@@ -0,0 +1,176 @@
+"""Coalescing and heartbeats for the model's token stream.
+
+The model yields one tiny delta per token. coalesce() (and acoalesce() for
+the async views) batch them into one chunk per SSE_COALESCE_MS window or
+SSE_COALESCE_BYTES of text, whichever comes first. When nothing has been
+sent for SSE_HEARTBEAT_SECONDS they yield HEARTBEAT instead, which the
+views send as an SSE comment so idle proxies keep the connection open.
+
+The sync version reads the model on a pump thread, so a window can close
+(and a heartbeat go out) while the model is still thinking.
+"""
+import asyncio
+import contextvars
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+HEARTBEAT = object()
+HEARTBEAT_FRAME = ': keepalive\n\n'
+
+_DELTA, _END, _ERROR = range(3)
+
+
+class _Batcher:
+    """Buffered text plus the deadlines for flushing it and for the next heartbeat."""
+
+    def __init__(self, window: float, max_bytes: int, heartbeat: float):
+        self.window = window
+        self.max_bytes = max_bytes
+        self.heartbeat = heartbeat
+        self.parts = []
+        self.size = 0
+        self.flush_at = None
+        self.last_sent = time.monotonic()
+
+    def add(self, delta: str) -> bool:
+        """Buffer a delta; True if the buffer should be flushed now."""
+        self.parts.append(delta)
+        self.size += len(delta)
+        if self.flush_at is None:
+            self.flush_at = time.monotonic() + self.window
+        return self.size >= self.max_bytes or time.monotonic() >= self.flush_at
+
+    def take(self) -> str:
+        text = ''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        self.flush_at = None
+        self.last_sent = time.monotonic()
+        return text
+
+    def timeout(self) -> float | None:
+        """Seconds until something is due, or None to wait indefinitely."""
+        deadlines = []
+        if self.flush_at is not None:
+            deadlines.append(self.flush_at)
+        if self.heartbeat:
+            deadlines.append(self.last_sent + self.heartbeat)
+        if not deadlines:
+            return None
+        return max(0.0, min(deadlines) - time.monotonic())
+
+    def due(self):
+        """What to yield after a wait timed out: text, HEARTBEAT or None."""
+        now = time.monotonic()
+        if self.parts and now >= self.flush_at:
+            return self.take()
+        if self.heartbeat and now >= self.last_sent + self.heartbeat:
+            self.last_sent = now
+            return HEARTBEAT
+        return None
+
+
+def _options(window, max_bytes, heartbeat) -> tuple[float, int, float]:
+    if window is None:
+        window = settings.SSE_COALESCE_MS / 1000
+    if max_bytes is None:
+        max_bytes = settings.SSE_COALESCE_BYTES
+    if heartbeat is None:
+        heartbeat = settings.SSE_HEARTBEAT_SECONDS
+    return window, max_bytes, heartbeat
+
+
+def coalesce(deltas, window=None, max_bytes=None, heartbeat=None):
+    """Batch a sync iterator of text deltas; see the module docstring."""
+    window, max_bytes, heartbeat = _options(window, max_bytes, heartbeat)
+    if not window and not heartbeat:
+        yield from deltas
+        return
+
+    items = queue.SimpleQueue()
+    stop = threading.Event()
+
+    def pump():
+        try:
+            for delta in deltas:
+                if stop.is_set():
+                    break
+                items.put((_DELTA, delta))
+        except BaseException as e:
+            items.put((_ERROR, e))
+        else:
+            items.put((_END, None))
+        finally:
+            close = getattr(deltas, 'close', None)
+            if close:
+                close()
+
+    # A copy of the context so the model's timing spans land on this request
+    threading.Thread(
+        target=contextvars.copy_context().run, args=(pump,),
+        name='sse-pump', daemon=True,
+    ).start()
+
+    batch = _Batcher(window, max_bytes, heartbeat)
+    try:
+        while True:
+            try:
+                kind, value = items.get(timeout=batch.timeout())
+            except queue.Empty:
+                due = batch.due()
+                if due is not None:
+                    yield due
+                continue
+            if kind == _DELTA:
+                if batch.add(value):
+                    yield batch.take()
+                continue
+            if batch.parts:
+                yield batch.take()
+            if kind == _ERROR:
+                raise value
+            return
+    finally:
+        stop.set()
+
+
+async def acoalesce(deltas, window=None, max_bytes=None, heartbeat=None):
+    """Async counterpart of coalesce() for an async iterator of deltas."""
+    window, max_bytes, heartbeat = _options(window, max_bytes, heartbeat)
+    if not window and not heartbeat:
+        async for delta in deltas:
+            yield delta
+        return
+
+    iterator = deltas.__aiter__()
+    batch = _Batcher(window, max_bytes, heartbeat)
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=batch.timeout())
+            if not done:
+                due = batch.due()
+                if due is not None:
+                    yield due
+                continue
+            task, pending = pending, None
+            try:
+                delta = task.result()
+            except StopAsyncIteration:
+                if batch.parts:
+                    yield batch.take()
+                return
+            except Exception:
+                if batch.parts:
+                    yield batch.take()
+                raise
+            if batch.add(delta):
+                yield batch.take()
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,26 @@
+"""Tests for the chat app. Run from backend/ with python manage.py test chat.
+
+They run against the local fakes in benchmarks/fakes.py, so they need no
+keys or network. The Lua script tests also need lupa (pip install lupa)
+and are skipped without it.
+"""
+from django.test import SimpleTestCase
+
+from benchmarks.fakes import use_fakes
+
+
+class FakesTestCase(SimpleTestCase):
+    """Runs each test against fresh in-process fakes, storing through `backend`.
+
+    With `lua`, the Upstash fake runs the Lua source of each script rather
+    than its Python version (backend must be 'upstash').
+    """
+
+    backend = 'memory'
+    lua = False
+
+    def setUp(self):
+        self.fakes = self.enterContext(use_fakes(remote=False, storage_backend=self.backend))
+        if self.lua:
+            from .lua import LuaEngine
+            self.fakes.redis.engine = LuaEngine()
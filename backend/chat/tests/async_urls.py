@@ -0,0 +1,9 @@
+"""chat_send and chat_ads served by chat/async_views.py, as under ASGI (CHAT_ASYNC_VIEWS)."""
+from django.urls import path
+
+from chat import async_views
+
+urlpatterns = [
+    path('api/chats/<str:chat_id>/send/', async_views.chat_send),
+    path('api/chats/<str:chat_id>/ads/', async_views.chat_ads),
+]
@@ -0,0 +1,99 @@
+"""Run the Lua source of the storage scripts, the way Redis would.
+
+engine.Engine runs the Python version registered for each script.
+LuaEngine runs the Lua body itself, in Lua 5.1 (the version Redis embeds),
+with redis.call going to the engine and cjson backed by Python's json.
+Tests use it to check that both versions of a script agree, and to drive
+the services through the Lua that is sent to Upstash. It needs lupa
+(pip install lupa); without it, `lua_available` is False.
+"""
+import hashlib
+import json
+
+from chat.services.backends.engine import CommandError, Engine
+
+try:
+    from lupa.lua51 import LuaError, LuaRuntime
+except ImportError:  # pragma: no cover
+    LuaRuntime = None
+
+lua_available = LuaRuntime is not None
+
+
+class LuaEngine(Engine):
+    """An Engine whose EVAL and EVALSHA run the script's Lua source."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sources = {}
+        self.runtime = LuaRuntime(unpack_returned_tuples=False)
+        self._lua_type = self.runtime.eval('type')
+        self.runtime.globals().redis = self.runtime.table_from({'call': self._redis_call})
+        self.runtime.globals().cjson = self.runtime.table_from({
+            'encode': self._cjson_encode,
+            'decode': self._cjson_decode,
+        })
+
+    def cmd_eval(self, body, numkeys, *args):
+        self.sources[hashlib.sha1(body.encode()).hexdigest()] = body
+        return super().cmd_eval(body, numkeys, *args)
+
+    def cmd_script(self, subcommand, *args):
+        if subcommand.upper() == 'LOAD':
+            self.sources[hashlib.sha1(args[0].encode()).hexdigest()] = args[0]
+        return super().cmd_script(subcommand, *args)
+
+    def _call_script(self, sha, numkeys, args):
+        n = int(numkeys)
+        lua_globals = self.runtime.globals()
+        lua_globals.KEYS = self.runtime.table(*args[:n])
+        lua_globals.ARGV = self.runtime.table(*args[n:])
+        try:
+            result = self.runtime.execute(self.sources[sha])
+        except LuaError as e:
+            raise CommandError(f'ERR Error running script: {e}') from e
+        return self._from_lua(result)
+
+    # ── Conversions (https://redis.io/docs/interact/programmability/lua-api/) ──
+
+    def _redis_call(self, *command):
+        return self._to_lua(self.execute(list(command)))
+
+    def _to_lua(self, reply):
+        if reply is None:
+            return False
+        if isinstance(reply, list):
+            return self.runtime.table(*[self._to_lua(item) for item in reply])
+        return reply
+
+    def _from_lua(self, value):
+        if value is None or value is False:
+            return None
+        if value is True:
+            return 1
+        if isinstance(value, float):
+            return int(value)
+        if self._lua_type(value) == 'table':
+            items = []
+            for i in range(1, len(value) + 1):
+                if value[i] is None:
+                    break
+                items.append(self._from_lua(value[i]))
+            return items
+        return value
+
+    def _cjson_decode(self, text):
+        return self.runtime.table_from(json.loads(text), recursive=True)
+
+    def _cjson_encode(self, table):
+        return json.dumps(self._from_table(table), separators=(',', ':'))
+
+    def _from_table(self, value):
+        if isinstance(value, float) and value.is_integer():
+            return int(value)
+        if self._lua_type(value) != 'table':
+            return value
+        items = dict(value.items())
+        if items and list(items) == list(range(1, len(items) + 1)):
+            return [self._from_table(item) for item in items.values()]
+        return {key: self._from_table(item) for key, item in items.items()}
@@ -0,0 +1,168 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from chat.services import ads
+from chat.services.ads import CircuitBreaker
+from . import FakesTestCase
+
+MESSAGES = [
+    {'role': 'user', 'content': 'Which running shoes for a marathon?'},
+    {'role': 'assistant', 'content': 'Something with cushioning.'},
+]
+
+
+@override_settings(THRAD_FILL_THRESHOLD=0)
+class BidCacheTests(FakesTestCase):
+    def _ad(self, turn_number: int = 1) -> dict:
+        return ads.get_thrad_ad(MESSAGES, 'user@example.com', 'chat-1', turn_number=turn_number)
+
+    def test_bid_is_cached(self):
+        self.assertEqual(self._ad(), self.fakes.thrad.BID)
+        self.assertEqual(self._ad(), self.fakes.thrad.BID)
+        self.assertEqual(self.fakes.thrad.requests, 1)
+        # A different turn is a new auction
+        self._ad(turn_number=2)
+        self.assertEqual(self.fakes.thrad.requests, 2)
+
+    @override_settings(THRAD_AD_NO_BID_TTL_SECONDS=0.2)
+    def test_no_bid_is_cached_briefly(self):
+        self.fakes.thrad.fill_rate = 0
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self.assertIn(self._ad(), ads.MOCK_ADS)
+            self.assertIn(self._ad(), ads.MOCK_ADS)
+        # Both keys, once
+        self.assertEqual(self.fakes.thrad.requests, 2)
+        time.sleep(0.25)
+        self.fakes.thrad.fill_rate = 1
+        self.assertEqual(self._ad(), self.fakes.thrad.BID)
+        self.assertEqual(self.fakes.thrad.requests, 3)
+
+    @override_settings(THRAD_AD_NO_BID_TTL_SECONDS=0)
+    def test_no_bid_cache_can_be_turned_off(self):
+        self.fakes.thrad.fill_rate = 0
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self._ad()
+            self._ad()
+        self.assertEqual(self.fakes.thrad.requests, 4)
+
+    def test_failures_are_not_cached(self):
+        self.fakes.thrad.error_rate = 1
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self._ad()
+        self.fakes.thrad.error_rate = 0
+        self.assertEqual(self._ad(), self.fakes.thrad.BID)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = [1000.0]
+        self.enterContext(mock.patch('chat.services.ads.time.monotonic', lambda: self.now[0]))
+        self.breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=30)
+
+    def _open(self):
+        for success in (True, True, False):
+            self.breaker.record(success)
+        self.assertTrue(self.breaker.allow())
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self.breaker.record(False)
+        self.assertFalse(self.breaker.allow())
+
+    def test_opens_at_the_failure_rate_once_the_window_has_enough_calls(self):
+        for _ in range(3):
+            self.breaker.record(False)
+        self.assertTrue(self.breaker.allow())
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self.breaker.record(False)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_lets_one_probe_through(self):
+        self._open()
+        self.now[0] += 29
+        self.assertFalse(self.breaker.allow())
+        self.now[0] += 1
+        self.assertTrue(self.breaker.allow())
+        self.assertFalse(self.breaker.allow())
+        # A straggler from before the breaker opened doesn't decide
+        self.breaker.record(True)
+        self.assertTrue(self.breaker.allow())
+
+    def test_successful_probe_closes(self):
+        self._open()
+        self.now[0] += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(True)
+        self.assertTrue(self.breaker.allow())
+        self.assertTrue(self.breaker.allow())
+        # With a fresh window: three failures are not enough to reopen
+        for _ in range(3):
+            self.breaker.record(False)
+        self.assertTrue(self.breaker.allow())
+
+    def test_failed_probe_reopens(self):
+        self._open()
+        self.now[0] += 30
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record(False)
+        self.assertFalse(self.breaker.allow())
+        self.now[0] += 29
+        self.assertFalse(self.breaker.allow())
+        self.now[0] += 1
+        self.assertTrue(self.breaker.allow())
+
+
+@override_settings(THRAD_AD_BUDGET_SECONDS=1, THRAD_HEDGE_DELAY_SECONDS=0.1)
+class RequestBidTests(FakesTestCase):
+    PAYLOAD = {'chatId': 'chat-1', 'messages': []}
+
+    def _fake_ssp(self, answers: dict) -> list:
+        """Patch the SSP call: key → (seconds to answer, bid). Returns the (key, timeout) of each call."""
+        calls = []
+        lock = threading.Lock()
+
+        def call(api_key, payload, timeout):
+            with lock:
+                calls.append((api_key, timeout))
+            delay, bid = answers[api_key]
+            time.sleep(delay)
+            return bid
+        self.enterContext(mock.patch.object(ads, '_call_thrad_api', call))
+        return calls
+
+    def test_slow_primary_is_hedged_onto_the_fallback(self):
+        calls = self._fake_ssp({'fake-primary': (0.5, {'from': 'primary'}), 'fake-fallback': (0, {'from': 'fallback'})})
+        bid, _ = ads._request_bid(self.PAYLOAD)
+        self.assertEqual(bid, {'from': 'fallback'})
+        self.assertEqual([key for key, _ in calls], ['fake-primary', 'fake-fallback'])
+
+    def test_fast_primary_is_not_hedged(self):
+        calls = self._fake_ssp({'fake-primary': (0, {'from': 'primary'}), 'fake-fallback': (0, {'from': 'fallback'})})
+        self.assertEqual(ads._request_bid(self.PAYLOAD)[0], {'from': 'primary'})
+        self.assertEqual([key for key, _ in calls], ['fake-primary'])
+
+    def test_each_call_gets_the_budget_left_when_it_starts(self):
+        calls = self._fake_ssp({'fake-primary': (0.3, None), 'fake-fallback': (0, None)})
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            ads._request_bid(self.PAYLOAD)
+        (_, primary), (_, fallback) = calls
+        self.assertAlmostEqual(primary, 1, delta=0.05)
+        # Hedged after 0.1 s
+        self.assertAlmostEqual(fallback, 0.9, delta=0.05)
+
+    def test_call_starting_after_the_deadline_is_skipped(self):
+        calls = self._fake_ssp({'fake-primary': (0, {'from': 'primary'})})
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            self.assertEqual(ads._attempt('fake-primary', self.PAYLOAD, time.monotonic() - 1), (None, None))
+        self.assertEqual(calls, [])
+
+    def test_open_breaker_skips_the_key(self):
+        calls = self._fake_ssp({'fake-primary': (0, {'from': 'primary'}), 'fake-fallback': (0, {'from': 'fallback'})})
+        primary = ads._breaker('fake-primary')
+        with self.assertLogs('chat.services.ads', 'WARNING'):
+            for _ in range(primary.min_calls):
+                primary.record(False)
+        with self.assertLogs('chat.services.ads', 'INFO'):
+            self.assertEqual(ads._request_bid(self.PAYLOAD)[0], {'from': 'fallback'})
+        self.assertEqual([key for key, _ in calls], ['fake-fallback'])
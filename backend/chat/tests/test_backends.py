@@ -0,0 +1,160 @@
+import asyncio
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from unittest import mock
+
+import httpx
+from asgiref.sync import async_to_sync
+from django.test import SimpleTestCase, override_settings
+
+from chat.services.backends import upstash
+from chat.services.backends.engine import Engine
+from chat.services.backends.sqlite import SqliteClient
+
+
+@override_settings(KV_TIMEOUT_SECONDS=2, KV_REST_API_URL='http://127.0.0.1:1', KV_REST_API_TOKEN='t')
+class UpstashClientTests(SimpleTestCase):
+    """The tuned httpx client swapped in for upstash_redis's default one."""
+
+    def test_sync_client_closes_the_default(self):
+        with mock.patch.object(httpx.Client, 'close', autospec=True) as close:
+            client = upstash.create_client()
+        self.addCleanup(client._http._client.close)
+        (default,), _ = close.call_args
+        self.assertIsNot(default, client._http._client)
+        self.assertEqual(client._http._client.timeout, httpx.Timeout(2))
+
+    def test_async_client_closes_the_default(self):
+        async def create():
+            client = upstash.create_async_client()
+            await asyncio.sleep(0)
+            return client
+
+        with mock.patch.object(httpx.AsyncClient, 'aclose', autospec=True) as aclose:
+            client = async_to_sync(create)()
+        (default,), _ = aclose.await_args
+        self.assertIsNot(default, client._http._client)
+        self.assertEqual(client._http._client.timeout, httpx.Timeout(2))
+        self.assertEqual(upstash._closing, set())
+
+
+@override_settings(KV_TIMEOUT_SECONDS=0.2)
+class SqliteTests(SimpleTestCase):
+    def setUp(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.path = str(Path(directory) / 'storage.sqlite3')
+        self.client = SqliteClient(self.path)
+        self.addCleanup(self.client.close)
+        self.client.set('greeting', 'hello')
+        self.client.hset('hash', values={'a': '1'})
+
+    def _hold_write_lock(self):
+        """Another process's writer, mid-transaction."""
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+        writer.execute("INSERT OR REPLACE INTO kv (key, kind, value) VALUES ('other', 'string', 'x')")
+        self.addCleanup(writer.execute, 'ROLLBACK')
+
+    def test_reads_do_not_wait_on_a_writer(self):
+        self._hold_write_lock()
+        start = time.monotonic()
+        pipe = self.client.pipeline()
+        pipe.get('greeting')
+        pipe.hgetall('hash')
+        pipe.exists('other')
+        self.assertEqual(pipe.exec(), ['hello', {'a': '1'}, 0])
+        self.assertLess(time.monotonic() - start, 0.1)
+
+    def test_writes_wait_on_a_writer(self):
+        self._hold_write_lock()
+        with self.assertRaisesMessage(sqlite3.OperationalError, 'locked'):
+            self.client.set('greeting', 'bye')
+
+    def test_expired_key_reads_as_missing(self):
+        self.client.set('short', 'lived', ex=60)
+        self.client.expire('short', 0)
+        self.assertIsNone(self.client.get('short'))
+        self.assertEqual(self.client.exists('short'), 0)
+        # Removed by the next write's purge
+        self.client._purged_at = 0.0
+        self.client.set('greeting', 'bye')
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        self.assertIsNone(conn.execute("SELECT 1 FROM kv WHERE key = 'short'").fetchone())
+
+    def _statements(self) -> list:
+        """SQL the client runs from here on."""
+        statements = []
+        self.client._connection().set_trace_callback(statements.append)
+        return statements
+
+    def _changes(self, fn) -> int:
+        """Rows `fn` inserts, updates or deletes."""
+        conn = self.client._connection()
+        before = conn.total_changes
+        fn()
+        return conn.total_changes - before
+
+    def _rows(self, table: str, key: str) -> list:
+        conn = sqlite3.connect(self.path)
+        self.addCleanup(conn.close)
+        return conn.execute(f'SELECT * FROM {table} WHERE key = ? ORDER BY 2', (key,)).fetchall()
+
+    def test_hset_writes_one_field_row(self):
+        self.client.hset('big', values={f'f{i}': str(i) for i in range(50)})
+        statements = self._statements()
+        self.assertEqual(self._changes(lambda: self.client.hset('big', 'f7', 'seven')), 1)
+        self.assertFalse([s for s in statements if 'SELECT field, value' in s])
+        self.assertIn(('big', 'f7', 'seven'), self._rows('kv_hash', 'big'))
+        self.assertEqual(self.client.hlen('big'), 50)
+
+    def test_rpush_adds_rows_without_reading_the_list(self):
+        self.client.rpush('list', *[f'v{i}' for i in range(50)])
+        statements = self._statements()
+        self.assertEqual(self._changes(lambda: self.client.rpush('list', 'a', 'b')), 2)
+        self.assertFalse([s for s in statements if 'SELECT position, value' in s])
+        self.assertEqual(self.client.lrange('list', -3, -1), ['v49', 'a', 'b'])
+
+    def test_lpush_and_lpop_touch_the_front_only(self):
+        self.client.rpush('list', 'a', 'b', 'c')
+        self.assertEqual(self._changes(lambda: self.client.lpush('list', 'z')), 1)
+        self.assertEqual(self._changes(lambda: self.client.lpop('list')), 1)
+        self.assertEqual([value for _, _, value in self._rows('kv_list', 'list')], ['a', 'b', 'c'])
+
+    def test_commands_match_the_memory_engine(self):
+        memory = Engine()
+        commands = [
+            ['RPUSH', 'l', 'a', 'b', 'c'], ['LPUSH', 'l', 'x', 'y'], ['LREM', 'l', '0', 'b'],
+            ['LTRIM', 'l', '0', '2'], ['RPUSH', 'l', 'd'], ['LPOP', 'l'], ['LRANGE', 'l', '0', '-1'],
+            ['HSET', 'h', 'a', '1', 'b', '2'], ['HINCRBY', 'h', 'a', '5'], ['HDEL', 'h', 'b', 'missing'],
+            ['HSETNX', 'h', 'c', '3'], ['HGETALL', 'h'], ['HLEN', 'h'],
+            ['DEL', 'h'], ['HSET', 'h', 'z', '26'], ['HGETALL', 'h'],
+            ['LTRIM', 'l', '5', '9'], ['EXISTS', 'l'],
+        ]
+        for command in commands:
+            with self.subTest(command=command):
+                self.assertEqual(self.client._run([command], False), [memory.execute(command)])
+        self.assertEqual(self._rows('kv_list', 'l'), [])
+        self.assertEqual(self._rows('kv_hash', 'h'), [('h', 'z', '26')])
+
+    def test_changing_type_drops_the_old_rows(self):
+        self.client.delete('hash')
+        self.client.rpush('hash', 'a')
+        self.assertEqual(self._rows('kv_hash', 'hash'), [])
+        self.client.set('hash', 'now a string')
+        self.assertEqual(self._rows('kv_list', 'hash'), [])
+        self.assertEqual(self.client.get('hash'), 'now a string')
+
+    def test_hashes_and_lists_stored_whole_are_split(self):
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(conn.close)
+        conn.execute("""INSERT INTO kv (key, kind, value) VALUES ('old_hash', 'hash', '{"a": "1"}')""")
+        conn.execute("""INSERT INTO kv (key, kind, value) VALUES ('old_list', 'list', '["x", "y"]')""")
+        client = SqliteClient(self.path)
+        self.addCleanup(client.close)
+        self.assertEqual(client.hgetall('old_hash'), {'a': '1'})
+        self.assertEqual(client.lrange('old_list', 0, -1), ['x', 'y'])
+        self.assertEqual(conn.execute("SELECT value FROM kv WHERE key = 'old_hash'").fetchone(), ('',))
@@ -0,0 +1,102 @@
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from chat.services.cache import SingleFlight, TTLCache
+
+
+class TTLCacheTests(SimpleTestCase):
+    def _clock(self, start: float = 1000.0) -> list:
+        """A fake monotonic clock; set now[0] to move it."""
+        now = [start]
+        self.enterContext(mock.patch('chat.services.cache.time.monotonic', lambda: now[0]))
+        return now
+
+    def test_entries_expire_after_their_ttl(self):
+        now = self._clock()
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=5)
+        now[0] += 5
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('b', 'gone'), 'gone')
+        now[0] += 55
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_falsy_values_are_cached(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set('empty', {})
+        self.assertEqual(cache.get('empty'), {})
+
+    def test_delete_and_clear(self):
+        cache = TTLCache(maxsize=10, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def _run_together(self, flight: SingleFlight, fn, callers: int = 5) -> list:
+        """Call flight.do('key', fn) from `callers` threads at once; (result or exception) of each."""
+        outcomes = [None] * callers
+
+        def call(i):
+            try:
+                outcomes[i] = flight.do('key', fn)
+            except Exception as e:
+                outcomes[i] = e
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        return outcomes
+
+    def _slow(self, result):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.1)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return fn, calls
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        fn, calls = self._slow('bid')
+        self.assertEqual(self._run_together(flight, fn), ['bid'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_concurrent_callers_share_the_exception(self):
+        flight = SingleFlight()
+        error = ConnectionError('SSP down')
+        fn, calls = self._slow(error)
+        self.assertEqual(self._run_together(flight, fn), [error] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_later_calls_run_again(self):
+        flight = SingleFlight()
+        fn, calls = self._slow('bid')
+        flight.do('key', fn)
+        flight.do('key', fn)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(flight._calls, {})
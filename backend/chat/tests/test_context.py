@@ -0,0 +1,93 @@
+from django.test import SimpleTestCase, override_settings
+
+from chat.services import context
+
+
+def _chat(*turns: tuple, **fields) -> dict:
+    """A chat whose messages are (role, content) turns."""
+    messages = [
+        {'role': role, 'content': content, 'timestamp': f't{i}', 'tokens': context.estimate_tokens(content)}
+        for i, (role, content) in enumerate(turns)
+    ]
+    return {'id': 'c', 'messages': messages, **fields}
+
+
+def _tokens(window: list) -> int:
+    return sum(context.message_tokens(m) for m in window)
+
+
+# 100 tokens of content, 104 with the per-message overhead
+LONG = 'x' * 400
+
+
+@override_settings(CHAT_LLM_CONTEXT_TOKENS=250, CHAT_CONTEXT_SUMMARY=False)
+class LlmWindowTests(SimpleTestCase):
+    def test_everything_that_fits(self):
+        chat = _chat(('user', 'Hi'), ('assistant', 'Hello'), ('user', 'How are you?'))
+        self.assertEqual(context.llm_window(chat), [
+            {'role': 'user', 'content': 'Hi'},
+            {'role': 'assistant', 'content': 'Hello'},
+            {'role': 'user', 'content': 'How are you?'},
+        ])
+
+    def test_oldest_turns_drop_out_and_the_window_starts_on_a_user_turn(self):
+        chat = _chat(('user', LONG), ('assistant', LONG), ('user', 'Hi'), ('assistant', LONG), ('user', 'More?'))
+        # The assistant turn at index 1 would fit, but would open the window
+        self.assertEqual([m['content'] for m in context.llm_window(chat)], ['Hi', LONG, 'More?'])
+
+    def test_a_long_question_is_sent_whole(self):
+        chat = _chat(('user', 'Hi'), ('assistant', 'Hello'), ('user', LONG * 3))
+        self.assertEqual(context.llm_window(chat), [{'role': 'user', 'content': LONG * 3}])
+
+    @override_settings(CHAT_CONTEXT_SUMMARY=True)
+    def test_summary_replaces_the_summarized_turns(self):
+        chat = _chat(
+            ('user', 'Hi'), ('assistant', 'Hello'), ('user', 'Again'), ('assistant', 'Sure'), ('user', 'Last'),
+            summary='They said hello', summary_upto=2,
+        )
+        window = context.llm_window(chat)
+        self.assertEqual(window[0]['role'], 'system')
+        self.assertIn('They said hello', window[0]['content'])
+        self.assertEqual([m['content'] for m in window[1:]], ['Again', 'Sure', 'Last'])
+
+
+@override_settings(THRAD_AD_CONTEXT_TOKENS=150)
+class AdWindowTests(SimpleTestCase):
+    def test_recent_turns_with_timestamps(self):
+        chat = _chat(
+            ('user', LONG * 2), ('assistant', 'Hello'), ('user', 'Shoes?'), ('assistant', 'Try running shoes'),
+        )
+        # 'Hello' fits too, but would open the window
+        self.assertEqual(context.ad_window(chat), [
+            {'role': 'user', 'content': 'Shoes?', 'timestamp': 't2'},
+            {'role': 'assistant', 'content': 'Try running shoes', 'timestamp': 't3'},
+        ])
+
+    def test_long_reply_keeps_its_question(self):
+        chat = _chat(('user', 'Hi'), ('assistant', 'Hello'), ('user', 'Paste this'), ('assistant', LONG * 5))
+        window = context.ad_window(chat)
+        self.assertEqual([m['role'] for m in window], ['user', 'assistant'])
+        self.assertEqual(window[0]['content'], 'Paste this')
+        self.assertTrue((LONG * 5).startswith(window[1]['content']))
+        self.assertLessEqual(_tokens(window), 150)
+        self.assertGreater(_tokens(window), 140)
+
+    def test_long_question_and_reply_are_both_shortened(self):
+        chat = _chat(('user', 'Hi'), ('assistant', 'Hello'), ('user', LONG * 5), ('assistant', LONG * 2))
+        window = context.ad_window(chat)
+        self.assertEqual([m['role'] for m in window], ['user', 'assistant'])
+        self.assertEqual(len(window[0]['content']), len(window[1]['content']))
+        self.assertLessEqual(_tokens(window), 150)
+        self.assertEqual([m['timestamp'] for m in window], ['t2', 't3'])
+
+    def test_short_turn_is_kept_whole_next_to_a_long_one(self):
+        chat = _chat(('user', 'Hi ' * 30), ('assistant', LONG * 5))
+        window = context.ad_window(chat)
+        self.assertEqual(window[0]['content'], 'Hi ' * 30)
+        self.assertLessEqual(_tokens(window), 150)
+
+    def test_single_message(self):
+        chat = _chat(('user', LONG * 5))
+        window = context.ad_window(chat)
+        self.assertEqual(len(window), 1)
+        self.assertLessEqual(_tokens(window), 150)
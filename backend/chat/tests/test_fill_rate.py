@@ -0,0 +1,150 @@
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client, SimpleTestCase, override_settings
+
+from chat.services import fill_rate, storage
+from chat.services.fill_rate import FillRateEstimator
+from . import FakesTestCase
+
+EMAIL = 'user@example.com'
+CELLS = ('turn=1', 'category=travel', 'length=1')
+KEY = 'test_fill_stats'
+
+
+class FeaturesTests(SimpleTestCase):
+    def test_cells(self):
+        messages = [
+            {'role': 'user', 'content': 'Budget tips?'},
+            {'role': 'assistant', 'content': 'x' * 400},
+            {'role': 'user', 'content': 'And a trip to Japan, on a budget'},
+        ]
+        # ~115 tokens: 64 <= tokens < 128
+        self.assertEqual(fill_rate.features(messages, 3), ('turn=3', 'category=travel', 'length=1'))
+
+    def test_turn_is_capped(self):
+        self.assertEqual(fill_rate.features([], 50)[0], f'turn={fill_rate.MAX_TURN}')
+
+    def test_turn_that_is_not_an_integer(self):
+        self.assertEqual(fill_rate.features([], '3')[0], 'turn=3')
+        self.assertEqual(fill_rate.features([], None)[0], 'turn=0')
+        self.assertEqual(fill_rate.features([], 'third')[0], 'turn=0')
+
+
+class EstimatorTests(FakesTestCase):
+    def _estimator(self, sync_seconds: float = 0) -> FillRateEstimator:
+        return FillRateEstimator(KEY, sync_seconds)
+
+    def test_unseen_cells_start_even(self):
+        self.assertEqual(self._estimator().predict(CELLS), 0.5)
+
+    def test_misses_lower_the_estimate(self):
+        estimator = self._estimator()
+        for _ in range(10):
+            estimator.record(CELLS, False, 100)
+        # Marginals at 1/12; the joint cell's own 0/10 shrunk towards them
+        self.assertAlmostEqual(estimator.predict(CELLS), (0 + 20 / 12) / 30)
+        # Another joint cell sharing two of the marginals
+        self.assertAlmostEqual(estimator.predict(('turn=1', 'category=food', 'length=1')), (1 / 12 * 2 + 0.5) / 3)
+
+    def test_counts_are_shared_through_redis(self):
+        writer, reader = self._estimator(), self._estimator()
+        writer.record(CELLS, True, 120)
+        writer.record(CELLS, False, 80)
+        stored = storage.get_redis().hgetall(KEY)
+        self.assertEqual(stored['turn=1:calls'], '2')
+        self.assertEqual(stored['turn=1:fills'], '1')
+        self.assertEqual(stored['turn=1,category=travel,length=1:ms'], '200')
+        self.assertEqual(reader.stats(), {})
+        reader.predict(CELLS)
+        self.assertEqual(reader.stats()['turn=1'], {'calls': 2, 'fill_rate': 0.5, 'mean_ms': 100.0})
+
+    def test_sync_waits_for_its_interval(self):
+        writer, reader = self._estimator(), self._estimator(sync_seconds=3600)
+        reader.predict(CELLS)
+        writer.record(CELLS, False, 100)
+        reader.predict(CELLS)
+        self.assertEqual(reader.stats(), {})
+        reader.clear()
+        reader.predict(CELLS)
+        self.assertEqual(reader.stats()['turn=1']['calls'], 1)
+
+    def test_failed_sync_keeps_the_increments(self):
+        estimator = self._estimator()
+        with mock.patch.object(fill_rate, 'pipeline', side_effect=ConnectionError('Redis is down')), \
+                self.assertLogs('chat.services.fill_rate', 'WARNING'):
+            estimator.record(CELLS, True, 50)
+        self.assertEqual(storage.get_redis().hgetall(KEY), {})
+        self.assertEqual(estimator.stats()['turn=1']['calls'], 1)
+        estimator.predict(CELLS)
+        self.assertEqual(storage.get_redis().hget(KEY, 'turn=1:fills'), '1')
+        self.assertEqual(estimator.stats()['turn=1']['calls'], 1)
+
+
+@override_settings(THRAD_FILL_THRESHOLD=0.2)
+class ShouldRequestTests(FakesTestCase):
+    def setUp(self):
+        super().setUp()
+        for _ in range(30):
+            fill_rate.record(CELLS, False, 100)
+
+    @override_settings(THRAD_FILL_EXPLORE_RATE=0)
+    def test_unlikely_fill_is_skipped(self):
+        with self.assertLogs('chat.services.fill_rate', 'INFO'):
+            self.assertFalse(fill_rate.should_request(CELLS))
+        self.assertTrue(fill_rate.should_request(('turn=2', 'category=food', 'length=3')))
+
+    @override_settings(THRAD_FILL_EXPLORE_RATE=1)
+    def test_exploring(self):
+        with self.assertLogs('chat.services.fill_rate', 'INFO'):
+            self.assertTrue(fill_rate.should_request(CELLS))
+
+    @override_settings(THRAD_FILL_THRESHOLD=0, THRAD_FILL_EXPLORE_RATE=0)
+    def test_threshold_zero_never_skips(self):
+        self.assertTrue(fill_rate.should_request(CELLS))
+
+
+class TurnNumberTests(FakesTestCase):
+    """turn_number from the request body, through the ads and send views."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = storage.create_user(EMAIL)
+        self.chat = storage.create_chat(EMAIL, 'Hello')
+        storage.add_message(self.chat['id'], 'user', 'Hello')
+        storage.add_message(self.chat['id'], 'assistant', 'Hi there')
+
+    def _post(self, path: str, data: dict):
+        return Client().post(
+            f'/api/chats/{self.chat["id"]}/{path}/', data, content_type='application/json',
+            headers={'X-Auth-Token': self.user['token']},
+        )
+
+    def test_ads(self):
+        for turn_number, sent in [(3, 3), ('4', 4), (None, 0)]:
+            with self.subTest(turn_number=turn_number):
+                response = self._post('ads', {'turn_number': turn_number})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.fakes.thrad.payloads[-1]['turn_number'], sent)
+        for turn_number in ['third', [3], {'n': 3}]:
+            with self.subTest(turn_number=turn_number):
+                self.assertEqual(self._post('ads', {'turn_number': turn_number}).status_code, 400)
+
+    def test_send_rejects_an_invalid_turn_number_before_saving(self):
+        response = self._post('send', {'message': 'Again', 'turn_number': 'third'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(storage.get_chat(self.chat['id'])['messages']), 2)
+
+
+@override_settings(ROOT_URLCONF='chat.tests.async_urls')
+class AsyncTurnNumberTests(TurnNumberTests):
+    """The same, through chat/async_views.py."""
+
+    def _post(self, path: str, data: dict):
+        return async_to_sync(self._apost)(path, data)
+
+    async def _apost(self, path: str, data: dict):
+        return await AsyncClient().post(
+            f'/api/chats/{self.chat["id"]}/{path}/', data, content_type='application/json',
+            headers={'X-Auth-Token': self.user['token']},
+        )
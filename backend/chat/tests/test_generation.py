@@ -0,0 +1,121 @@
+import asyncio
+import json
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, Client, SimpleTestCase, override_settings
+
+from chat import generation
+from chat.services import storage
+from . import FakesTestCase
+
+EMAIL = 'user@example.com'
+
+
+def _events(body: bytes) -> list:
+    frames = body.decode().split('\n\n')
+    events = [json.loads(frame[len('data: '):]) for frame in frames if frame.startswith('data: ')]
+    return [event for event in events if 'timing' not in event]
+
+
+class TailTests(SimpleTestCase):
+    async def test_cancelled_async_tail_unwinds(self):
+        gen = generation.Generation('c')
+        frames = generation.atail(gen.key, gen=gen)
+        self.assertEqual(_events((await anext(frames)).encode()), [{'generation': gen.id}])
+        # A disconnected client: the server cancels the tail while it waits
+        task = asyncio.ensure_future(anext(frames))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.wait({task}, timeout=1)
+        gen.finish()  # ends a tail that ignored the cancel
+        await asyncio.wait({task}, timeout=1)
+        self.assertTrue(task.cancelled())
+        self.assertEqual(gen._waiters, set())
+
+
+class ChatSendTests(FakesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = storage.create_user(EMAIL)
+        self.chat = storage.create_chat(EMAIL, 'Hello')
+
+    def _post_kwargs(self, **data) -> dict:
+        return {
+            'path': f'/api/chats/{self.chat["id"]}/send/',
+            'data': {'message': 'Hello', **data},
+            'content_type': 'application/json',
+            'headers': {'X-Auth-Token': self.user['token']},
+        }
+
+    def _send(self, **data) -> list:
+        response = Client().post(**self._post_kwargs(**data))
+        self.assertEqual(response.status_code, 200)
+        return _events(b''.join(response.streaming_content))
+
+    def _buffered(self, events: list) -> list:
+        key = storage.generation_key(self.chat['id'], events[0]['generation'])
+        return storage.read_generation_events(key)
+
+    def test_done_points_to_the_stored_reply(self):
+        events = self._send()
+        self.assertEqual(''.join(event.get('chunk', '') for event in events), 'Hello there!')
+        done = events[-1]
+        self.assertTrue(done['done'])
+        messages = storage.get_chat(self.chat['id'])['messages']
+        self.assertEqual([m['role'] for m in messages], ['user', 'assistant'])
+        self.assertEqual(messages[-1]['id'], done['message_id'])
+        # A resume replays the same events, then the end of the buffer
+        self.assertEqual(self._buffered(events), events + [{'end': True}])
+
+    def test_failed_save_ends_with_an_error_and_no_done(self):
+        queue_messages = storage._queue_messages
+
+        def failing(pipe, chat_id, messages):
+            if any(m['role'] == 'assistant' for m in messages):
+                raise ConnectionError('Redis is down')
+            queue_messages(pipe, chat_id, messages)
+
+        with mock.patch.object(storage, '_queue_messages', failing):
+            events = self._send()
+        self.assertFalse(any('done' in event for event in events))
+        self.assertEqual(events[-1], {'error': 'Redis is down'})
+        messages = storage.get_chat(self.chat['id'])['messages']
+        self.assertEqual([m['role'] for m in messages], ['user'])
+        buffered = self._buffered(events)
+        self.assertEqual(buffered[-2:], [{'error': 'Redis is down'}, {'end': True}])
+        self.assertFalse(any('done' in event for event in buffered))
+
+    def test_first_turn_inline_ad_is_left_to_the_client(self):
+        events = self._send(inline_ad=True)
+        # Null after done, so the client asks /ads/ once the reply exists
+        self.assertTrue(events[-2]['done'])
+        self.assertEqual(events[-1], {'ad': None})
+        self.assertEqual(self.fakes.thrad.requests, 0)
+
+    def test_inline_ad_is_bid_with_the_stored_reply(self):
+        self._send()
+        events = self._send(inline_ad=True)
+        self.assertTrue(events[-2]['done'])
+        self.assertEqual(events[-1], {'ad': self.fakes.thrad.BID})
+        self.assertEqual(self.fakes.thrad.requests, 1)
+        sent = self.fakes.thrad.payloads[0]['messages']
+        self.assertEqual([m['role'] for m in sent], ['user', 'assistant', 'user', 'assistant'])
+        self.assertEqual(sent[-1]['content'], 'Hello there!')
+        self.assertEqual(self.fakes.thrad.payloads[0]['turn_number'], 2)
+
+
+@override_settings(ROOT_URLCONF='chat.tests.async_urls')
+class AsyncChatSendTests(ChatSendTests):
+    """The same, through chat/async_views.py."""
+
+    def _send(self, **data) -> list:
+        return async_to_sync(self._asend)(**data)
+
+    async def _asend(self, **data) -> list:
+        response = await AsyncClient().post(**self._post_kwargs(**data))
+        self.assertEqual(response.status_code, 200)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        # The worker's last flush runs after the tail has ended
+        await asyncio.gather(*generation._tasks)
+        return _events(body)
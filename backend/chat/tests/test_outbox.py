@@ -0,0 +1,156 @@
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.core.management import call_command
+from django.test import Client, override_settings
+
+from chat.services import codec, outbox, storage
+from . import FakesTestCase
+
+EMAIL = 'user@example.com'
+
+
+@override_settings(EMAIL_OUTBOX=True, EMAIL_RETRY_BASE_SECONDS=2, EMAIL_MAX_ATTEMPTS=3)
+class OutboxTests(FakesTestCase):
+    """The worker against the fake Brevo, with injected failures."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.brevo = self.fakes.brevo
+
+    def _send_code(self, email: str = EMAIL) -> str:
+        response = self.client.post('/api/auth/send-code/', {'email': email}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'queued')
+        return response.json()['job_id']
+
+    def _status(self, job_id: str) -> dict:
+        response = self.client.get(f'/api/auth/send-code/{job_id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def _job(self, job_id: str) -> dict:
+        return codec.decode(storage.get_redis().get(outbox.job_key(job_id)))
+
+    def _make_due(self, job_id: str):
+        storage.get_redis().zadd(outbox.OUTBOX_KEY, {job_id: 0})
+
+    def _code_exists(self, email: str = EMAIL) -> bool:
+        return storage.get_redis().exists(f'verify:{storage.email_hash(email)}') == 1
+
+    def test_queued_email_is_sent(self):
+        job_id = self._send_code()
+        self.assertEqual(self._status(job_id)['status'], 'queued')
+        self.assertEqual(outbox.process_batch(), {'sent': 1, 'retrying': 0, 'failed': 0})
+        self.assertEqual(self._status(job_id), {'id': job_id, 'status': 'sent', 'attempts': 1, 'error': None})
+        self.assertEqual(self.brevo.delivered, [EMAIL])
+        self.assertEqual(storage.get_redis().zcard(outbox.OUTBOX_KEY), 0)
+        self.assertTrue(storage.verify_code(EMAIL, self._job(job_id)['code']))
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/api/auth/send-code/missing/').status_code, 404)
+
+    def test_server_error_is_retried_with_backoff(self):
+        job_id = self._send_code()
+        self.brevo.fail_first, self.brevo.fail_status = 1, 503
+        before = time.time()
+        self.assertEqual(outbox.process_batch(), {'sent': 0, 'retrying': 1, 'failed': 0})
+        status = self._status(job_id)
+        self.assertEqual((status['status'], status['attempts']), ('retrying', 1))
+        self.assertIn('503', status['error'])
+        # Due again within [base / 2, base] seconds
+        due = storage.get_redis().zscore(outbox.OUTBOX_KEY, job_id)
+        self.assertGreaterEqual(due, before + 1)
+        self.assertLessEqual(due, time.time() + 2)
+        self.assertEqual(outbox.process_batch(), {'sent': 0, 'retrying': 0, 'failed': 0})
+
+        self._make_due(job_id)
+        self.assertEqual(outbox.process_batch()['sent'], 1)
+        self.assertEqual(self._status(job_id), {'id': job_id, 'status': 'sent', 'attempts': 2, 'error': None})
+        self.assertTrue(self._code_exists())
+
+    def test_rate_limit_is_retried(self):
+        job_id = self._send_code()
+        self.brevo.fail_first, self.brevo.fail_status = 1, 429
+        self.assertEqual(outbox.process_batch()['retrying'], 1)
+        self.assertEqual(self._status(job_id)['status'], 'retrying')
+
+    def test_client_error_fails_and_revokes_the_code(self):
+        job_id = self._send_code()
+        self.brevo.fail_first, self.brevo.fail_status = 1, 401
+        with self.assertLogs('chat.services.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch(), {'sent': 0, 'retrying': 0, 'failed': 1})
+        status = self._status(job_id)
+        self.assertEqual((status['status'], status['attempts']), ('failed', 1))
+        self.assertIn('401', status['error'])
+        self.assertFalse(self._code_exists())
+        self.assertEqual(storage.get_redis().zcard(outbox.OUTBOX_KEY), 0)
+
+    def test_gives_up_after_max_attempts(self):
+        job_id = self._send_code()
+        self.brevo.fail_first = 10
+        for attempt in range(1, 3):
+            self.assertEqual(outbox.process_batch()['retrying'], 1)
+            self.assertEqual(self._status(job_id)['attempts'], attempt)
+            self._make_due(job_id)
+        with self.assertLogs('chat.services.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch()['failed'], 1)
+        self.assertEqual(self._status(job_id)['status'], 'failed')
+        self.assertEqual(self._status(job_id)['attempts'], 3)
+        self.assertFalse(self._code_exists())
+
+    def test_revoking_keeps_a_newer_code(self):
+        job_id = self._send_code()
+        self.brevo.reject = {EMAIL}
+        code = self._job(job_id)['code']
+        newer = code
+        while newer == code:
+            newer = storage.create_verification_code(EMAIL)
+        with self.assertLogs('chat.services.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch()['failed'], 1)
+        self.assertTrue(storage.verify_code(EMAIL, newer))
+
+    def test_one_rejected_recipient_fails_alone(self):
+        emails = ['a@example.com', 'bad@example.com', 'c@example.com']
+        job_ids = [self._send_code(email) for email in emails]
+        self.brevo.reject = {'bad@example.com'}
+        with self.assertLogs('chat.services.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch(), {'sent': 2, 'retrying': 0, 'failed': 1})
+        # The batch, then each job alone
+        self.assertEqual(self.brevo.requests, 4)
+        self.assertEqual(
+            [self._status(job_id)['status'] for job_id in job_ids], ['sent', 'failed', 'sent'],
+        )
+        self.assertEqual(sorted(self.brevo.delivered), ['a@example.com', 'c@example.com'])
+        self.assertFalse(self._code_exists('bad@example.com'))
+        self.assertTrue(self._code_exists('a@example.com'))
+
+    def test_claimed_jobs_are_leased(self):
+        job_id = self._send_code()
+        now = time.time()
+        self.assertEqual([job['id'] for job in outbox._claim(10, now)], [job_id])
+        # A second worker polling meanwhile gets nothing
+        self.assertEqual(outbox._claim(10, now), [])
+        # Until the lease runs out (the first worker died)
+        later = now + settings.EMAIL_SEND_LEASE_SECONDS + 1
+        self.assertEqual([job['id'] for job in outbox._claim(10, later)], [job_id])
+
+    def test_code_expired_before_sending(self):
+        job_id = self._send_code()
+        job = self._job(job_id)
+        job['queued_at'] -= storage.VERIFY_TTL
+        storage.get_redis().set(outbox.job_key(job_id), codec.encode(job), keepttl=True)
+        with self.assertLogs('chat.services.outbox', 'WARNING'):
+            self.assertEqual(outbox.process_batch()['failed'], 1)
+        self.assertEqual(self.brevo.requests, 0)
+        self.assertEqual(self._status(job_id)['status'], 'failed')
+
+    def test_worker_command_drains_the_queue(self):
+        job_ids = [self._send_code(f'user{i}@example.com') for i in range(3)]
+        # Keep the test runner's own SIGINT handler
+        with mock.patch('signal.signal'):
+            call_command('email_worker', once=True)
+        self.assertEqual([self._status(job_id)['status'] for job_id in job_ids], ['sent'] * 3)
+        self.assertEqual(self.brevo.requests, 1)
@@ -0,0 +1,245 @@
+import json
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from django.test import Client, SimpleTestCase
+
+from chat.services import codec, outbox, storage, user_profile
+from chat.services.backends.engine import Engine
+from chat.services.backends.script import Script
+from . import FakesTestCase
+from .lua import LuaEngine, lua_available
+
+EMAIL = 'user@example.com'
+
+
+def _verify_entry(code: str, attempts: int) -> str:
+    return json.dumps({'code': code, 'attempts': attempts})
+
+
+# script → [(commands run first, keys, args)]; each case runs through the
+# Lua source and through the Python version, which must reply and leave the
+# data the same
+SCENARIOS = {
+    storage._verify_code: [
+        ([], ['verify:x'], ['123456', '5']),
+        ([['SET', 'verify:x', _verify_entry('123456', 0), 'EX', '600']], ['verify:x'], ['123456', '5']),
+        ([['SET', 'verify:x', _verify_entry('123456', 2), 'EX', '600']], ['verify:x'], ['000000', '5']),
+        ([['SET', 'verify:x', _verify_entry('123456', 5), 'EX', '600']], ['verify:x'], ['123456', '5']),
+    ],
+    storage._delete_code: [
+        ([], ['verify:x'], ['123456']),
+        ([['SET', 'verify:x', _verify_entry('123456', 1)]], ['verify:x'], ['123456']),
+        ([['SET', 'verify:x', _verify_entry('123456', 1)]], ['verify:x'], ['654321']),
+    ],
+    storage._migrate_chat: [
+        ([], ['chats:c', 'chat_meta:c', 'chat_messages:c', 'chat_message_ids:c'], ['2', 'id', 'c']),
+        (
+            [['SET', 'chats:c', '{}'], ['HSET', 'chat_meta:c', 'id', 'c']],
+            ['chats:c', 'chat_meta:c', 'chat_messages:c', 'chat_message_ids:c'],
+            ['2', 'id', 'c'],
+        ),
+        (
+            [['SET', 'chats:c', '{}'], ['RPUSH', 'chat_message_ids:c', 'stale']],
+            ['chats:c', 'chat_meta:c', 'chat_messages:c', 'chat_message_ids:c'],
+            ['4', 'id', 'c', 'message_count', '2', 'm1', '{"a":1}', 'm2', '{"b":2}'],
+        ),
+        (
+            [['SET', 'chats:c', '{}']],
+            ['chats:c', 'chat_meta:c', 'chat_messages:c', 'chat_message_ids:c'],
+            ['2', 'id', 'c'],
+        ),
+    ],
+    storage._message_feedback: [
+        ([], ['chat_meta:c', 'chat_messages:c'], ['m1', 'like', EMAIL]),
+        ([['HSET', 'chat_meta:c', 'user_email', 'other@example.com']], ['chat_meta:c', 'chat_messages:c'], ['m1', 'like', EMAIL]),
+        ([['HSET', 'chat_meta:c', 'user_email', EMAIL]], ['chat_meta:c', 'chat_messages:c'], ['m1', 'like', EMAIL]),
+        (
+            [['HSET', 'chat_meta:c', 'user_email', EMAIL], ['HSET', 'chat_messages:c', 'm1', '{}']],
+            ['chat_meta:c', 'chat_messages:c'],
+            ['m1', 'dislike', EMAIL],
+        ),
+    ],
+    user_profile._fold_profile: [
+        ([], ['profiles:p', 'profile:p', 'profile_topics:p'], ['e', 't', '3', '2', '0']),
+        (
+            [['SET', 'profiles:p', '{}'], ['HSET', 'profile:p', 'email', 'kept', 'interest:tech', '1']],
+            ['profiles:p', 'profile:p', 'profile_topics:p'],
+            ['e', 't', '3', '2', '2', 'interest:tech', '4', 'interest:food', '1', 'a', 'b', 'c'],
+        ),
+        (
+            [['SET', 'profiles:p', '{}']],
+            ['profiles:p', 'profile:p', 'profile_topics:p'],
+            ['e', 't', '0', '5', '0'],
+        ),
+    ],
+    outbox._claim_due: [
+        ([], ['email_outbox'], ['100', '10', '160']),
+        (
+            [['ZADD', 'email_outbox', '10', 'a', '20', 'b', '30', 'c', '500', 'd']],
+            ['email_outbox'],
+            ['100', '2', '160'],
+        ),
+    ],
+}
+
+
+def _snapshot(engine: Engine) -> dict:
+    """Live keys and which of them expire; JSON strings compared decoded (cjson spaces them differently)."""
+    data = {}
+    for key in sorted(engine.data):
+        if not engine._alive(key):
+            continue
+        kind, value = engine.data[key]
+        if kind == 'string' and value.startswith('{'):
+            value = json.loads(value)
+        data[key] = (kind, value)
+    return {'data': data, 'expiring': sorted(engine.expires)}
+
+
+@unittest.skipUnless(lua_available, 'needs lupa to run Lua')
+class ScriptEquivalenceTests(SimpleTestCase):
+    def test_every_script_has_scenarios(self):
+        modules = (storage, user_profile, outbox)
+        scripts = {value for module in modules for value in vars(module).values() if isinstance(value, Script)}
+        self.assertEqual(scripts, set(SCENARIOS))
+
+    def test_lua_and_python_agree(self):
+        for script, cases in SCENARIOS.items():
+            for setup, keys, args in cases:
+                with self.subTest(script=script.lua.strip().splitlines()[0], keys=keys, args=args):
+                    results = []
+                    for engine in (Engine(), LuaEngine()):
+                        for command in setup:
+                            engine.execute(command)
+                        reply = engine.execute(['EVAL', script.lua, str(len(keys)), *keys, *args])
+                        results.append((reply, _snapshot(engine)))
+                    self.assertEqual(results[0], results[1])
+
+
+class VerifyCodeTests(FakesTestCase):
+    """Through the Script objects on the memory backend (the Python versions)."""
+
+    key = f'verify:{storage.email_hash(EMAIL)}'
+
+    def setUp(self):
+        super().setUp()
+        self.code = storage.create_verification_code(EMAIL)
+        self.wrong = f'{(int(self.code) + 1) % 1000000:06d}'
+
+    def _attempts(self) -> int:
+        return json.loads(storage.get_redis().get(self.key))['attempts']
+
+    def test_right_code_verifies_once(self):
+        self.assertTrue(storage.verify_code(EMAIL, f' {self.code} '))
+        self.assertFalse(storage.verify_code(EMAIL, self.code))
+
+    def test_wrong_code_counts_an_attempt_and_keeps_the_ttl(self):
+        self.assertFalse(storage.verify_code(EMAIL, self.wrong))
+        self.assertEqual(self._attempts(), 1)
+        self.assertGreater(storage.get_redis().ttl(self.key), 0)
+        self.assertTrue(storage.verify_code(EMAIL, self.code))
+
+    def test_attempt_limit_revokes_the_code(self):
+        for _ in range(storage.MAX_ATTEMPTS):
+            self.assertFalse(storage.verify_code(EMAIL, self.wrong))
+        self.assertFalse(storage.verify_code(EMAIL, self.code))
+        self.assertIsNone(storage.get_redis().get(self.key))
+
+    def test_expired_code_does_not_verify(self):
+        storage.get_redis().expire(self.key, 0)
+        self.assertFalse(storage.verify_code(EMAIL, self.code))
+
+    def test_concurrent_wrong_guesses_each_count(self):
+        guesses = storage.MAX_ATTEMPTS - 1
+        with ThreadPoolExecutor(guesses) as pool:
+            results = list(pool.map(lambda _: storage.verify_code(EMAIL, self.wrong), range(guesses)))
+        self.assertEqual(results, [False] * guesses)
+        self.assertEqual(self._attempts(), guesses)
+        self.assertTrue(storage.verify_code(EMAIL, self.code))
+
+    def test_concurrent_right_guesses_verify_once(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: storage.verify_code(EMAIL, self.code), range(8)))
+        self.assertEqual(results.count(True), 1)
+
+    def test_delete_keeps_a_newer_code(self):
+        storage.delete_verification_code(EMAIL, self.wrong)
+        self.assertTrue(storage.verify_code(EMAIL, self.code))
+
+
+class MessageFeedbackTests(FakesTestCase):
+    """Through the Script objects on the memory backend (the Python versions)."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = storage.create_user(EMAIL)
+        self.chat = storage.create_chat(EMAIL, 'Hello')
+        self.message = storage.add_message(self.chat['id'], 'assistant', 'Hi there')
+
+    def _post(self, message_id: str):
+        return Client().post(
+            f'/api/chats/{self.chat["id"]}/feedback/',
+            {'message_id': message_id, 'feedback': 'like'},
+            content_type='application/json',
+            headers={'X-Auth-Token': self.user['token']},
+        )
+
+    def test_feedback_is_stored_on_the_message(self):
+        self.assertEqual(storage.set_message_feedback(self.chat['id'], self.message['id'], 'like', EMAIL), 'ok')
+        chat = storage.get_chat(self.chat['id'])
+        self.assertEqual(chat['messages'][0]['feedback'], 'like')
+
+    def test_unknown_message(self):
+        self.assertEqual(
+            storage.set_message_feedback(self.chat['id'], 'missing', 'like', EMAIL), 'message_not_found',
+        )
+        self.assertIsNone(storage.get_chat(self.chat['id'])['messages'][0]['feedback'])
+
+    def test_unknown_chat_and_other_owner(self):
+        self.assertEqual(storage.set_message_feedback('missing', self.message['id'], 'like', EMAIL), 'chat_not_found')
+        self.assertEqual(
+            storage.set_message_feedback(self.chat['id'], self.message['id'], 'like', 'other@example.com'),
+            'forbidden',
+        )
+
+    def test_view(self):
+        self.assertEqual(self._post(self.message['id']).status_code, 200)
+        self.assertEqual(self._post('missing').status_code, 404)
+
+    def test_legacy_chat_is_migrated_first(self):
+        legacy = {
+            'id': 'legacy', 'user_email': EMAIL, 'title': 'Old', 'created_at': self.chat['created_at'],
+            'messages': [{'id': 'm1', 'role': 'user', 'content': 'Hi', 'feedback': None}],
+        }
+        storage.get_redis().set('chats:legacy', codec.encode(legacy))
+        self.assertEqual(storage.set_message_feedback('legacy', 'm1', 'dislike', EMAIL), 'ok')
+        self.assertEqual(storage.get_chat('legacy')['messages'][0]['feedback'], 'dislike')
+
+
+class UpstashVerifyCodeTests(VerifyCodeTests):
+    """Through upstash_redis over REST: EVALSHA, then EVAL on NOSCRIPT."""
+
+    backend = 'upstash'
+
+
+class UpstashMessageFeedbackTests(MessageFeedbackTests):
+    """Through upstash_redis over REST: EVALSHA, then EVAL on NOSCRIPT."""
+
+    backend = 'upstash'
+
+
+@unittest.skipUnless(lua_available, 'needs lupa to run Lua')
+class LuaVerifyCodeTests(VerifyCodeTests):
+    """Through upstash_redis over REST, running the Lua that Upstash would."""
+
+    backend = 'upstash'
+    lua = True
+
+
+@unittest.skipUnless(lua_available, 'needs lupa to run Lua')
+class LuaMessageFeedbackTests(MessageFeedbackTests):
+    """Through upstash_redis over REST, running the Lua that Upstash would."""
+
+    backend = 'upstash'
+    lua = True
@@ -0,0 +1,45 @@
+from django.test import SimpleTestCase
+
+from chat.services import storage
+from chat.services.backends.engine import CommandError, Engine
+from . import FakesTestCase
+
+
+class UpdateChatTests(FakesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.chat = storage.create_chat('user@example.com', 'Hello')
+        for i in range(3):
+            storage.add_message(self.chat['id'], 'user', f'message {i}')
+
+    def test_replaces_messages_and_resets_count(self):
+        messages = [storage._new_message('user', 'only one')]
+        storage.update_chat(self.chat['id'], messages)
+        chat = storage.get_chat(self.chat['id'])
+        self.assertEqual([m['content'] for m in chat['messages']], ['only one'])
+        chats, _ = storage.list_user_chats('user@example.com')
+        self.assertEqual(chats[0]['message_count'], 1)
+
+    def test_empty_update_clears_the_chat(self):
+        storage.update_chat(self.chat['id'], [])
+        self.assertEqual(storage.get_chat(self.chat['id'])['messages'], [])
+        chats, _ = storage.list_user_chats('user@example.com')
+        self.assertEqual(chats[0]['message_count'], 0)
+
+
+class UpstashUpdateChatTests(UpdateChatTests):
+    # The real upstash_redis client, over REST
+    backend = 'upstash'
+
+
+class SqliteUpdateChatTests(UpdateChatTests):
+    backend = 'sqlite'
+
+
+class EngineTests(SimpleTestCase):
+    def test_hset_without_pairs_is_an_error(self):
+        engine = Engine()
+        with self.assertRaisesMessage(CommandError, 'wrong number of arguments'):
+            engine.execute(['HSET', 'key'])
+        with self.assertRaisesMessage(CommandError, 'wrong number of arguments'):
+            engine.execute(['HSET', 'key', 'field'])
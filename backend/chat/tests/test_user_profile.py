@@ -0,0 +1,30 @@
+from django.test import SimpleTestCase
+
+from chat.services.user_profile import match_interests
+
+
+class MatchInterestsTests(SimpleTestCase):
+    def test_whole_words_only(self):
+        self.assertEqual(match_interests('She said she was happy'), {})
+        self.assertEqual(match_interests('Is this app any good? AI!'), {'technology': 'app'})
+
+    def test_first_keyword_in_text_order(self):
+        self.assertEqual(
+            match_interests('My Budget for the trip, then some Python'),
+            {'finance': 'budget', 'travel': 'trip', 'technology': 'python'},
+        )
+
+    def test_phrases(self):
+        self.assertEqual(match_interests('Is MACHINE learning hard?'), {'technology': 'machine learning'})
+        self.assertEqual(match_interests('data on mental health'), {'technology': 'data', 'health': 'mental health'})
+        # A phrase is ordered by where it starts, ahead of a later single word
+        self.assertEqual(match_interests('machine learning and code'), {'technology': 'machine learning'})
+
+    def test_phrase_split_by_punctuation_does_not_match(self):
+        self.assertEqual(match_interests('the machine, learning slowly'), {})
+        self.assertEqual(match_interests('machine_learning'), {})
+
+    def test_non_ascii_text(self):
+        self.assertEqual(match_interests('Café recipe for the naïve chef'), {'food': 'recipe'})
+        self.assertEqual(match_interests('Ünïcode around the cloud'), {'technology': 'cloud'})
+        self.assertEqual(match_interests('Straße ohne Flight'), {'travel': 'flight'})
@@ -1,12 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    from . import async_views as chat_views
+else:
+    chat_views = views
+
 urlpatterns = [
     path('auth/send-code/', views.send_code),
+    path('auth/send-code/<str:job_id>/', views.send_code_status),
     path('auth/verify-code/', views.verify_code),
-    path('chats/', views.chats),
-    path('chats/<str:chat_id>/', views.chat_detail),
-    path('chats/<str:chat_id>/send/', views.chat_send),
-    path('chats/<str:chat_id>/feedback/', views.chat_feedback),
-    path('chats/<str:chat_id>/ads/', views.chat_ads),
+    path('chats/', chat_views.chats),
+    path('chats/<str:chat_id>/', chat_views.chat_detail),
+    path('chats/<str:chat_id>/send/', chat_views.chat_send),
+    path('chats/<str:chat_id>/feedback/', chat_views.chat_feedback),
+    path('chats/<str:chat_id>/ads/', chat_views.chat_ads),
+    path('chats/<str:chat_id>/stream/<str:gen_id>/', chat_views.chat_stream),
+    path('metrics/', views.metrics),
 ]
@@ -1,11 +1,17 @@
 import json
+import logging
+from django.conf import settings
 from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from .services import storage, user_profile, email as email_service
-from .services.ads import get_thrad_ad
+from .services import codec, context, fill_rate, outbox, storage, timing, user_profile, email as email_service
+from .services.ads import get_thrad_ad, submit_thrad_ad
 from .services.claude import stream_response
 from .prompts import build_system_prompt
+from .streaming import coalesce
+from . import generation
+
+logger = logging.getLogger(__name__)
 
 
 def _get_auth_user(request):
@@ -13,7 +19,7 @@ def _get_auth_user(request):
     token = request.headers.get('X-Auth-Token', '')
     if not token:
         return None
-    return storage.get_user_by_token(token)
+    return request.storage.get_user_by_token(token)
 
 
 def _json_body(request):
@@ -24,6 +30,52 @@ def _json_body(request):
         return {}
 
 
+def _turn_number(body: dict) -> int:
+    """The request's turn_number as an int, 0 if absent or null.
+
+    Raises ValueError if it is not an integer.
+    """
+    value = body.get('turn_number')
+    if value is None:
+        return 0
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError(f'Invalid turn_number: {value!r}') from None
+
+
+def _ad_event(future, timeout=None) -> dict:
+    """Event carrying the result of a background ad request (null on failure)."""
+    try:
+        ad = future.result(timeout=timeout)
+    except Exception:
+        logger.warning('Inline ad was not ready in time or failed', exc_info=True)
+        ad = None
+    return {'ad': ad}
+
+
+def _flush_generation(session, gen):
+    """Write a generation's new events (and anything else queued) to Redis."""
+    offset = gen.queue_flush(session)
+    try:
+        session.flush()
+    except Exception:
+        # Tailers in this process still see every event, and the next
+        # flush sends these again
+        logger.warning('Could not buffer generation %s', gen.key, exc_info=True)
+        return
+    gen.flushed(offset)
+
+
+def _refresh_summary(session, chat):
+    """Fold turns that left the LLM window into the chat's rolling summary."""
+    try:
+        session.set_chat_summary(chat['id'], *context.summarize_older(chat))
+        session.flush()
+    except Exception:
+        logger.warning('Could not summarize chat %s', chat['id'], exc_info=True)
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def send_code(request):
@@ -32,6 +84,19 @@ def send_code(request):
     if not email:
         return JsonResponse({'error': 'Email is required'}, status=400)
 
+    if settings.EMAIL_OUTBOX:
+        try:
+            job = outbox.queue_verification_email(email)
+        except Exception:
+            logger.exception('Could not queue verification email')
+            return JsonResponse({'error': 'Failed to send verification email'}, status=500)
+        return JsonResponse({
+            'message': 'Verification code sent',
+            'email': email,
+            'job_id': job['id'],
+            'status': job['status'],
+        })
+
     code = storage.create_verification_code(email)
     try:
         email_service.send_verification_code(email, code)
@@ -42,6 +107,15 @@ def send_code(request):
     return JsonResponse({'message': 'Verification code sent', 'email': email})
 
 
+@require_http_methods(['GET'])
+def send_code_status(request, job_id):
+    """Delivery status of a queued verification email (EMAIL_OUTBOX)."""
+    status = outbox.get_status(job_id)
+    if status is None:
+        return JsonResponse({'error': 'Unknown or expired job'}, status=404)
+    return JsonResponse(status)
+
+
 @csrf_exempt
 @require_http_methods(['POST'])
 def verify_code(request):
@@ -72,8 +146,15 @@ def chats(request):
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
     if request.method == 'GET':
-        chat_list = storage.list_user_chats(user['email'])
-        return JsonResponse({'chats': chat_list})
+        try:
+            limit = int(request.GET.get('limit', storage.CHAT_PAGE_SIZE))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit'}, status=400)
+        limit = max(1, min(limit, storage.MAX_CHAT_PAGE_SIZE))
+        chat_list, next_cursor = storage.list_user_chats(
+            user['email'], limit=limit, cursor=request.GET.get('cursor'),
+        )
+        return JsonResponse({'chats': chat_list, 'next_cursor': next_cursor})
 
     # POST — create new chat
     body = _json_body(request)
@@ -92,7 +173,7 @@ def chat_detail(request, chat_id):
     if not user:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
-    chat = storage.get_chat(chat_id)
+    chat = request.storage.get_chat(chat_id)
     if not chat:
         return JsonResponse({'error': 'Chat not found'}, status=404)
     if chat['user_email'] != user['email']:
@@ -108,7 +189,8 @@ def chat_send(request, chat_id):
     if not user:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
-    chat = storage.get_chat(chat_id)
+    session = request.storage
+    chat = session.get_chat(chat_id)
     if not chat:
         return JsonResponse({'error': 'Chat not found'}, status=404)
     if chat['user_email'] != user['email']:
@@ -118,46 +200,82 @@ def chat_send(request, chat_id):
     message = body.get('message', '').strip()
     if not message:
         return JsonResponse({'error': 'Message is required'}, status=400)
+    try:
+        turn_number = _turn_number(body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid turn_number'}, status=400)
 
     # Save user message
-    user_msg = storage.add_message(chat_id, 'user', message)
+    user_msg = session.add_message(chat_id, 'user', message)
 
-    # Update user profile interests (still useful for analytics)
-    profile = user_profile.update_interests(user['email'], message)
+    # Update user profile interests (still useful for analytics); buffered,
+    # so it costs no Redis round trip here
+    user_profile.update_interests(user['email'], message, session=session)
 
     # Build system prompt (no ad injection — ads are separate cards now)
     system_prompt = build_system_prompt()
 
-    # Get updated chat messages for Claude context
-    chat = storage.get_chat(chat_id)
-    messages = [
-        {'role': m['role'], 'content': m['content']}
-        for m in chat['messages']
-    ]
+    # The session's chat already includes the new user message; send only
+    # the recent turns that fit the context budget
+    messages = context.llm_window(chat)
 
-    def event_stream():
+    # Opt-in: send the ad in-stream, saving the client a separate round trip
+    # to the ads endpoint. The bid goes out once the reply is stored, so the
+    # SSP sees it; on a chat's first turn (only the user message so far) the
+    # stream carries a null ad instead and the client asks /ads/ after the
+    # reply, as get_thrad_ad needs a user and an assistant turn
+    inline_ad = bool(body.get('inline_ad'))
+    first_turn = len(chat['messages']) < 2
+    turn_number = turn_number or sum(1 for m in chat['messages'] if m['role'] == 'assistant') + 1
+
+    # The reply is generated on a worker that outlives this response, so a
+    # client that drops can resume it from the buffer (chat/generation.py)
+    gen = generation.Generation(chat_id)
+
+    def generate():
         full_response = []
         try:
-            for chunk in stream_response(messages, system_prompt):
+            # Deltas are batched into fewer, larger frames (see chat/streaming.py)
+            for chunk in coalesce(stream_response(messages, system_prompt), heartbeat=0):
                 full_response.append(chunk)
-                data = json.dumps({'chunk': chunk})
-                yield f'data: {data}\n\n'
-
-            # Save complete assistant response
+                gen.append({'chunk': chunk})
+                if gen.flush_due():
+                    _flush_generation(session, gen)
+
+            # Store the reply (with any events not yet buffered) before
+            # 'done' is appended, so neither a tailer nor a resume sees
+            # 'done' for a message that was never saved; if the write fails
+            # the generation ends with an error instead
             complete_text = ''.join(full_response)
-            assistant_msg = storage.add_message(chat_id, 'assistant', complete_text)
-
-            done_data = json.dumps({
-                'done': True,
-                'message_id': assistant_msg.get('id', ''),
-            })
-            yield f'data: {done_data}\n\n'
+            assistant_msg = session.add_message(chat_id, 'assistant', complete_text)
+            offset = gen.queue_flush(session)
+            session.flush()
+            gen.flushed(offset)
+            gen.append({'done': True, 'message_id': assistant_msg.get('id', '')})
+
+            if inline_ad and first_turn:
+                gen.append({'ad': None})
+            elif inline_ad:
+                ad_future = submit_thrad_ad(context.ad_window(chat), user['email'], chat_id, turn_number=turn_number)
+                gen.append(_ad_event(ad_future, timeout=settings.THRAD_INLINE_AD_WAIT_SECONDS))
         except Exception as e:
-            error_data = json.dumps({'error': str(e)})
-            yield f'data: {error_data}\n\n'
+            gen.append({'error': str(e)})
+        finally:
+            gen.finish()
+            _flush_generation(session, gen)
+
+        # After the reply is out, so it never delays the stream
+        if context.summary_due(chat):
+            _refresh_summary(session, chat)
+
+    # The generation event goes out with the user message
+    offset = gen.queue_flush(session)
+    session.flush()
+    gen.flushed(offset)
+    generation.start(gen, generate)
 
     response = StreamingHttpResponse(
-        event_stream(),
+        generation.tail(gen.key, gen=gen),
         content_type='text/event-stream',
     )
     response['Cache-Control'] = 'no-cache'
@@ -166,17 +284,48 @@ def chat_send(request, chat_id):
 
 
 @csrf_exempt
-@require_http_methods(['POST'])
-def chat_feedback(request, chat_id):
+@require_http_methods(['GET'])
+def chat_stream(request, chat_id, gen_id):
+    """Replay a reply generation from event ?from=N, then follow it live."""
     user = _get_auth_user(request)
     if not user:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
+    try:
+        offset = max(0, int(request.GET.get('from', 0)))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid offset'}, status=400)
+
+    owner = storage.generation_owner(chat_id, gen_id)
+    if not owner:
+        return JsonResponse({'error': 'Generation not found'}, status=404)
+    if owner != user['email']:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
 
-    chat = storage.get_chat(chat_id)
-    if not chat:
+    response = StreamingHttpResponse(
+        generation.tail(storage.generation_key(chat_id, gen_id), offset),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _feedback_response(result: str) -> JsonResponse:
+    if result == 'chat_not_found':
         return JsonResponse({'error': 'Chat not found'}, status=404)
-    if chat['user_email'] != user['email']:
+    if result == 'forbidden':
         return JsonResponse({'error': 'Forbidden'}, status=403)
+    if result == 'message_not_found':
+        return JsonResponse({'error': 'Message not found'}, status=404)
+    return JsonResponse({'status': 'ok'})
+
+
+@csrf_exempt
+@require_http_methods(['POST'])
+def chat_feedback(request, chat_id):
+    user = _get_auth_user(request)
+    if not user:
+        return JsonResponse({'error': 'Unauthorized'}, status=401)
 
     body = _json_body(request)
     message_id = body.get('message_id', '')
@@ -185,8 +334,9 @@ def chat_feedback(request, chat_id):
     if not message_id or feedback not in ('like', 'dislike'):
         return JsonResponse({'error': 'Invalid feedback'}, status=400)
 
-    storage.update_message_feedback(chat_id, message_id, feedback)
-    return JsonResponse({'status': 'ok'})
+    # Checks ownership and stores the feedback in one round trip
+    result = storage.set_message_feedback(chat_id, message_id, feedback, user['email'])
+    return _feedback_response(result)
 
 
 @csrf_exempt
@@ -196,19 +346,25 @@ def chat_ads(request, chat_id):
     if not user:
         return JsonResponse({'error': 'Unauthorized'}, status=401)
 
-    chat = storage.get_chat(chat_id)
+    chat = request.storage.get_chat(chat_id)
     if not chat:
         return JsonResponse({'error': 'Chat not found'}, status=404)
     if chat['user_email'] != user['email']:
         return JsonResponse({'error': 'Forbidden'}, status=403)
 
-    body = _json_body(request)
-    turn_number = body.get('turn_number', 0)
-
-    messages = [
-        {'role': m['role'], 'content': m['content']}
-        for m in chat.get('messages', [])
-    ]
+    try:
+        turn_number = _turn_number(_json_body(request))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid turn_number'}, status=400)
 
-    ad = get_thrad_ad(messages, user['email'], chat_id, turn_number=turn_number)
+    ad = get_thrad_ad(context.ad_window(chat), user['email'], chat_id, turn_number=turn_number)
     return JsonResponse({'ad': ad})
+
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """Latency histograms for this process (spans and per-route totals), plus codec and ad fill stats."""
+    token = request.headers.get('X-Metrics-Token', '')
+    if not settings.DEBUG and not (settings.METRICS_TOKEN and token == settings.METRICS_TOKEN):
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse({'histograms': timing.metrics(), 'codec': codec.stats(), 'ad_fill': fill_rate.stats()})
@@ -0,0 +1,7 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# Under ASGI the chat endpoints use the async views (see chat/async_views.py)
+os.environ.setdefault('CHAT_ASYNC_VIEWS', 'True')
+application = get_asgi_application()
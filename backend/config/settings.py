@@ -1,10 +1,13 @@
 import os
 from pathlib import Path
-from dotenv import load_dotenv
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
-load_dotenv(BASE_DIR / '.env')
+# Local development reads backend/.env; deployments set real environment
+# variables and ship no .env, so they skip importing python-dotenv
+if (BASE_DIR / '.env').exists():
+    from dotenv import load_dotenv
+    load_dotenv(BASE_DIR / '.env')
 
 SECRET_KEY = os.getenv('SECRET_KEY', 'django-insecure-change-me')
 
@@ -18,17 +21,29 @@ ALLOWED_HOSTS = [
 if os.getenv('VERCEL_URL'):
     ALLOWED_HOSTS.append(os.getenv('VERCEL_URL'))
 
+# Only what the API needs is loaded by default, since every app and
+# middleware is imported on a serverless cold start. The views are plain
+# Django, so Django REST framework and staticfiles are opt-in
+# (OPTIONAL_APPS=rest_framework,django.contrib.staticfiles)
 INSTALLED_APPS = [
     'django.contrib.contenttypes',
-    'django.contrib.staticfiles',
     'corsheaders',
-    'rest_framework',
     'chat',
 ]
+INSTALLED_APPS += [app for app in os.getenv('OPTIONAL_APPS', '').split(',') if app]
+
+# Per-request timing spans (Server-Timing header / final SSE event) and the
+# histograms behind GET /api/metrics/, which needs DEBUG or an
+# X-Metrics-Token header matching METRICS_TOKEN. With TIMING_ENABLED=False
+# the middleware is left out entirely.
+TIMING_ENABLED = os.getenv('TIMING_ENABLED', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
+    *(['chat.middleware.TimingMiddleware'] if TIMING_ENABLED else []),
+    'chat.middleware.StorageSessionMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -47,6 +62,10 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
+
+# Serve the chat endpoints from chat/async_views.py (set by config/asgi.py)
+ASYNC_VIEWS = os.getenv('CHAT_ASYNC_VIEWS', 'False') == 'True'
 
 DATABASES = {}
 
@@ -81,15 +100,131 @@ DATA_DIR = BASE_DIR / 'data'
 # Redis / Vercel KV
 KV_REST_API_URL = os.getenv('KV_REST_API_URL', '')
 KV_REST_API_TOKEN = os.getenv('KV_REST_API_TOKEN', '')
+KV_TIMEOUT_SECONDS = float(os.getenv('KV_TIMEOUT_SECONDS', '10'))
+KV_POOL_MAXSIZE = int(os.getenv('KV_POOL_MAXSIZE', '20'))
+KV_KEEPALIVE_SECONDS = float(os.getenv('KV_KEEPALIVE_SECONDS', '60'))
+
+# Storage backend (chat/services/backends): 'upstash' (the KV settings above),
+# 'redis' (native protocol to REDIS_URL, pooled per the KV_ settings),
+# 'sqlite' (embedded file for single-node setups) or 'memory' (tests)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'upstash')
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+SQLITE_STORAGE_PATH = os.getenv('SQLITE_STORAGE_PATH', str(DATA_DIR / 'storage.sqlite3'))
+
+# Stored value encoding (chat/services/codec.py): 'v1' compresses values of
+# at least STORAGE_COMPRESS_MIN_BYTES of JSON (msgpack + zlib, or JSON + zlib
+# without msgpack); 'json' writes plain JSON only. Both are always readable
+STORAGE_CODEC = os.getenv('STORAGE_CODEC', 'v1')
+STORAGE_COMPRESS_MIN_BYTES = int(os.getenv('STORAGE_COMPRESS_MIN_BYTES', '512'))
+STORAGE_COMPRESS_LEVEL = int(os.getenv('STORAGE_COMPRESS_LEVEL', '6'))
+
+# Auth token cache (per process). Unknown tokens are cached for the shorter
+# negative TTL; with AUTH_TOKEN_INLINE_USER the user record is stored under
+# tokens:{token} so a cache miss costs one read instead of two
+AUTH_CACHE_TTL_SECONDS = float(os.getenv('AUTH_CACHE_TTL_SECONDS', '60'))
+AUTH_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('AUTH_CACHE_NEGATIVE_TTL_SECONDS', '10'))
+AUTH_CACHE_MAXSIZE = int(os.getenv('AUTH_CACHE_MAXSIZE', '10000'))
+AUTH_TOKEN_INLINE_USER = os.getenv('AUTH_TOKEN_INLINE_USER', 'False') == 'True'
 
 # OpenAI
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
+# Empty means the official API; set to point at a proxy or a local fake
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')
+# The client is shared process-wide; the timeout applies per read, so a
+# long stream is fine as long as tokens keep arriving
+OPENAI_TIMEOUT_SECONDS = float(os.getenv('OPENAI_TIMEOUT_SECONDS', '60'))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv('OPENAI_CONNECT_TIMEOUT_SECONDS', '5'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '2'))
+OPENAI_POOL_MAXSIZE = int(os.getenv('OPENAI_POOL_MAXSIZE', '20'))
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv('OPENAI_KEEPALIVE_SECONDS', '60'))
+
+# Conversation windows (estimated tokens, see chat/services/context.py)
+CHAT_LLM_CONTEXT_TOKENS = int(os.getenv('CHAT_LLM_CONTEXT_TOKENS', '6000'))
+THRAD_AD_CONTEXT_TOKENS = int(os.getenv('THRAD_AD_CONTEXT_TOKENS', '1500'))
+# Fold turns that fall out of the LLM window into a persisted rolling summary,
+# refreshed once at least CHAT_SUMMARY_MIN_MESSAGES new turns have dropped out
+CHAT_CONTEXT_SUMMARY = os.getenv('CHAT_CONTEXT_SUMMARY', 'False') == 'True'
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv('CHAT_SUMMARY_MIN_MESSAGES', '6'))
+CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('CHAT_SUMMARY_MAX_TOKENS', '300'))
+
+# SSE framing for chat_send: batch model deltas into one frame per window or
+# size limit (0 for both sends every delta), and send a comment heartbeat
+# after this many idle seconds (0 disables)
+SSE_COALESCE_MS = float(os.getenv('SSE_COALESCE_MS', '40'))
+SSE_COALESCE_BYTES = int(os.getenv('SSE_COALESCE_BYTES', '1024'))
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+
+# Interest profiles (chat/services/user_profile.py): by default updates are
+# written through with the request. With PROFILE_FLUSH_SECONDS > 0 they are
+# buffered in process and flushed that often, or once PROFILE_FLUSH_BATCH
+# users are waiting; beyond PROFILE_BUFFER_MAXSIZE users, updates are
+# dropped. Only for long-running servers: on serverless the flusher thread
+# and the exit hook may never run, and buffered updates are lost.
+PROFILE_FLUSH_SECONDS = float(os.getenv('PROFILE_FLUSH_SECONDS', '0'))
+PROFILE_FLUSH_BATCH = int(os.getenv('PROFILE_FLUSH_BATCH', '500'))
+PROFILE_BUFFER_MAXSIZE = int(os.getenv('PROFILE_BUFFER_MAXSIZE', '10000'))
+
+# Resumable replies (chat/generation.py): how long a reply's event buffer is
+# kept in Redis, how often new events are flushed to it, how often a resume
+# on another process polls it, and how long a resume waits without new
+# events before giving up
+GENERATION_TTL_SECONDS = int(os.getenv('GENERATION_TTL_SECONDS', '600'))
+GENERATION_FLUSH_MS = float(os.getenv('GENERATION_FLUSH_MS', '250'))
+GENERATION_POLL_MS = float(os.getenv('GENERATION_POLL_MS', '250'))
+GENERATION_STALL_SECONDS = float(os.getenv('GENERATION_STALL_SECONDS', '90'))
 
 # Brevo (email verification)
 BREVO_API_KEY = os.getenv('BREVO_API_KEY', '').strip()
 EMAIL_FROM_ADDRESS = os.getenv('EMAIL_FROM_ADDRESS', '').strip()
+BREVO_API_URL = os.getenv('BREVO_API_URL', 'https://api.brevo.com/v3/smtp/email')
+BREVO_TIMEOUT_SECONDS = float(os.getenv('BREVO_TIMEOUT_SECONDS', '10'))
+# Email outbox (chat/services/outbox.py): send_code queues the email and
+# returns, and `manage.py email_worker` sends up to EMAIL_BATCH_SIZE per
+# Brevo request, retrying with exponential backoff (EMAIL_RETRY_BASE_SECONDS
+# doubling up to EMAIL_RETRY_MAX_SECONDS) for EMAIL_MAX_ATTEMPTS attempts.
+# Off by default: something has to run the worker
+EMAIL_OUTBOX = os.getenv('EMAIL_OUTBOX', 'False') == 'True'
+EMAIL_BATCH_SIZE = int(os.getenv('EMAIL_BATCH_SIZE', '50'))
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '5'))
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', '2'))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv('EMAIL_RETRY_MAX_SECONDS', '60'))
+EMAIL_SEND_LEASE_SECONDS = float(os.getenv('EMAIL_SEND_LEASE_SECONDS', '60'))
+EMAIL_POLL_SECONDS = float(os.getenv('EMAIL_POLL_SECONDS', '1'))
+
+# Analytics export (chat/services/export.py, `manage.py export_analytics`):
+# keys per SCAN batch, and a cap on keys read per second so an export does
+# not crowd out live traffic (0 for no cap)
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '200'))
+EXPORT_KEYS_PER_SECOND = float(os.getenv('EXPORT_KEYS_PER_SECOND', '1000'))
 
 # Thrad SSP
 THRAD_API_KEY = os.getenv('THRAD_API_KEY', '').strip()
 THRAD_API_KEY_FALLBACK = os.getenv('THRAD_API_KEY_FALLBACK', '').strip()
 THRAD_CHATBOT_URL = os.getenv('THRAD_CHATBOT_URL', '')
+THRAD_SSP_URL = os.getenv('THRAD_SSP_URL', 'https://ssp.thrads.ai/api/v1/ssp/bid-request')
+THRAD_AD_WORKERS = int(os.getenv('THRAD_AD_WORKERS', '8'))
+# Total time an ad request may take across both keys, and how long the
+# primary key gets before a hedged request goes out on the fallback key
+THRAD_AD_BUDGET_SECONDS = float(os.getenv('THRAD_AD_BUDGET_SECONDS', '5'))
+THRAD_HEDGE_DELAY_SECONDS = float(os.getenv('THRAD_HEDGE_DELAY_SECONDS', '1'))
+# Per-key circuit breaker
+THRAD_BREAKER_WINDOW = int(os.getenv('THRAD_BREAKER_WINDOW', '20'))
+THRAD_BREAKER_MIN_CALLS = int(os.getenv('THRAD_BREAKER_MIN_CALLS', '5'))
+THRAD_BREAKER_FAILURE_RATE = float(os.getenv('THRAD_BREAKER_FAILURE_RATE', '0.5'))
+THRAD_BREAKER_OPEN_SECONDS = float(os.getenv('THRAD_BREAKER_OPEN_SECONDS', '30'))
+# Bid cache for unchanged conversations; the Redis tier shares it across processes
+THRAD_AD_CACHE_TTL_SECONDS = float(os.getenv('THRAD_AD_CACHE_TTL_SECONDS', '300'))
+# How long an SSP answer without a bid is cached (0 turns that off)
+THRAD_AD_NO_BID_TTL_SECONDS = float(os.getenv('THRAD_AD_NO_BID_TTL_SECONDS', '30'))
+THRAD_AD_CACHE_MAXSIZE = int(os.getenv('THRAD_AD_CACHE_MAXSIZE', '1024'))
+THRAD_AD_CACHE_REDIS = os.getenv('THRAD_AD_CACHE_REDIS', 'False') == 'True'
+# Fill-rate prediction (chat/services/fill_rate.py): skip the SSP call when
+# the estimated chance of a bid is below THRAD_FILL_THRESHOLD (0 never skips),
+# except for THRAD_FILL_EXPLORE_RATE of those calls, which go out anyway to
+# keep the estimate fresh. Counts are shared through Redis every
+# THRAD_FILL_SYNC_SECONDS
+THRAD_FILL_THRESHOLD = float(os.getenv('THRAD_FILL_THRESHOLD', '0.05'))
+THRAD_FILL_EXPLORE_RATE = float(os.getenv('THRAD_FILL_EXPLORE_RATE', '0.1'))
+THRAD_FILL_SYNC_SECONDS = float(os.getenv('THRAD_FILL_SYNC_SECONDS', '30'))
+# How long a send stream waits after 'done' for an inline ad before giving up
+THRAD_INLINE_AD_WAIT_SECONDS = float(os.getenv('THRAD_INLINE_AD_WAIT_SECONDS', '10'))
@@ -109,6 +109,27 @@ export default function ChatPage() {
       // Guard: ignore callbacks from a superseded stream (e.g. after strict-mode remount)
       const isStale = () => abortControllerRef.current !== abortController;
 
+      // Set once this stream's `done` has been handled; the inline ad arrives after it
+      let doneMessageId = "";
+
+      // Fallback for when the stream carried no ad: ask the ads endpoint
+      const fetchAd = (messageId: string) => {
+        getChat(chatId)
+          .then((chat) => {
+            const allMessages = (chat.messages || []).map((m: Message) => ({
+              role: m.role,
+              content: m.content,
+            }));
+            return fetchThradAd(allMessages, chatId);
+          })
+          .then((ad) => {
+            if (ad && messageId) {
+              setAds((prev) => ({ ...prev, [messageId]: ad }));
+            }
+          })
+          .catch(() => {});
+      };
+
       streamChat(
         chatId,
         message,
@@ -119,6 +140,7 @@ export default function ChatPage() {
         },
         (messageId) => {
           if (isStale()) return;
+          doneMessageId = messageId;
           isStreamingRef.current = false;
           setStreamingContent("");
           setIsStreaming(false);
@@ -142,23 +164,6 @@ export default function ChatPage() {
                 content: fullResponse,
               };
               setMessages((prev) => [...prev, assistantMsg]);
-            })
-            .finally(() => {
-              // Fetch ad after messages settle
-              getChat(chatId)
-                .then((chat) => {
-                  const allMessages = (chat.messages || []).map((m: Message) => ({
-                    role: m.role,
-                    content: m.content,
-                  }));
-                  return fetchThradAd(allMessages, chatId);
-                })
-                .then((ad) => {
-                  if (ad && messageId) {
-                    setAds((prev) => ({ ...prev, [messageId]: ad }));
-                  }
-                })
-                .catch(() => {});
             });
         },
         (error) => {
@@ -178,7 +183,15 @@ export default function ChatPage() {
           setStreamError(error);
           abortControllerRef.current = null;
         },
-        abortController.signal
+        abortController.signal,
+        (ad) => {
+          if (!doneMessageId) return;
+          if (ad) {
+            setAds((prev) => ({ ...prev, [doneMessageId]: ad }));
+          } else {
+            fetchAd(doneMessageId);
+          }
+        }
       );
     },
     [chatId, router]
@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef, type UIEvent } from "react";
 import { useRouter } from "next/navigation";
 import { listChats } from "@/lib/api";
 
@@ -19,14 +19,39 @@ interface SidebarProps {
 
 export default function Sidebar({ activeChatId, expanded, onToggle }: SidebarProps) {
   const [chats, setChats] = useState<Chat[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const loadingMore = useRef(false);
   const router = useRouter();
 
   useEffect(() => {
     listChats()
-      .then(setChats)
+      .then((page) => {
+        setChats(page.chats);
+        setNextCursor(page.nextCursor);
+      })
       .catch(() => {});
   }, [activeChatId]);
 
+  // Older chats are fetched a page at a time as the list is scrolled down
+  const loadMore = () => {
+    if (!nextCursor || loadingMore.current) return;
+    loadingMore.current = true;
+    listChats(nextCursor)
+      .then((page) => {
+        setChats((prev) => [...prev, ...page.chats.filter((c: Chat) => !prev.some((p) => p.id === c.id))]);
+        setNextCursor(page.nextCursor);
+      })
+      .catch(() => {})
+      .finally(() => {
+        loadingMore.current = false;
+      });
+  };
+
+  const handleScroll = (e: UIEvent<HTMLDivElement>) => {
+    const el = e.currentTarget;
+    if (el.scrollHeight - el.scrollTop - el.clientHeight < 200) loadMore();
+  };
+
   const handleNewChat = () => {
     router.push("/");
   };
@@ -133,7 +158,7 @@ export default function Sidebar({ activeChatId, expanded, onToggle }: SidebarPro
 
       {/* Recents */}
       {chats.length > 0 && (
-        <div className="mt-4 flex-1 overflow-y-auto">
+        <div className="mt-4 flex-1 overflow-y-auto" onScroll={handleScroll}>
           <div className="px-3 mb-1 text-[12px] uppercase text-[var(--color-text-secondary)] tracking-wider">
             Recents
           </div>
@@ -150,6 +175,14 @@ export default function Sidebar({ activeChatId, expanded, onToggle }: SidebarPro
               {chat.title}
             </button>
           ))}
+          {nextCursor && (
+            <button
+              onClick={loadMore}
+              className="w-full text-left px-3 py-1.5 text-[13px] text-[var(--color-text-secondary)] hover:text-[var(--color-text-primary)] transition-colors cursor-pointer"
+            >
+              Load more
+            </button>
+          )}
         </div>
       )}
     </div>
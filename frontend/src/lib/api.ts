@@ -25,11 +25,26 @@ async function apiFetch(path: string, options: RequestInit = {}) {
   return res.json();
 }
 
+const EMAIL_STATUS_POLL_MS = 500;
+const EMAIL_STATUS_WAIT_MS = 4000;
+
 export async function sendCode(email: string) {
-  return apiFetch('/auth/send-code/', {
+  const data = await apiFetch('/auth/send-code/', {
     method: 'POST',
     body: JSON.stringify({ email }),
   });
+  // With the backend's email outbox the email goes out in the background;
+  // wait briefly on its status so a failed send still shows as an error
+  if (data.job_id) {
+    const deadline = Date.now() + EMAIL_STATUS_WAIT_MS;
+    while (Date.now() < deadline) {
+      await new Promise((resolve) => setTimeout(resolve, EMAIL_STATUS_POLL_MS));
+      const job = await apiFetch(`/auth/send-code/${data.job_id}/`).catch(() => null);
+      if (job?.status === 'sent') break;
+      if (job?.status === 'failed') throw new Error('Failed to send verification email');
+    }
+  }
+  return data;
 }
 
 export async function verifyCode(email: string, code: string) {
@@ -43,9 +58,12 @@ export async function verifyCode(email: string, code: string) {
   return data;
 }
 
-export async function listChats() {
-  const data = await apiFetch('/chats/');
-  return data.chats;
+// One page of the user's chats, newest first; pass nextCursor back in for
+// the next page (it is null after the last one)
+export async function listChats(cursor?: string | null) {
+  const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+  const data = await apiFetch(`/chats/${query}`);
+  return { chats: data.chats, nextCursor: data.next_cursor ?? null };
 }
 
 export async function createChat(message: string) {
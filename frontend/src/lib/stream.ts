@@ -9,6 +9,10 @@ export interface AdData {
   image_url?: string;
 }
 
+// Reconnects to a reply whose stream dropped before it finished
+const MAX_RESUMES = 3;
+const RESUME_DELAY_MS = 500;
+
 export async function streamChat(
   chatId: string,
   message: string,
@@ -16,30 +20,25 @@ export async function streamChat(
   onDone: (messageId: string) => void,
   onError: (error: string) => void,
   signal?: AbortSignal,
+  onAd?: (ad: AdData | null) => void,
 ) {
   const token = getToken();
+  // With onAd the server bids for the ad once the reply is stored and sends
+  // it as an `ad` event; onAd fires once after `done` (null if no ad arrived,
+  // always on a chat's first turn)
+  let ad: AdData | null | undefined;
+  let doneSeen = false;
+  // The reply keeps generating server-side if the connection drops; resume
+  // it from the number of events already handled
+  let generationId = '';
+  let received = 0;
 
-  try {
-    const res = await fetch(`${API_URL}/api/chats/${chatId}/send/`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-        'X-Auth-Token': token,
-      },
-      body: JSON.stringify({ message }),
-      signal,
-    });
-
-    if (!res.ok) {
-      const data = await res.json().catch(() => ({}));
-      onError(data.error || `API error ${res.status}`);
-      return;
-    }
-
+  // Returns true once the reply is fully handled, false if the stream ended early
+  const readEvents = async (res: Response): Promise<boolean> => {
     const reader = res.body?.getReader();
     if (!reader) {
       onError('No response body');
-      return;
+      return true;
     }
 
     const decoder = new TextDecoder();
@@ -47,7 +46,10 @@ export async function streamChat(
 
     while (true) {
       const { done, value } = await reader.read();
-      if (done) break;
+      if (done) {
+        if (doneSeen && ad !== undefined) return true;
+        return false;
+      }
 
       buffer += decoder.decode(value, { stream: true });
 
@@ -60,23 +62,85 @@ export async function streamChat(
         const jsonStr = line.slice(6).trim();
         if (!jsonStr) continue;
 
+        let data;
         try {
-          const data = JSON.parse(jsonStr);
-          if (data.error) {
-            onError(data.error);
-            return;
-          }
-          if (data.done) {
-            onDone(data.message_id || '');
-            return;
+          data = JSON.parse(jsonStr);
+        } catch {
+          continue; // Skip malformed JSON
+        }
+        if (data.timing) continue;
+        received++;
+
+        if (data.generation) {
+          generationId = data.generation;
+          continue;
+        }
+        if (data.error) {
+          onError(data.error);
+          return true;
+        }
+        if (data.ad !== undefined) {
+          ad = data.ad;
+          if (doneSeen) {
+            onAd?.(ad ?? null);
+            return true;
           }
-          if (data.chunk) {
-            onChunk(data.chunk);
+        }
+        if (data.done) {
+          onDone(data.message_id || '');
+          if (!onAd) return true;
+          doneSeen = true;
+          if (ad !== undefined) {
+            onAd(ad);
+            return true;
           }
-        } catch {
-          // Skip malformed JSON
         }
+        if (data.chunk) {
+          onChunk(data.chunk);
+        }
+      }
+    }
+  };
+
+  try {
+    let res = await fetch(`${API_URL}/api/chats/${chatId}/send/`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'X-Auth-Token': token,
+      },
+      body: JSON.stringify({ message, inline_ad: !!onAd }),
+      signal,
+    });
+
+    for (let resumes = 0; ; resumes++) {
+      if (!res.ok) {
+        const data = await res.json().catch(() => ({}));
+        onError(data.error || `API error ${res.status}`);
+        return;
+      }
+
+      let finished = false;
+      let failure: unknown = null;
+      try {
+        finished = await readEvents(res);
+      } catch (err) {
+        if (signal?.aborted) throw err;
+        failure = err;
       }
+      if (finished) return;
+      if (!generationId || resumes >= MAX_RESUMES) {
+        if (failure) throw failure;
+        // Ended after `done` without an ad: nothing more is coming
+        if (doneSeen) onAd?.(ad ?? null);
+        return;
+      }
+
+      await new Promise((resolve) => setTimeout(resolve, RESUME_DELAY_MS * (resumes + 1)));
+      res = await fetch(
+        `${API_URL}/api/chats/${chatId}/stream/${generationId}/?from=${received}`,
+        { headers: { 'X-Auth-Token': token }, signal },
+      );
     }
   } catch (err) {
     if (signal?.aborted) {